@@ -0,0 +1,311 @@
+#Headless batch processing of many sessions, without file dialogs or prompts.
+#Sessions come either from a manifest (.csv or .json) with one row per session, or from a glob of workbooks sharing the
+#same parameters. Sessions are processed in a process pool, and a summary of every session is written to batch_summary.csv.
+#Results of each session are written to a columnar store (see ResultWriter.py) with an optional Excel summary, and figures
+#are rendered headless in the same worker as the session, so the figures of many sessions render in parallel.
+#Every session also gets a <name>_report.json with the time, CPU time, memory and rows of every stage (see Instrumentation.py).
+#
+#usage:
+#   python BatchRunner.py --glob "cohort/*.xlsx" --type pulsed --paradigm fear --workers 16
+#   python BatchRunner.py --manifest sessions.csv --workers 16
+#
+#manifest columns (only workbook is required, other columns default to the command line values):
+#   workbook, video, type, paradigm, behavior, events, animals, norm_method, lowpass, max_gap, part, outdir
+#   behavioral sessions can be read from the tracking software's files instead of a workbook with the columns
+#   behavior_file (DeepLabCut .h5/.csv or ezTrack .csv), events_file and ttl_file (.csv), in which case workbook is not needed
+#   events is a list of name=id pairs separated by ";", e.g. "id_trialStart=71;id_cueAversive=34"
+#   animals maps RWD fibers to animals in the same format, e.g. "1=M1;2=M1;3=M2;4=M2"
+import argparse
+import concurrent.futures
+import contextlib
+import glob
+import json
+import os
+import time
+import traceback
+import pandas as pd
+import BehaviorStruct
+import EventConfig
+import Instrumentation
+import PhotometryStruct
+import Plotting
+import ResultWriter
+import VideoMetadata
+from main import pulsed_events, openField_events, fearConditioning_events, pavlov_events, LICK_WINDOWS
+
+RECORDING_TYPES = ["continuous", "pulsed", "brainmata", "behavior-only"]
+PARADIGMS = ["none", "tonic", "pavlovian", "fear"]
+BEHAVIOR_TYPES = ["deeplabcut", "eztrack", "none"]
+
+#default part to align for each behavioral data type, as used by main.py
+DEFAULT_PARTS = {"deeplabcut": "Back1_Vel", "ezt_freezing": "Freezing", "ezt_location": "Distance_px"}
+
+logger = Instrumentation.getLogger("batch")
+
+
+#builds the events dictionary for a session the same way main.py does, then applies explicit overrides
+def sessionEvents(type, paradigm, behavior, overrides):
+    events = {}
+    if type == "pulsed":
+        events.update(pulsed_events)
+    if paradigm in ["none", "tonic"]:
+        events.update(openField_events)
+    elif paradigm == "pavlovian":
+        events.update(pavlov_events)
+        if type == "brainmata" and behavior == "deeplabcut":
+            #event dataframe indexing is different with brainmata recordings
+            events = {"id_trialStart": "TONE_timestamp", "id_cueReward": "Reward Cue_timestamp", "id_cueNeutral": "Neutral Cue_timestamp"}
+    elif paradigm == "fear":
+        events.update(fearConditioning_events)
+    events.update(overrides)
+    return events
+
+
+#returns a list of session dictionaries from a manifest file, or from a glob of workbooks, filling in defaults from args
+def collectSessions(args):
+    rows = []
+    if args.manifest is not None:
+        if args.manifest.lower().endswith(".json"):
+            with open(args.manifest) as f:
+                rows = json.load(f)
+        else:
+            rows = pd.read_csv(args.manifest, dtype=str).to_dict("records")
+    if args.glob is not None:
+        for fpath in sorted(glob.glob(args.glob)):
+            rows.append({"workbook": fpath})
+
+    sessions = []
+    for row in rows:
+        row = {k: v for k, v in row.items() if not (isinstance(v, float) and pd.isna(v))}
+        if row.get("workbook") is None and row.get("behavior_file") is None:
+            raise ValueError("Every session needs a workbook or a behavior_file: " + str(row))
+        session = {"workbook": row.get("workbook"),
+                   "behaviorFile": row.get("behavior_file"),
+                   "eventsFile": row.get("events_file"),
+                   "ttlFile": row.get("ttl_file"),
+                   "video": row.get("video"),
+                   "type": row.get("type", args.type),
+                   "paradigm": row.get("paradigm", args.paradigm),
+                   "behavior": row.get("behavior", args.behavior),
+                   "part": row.get("part", args.part),
+                   "normMethod": row.get("norm_method", args.norm_method),
+                   "lowpass": float(row["lowpass"]) if row.get("lowpass") is not None else args.lowpass,
+                   "maxGap": int(row.get("max_gap", args.max_gap)),
+                   "outdir": row.get("outdir", args.out),
+                   "useCache": not args.no_cache,
+                   "backend": args.backend,
+                   "excelSummary": not args.no_excel,
+                   "plots": not args.no_plots,
+                   "logLevel": args.log_level,
+                   "traceMemory": args.trace_memory,
+                   "profile": args.profile}
+        #look for a video with the same name as the workbook if none was given
+        if session["video"] is None and session["type"] in ["brainmata", "behavior-only"]:
+            candidate = os.path.splitext(sessionSource(session))[0] + args.video_ext
+            if os.path.exists(candidate):
+                session["video"] = candidate
+        overrides = EventConfig.parseEvents(args.event and ";".join(args.event))
+        overrides.update(EventConfig.parseEvents(row.get("events")))
+        session["events"] = sessionEvents(session["type"], session["paradigm"], session["behavior"], overrides)
+        animals = EventConfig.parseEvents(row.get("animals", args.animal_map))
+        session["animalMap"] = {int(k): v for k, v in animals.items()} if len(animals) > 0 else None
+        sessions.append(session)
+    return sessions
+
+
+#the file a session is read from, which names its outputs
+def sessionSource(session):
+    return session["workbook"] if session.get("workbook") is not None else session["behaviorFile"]
+
+
+#returns a result writer for a session, writing to <outdir>/<name>_results
+def resultWriter(session, name, outdir):
+    return ResultWriter.ResultWriter(outdir, name, backend=session["backend"], excelSummary=session["excelSummary"],
+                                     metadata={"workbook": session["workbook"], "behaviorFile": session.get("behaviorFile"),
+                                               "video": session["video"]})
+
+
+def runPhotometry(session, name, outdir):
+    channel1 = PhotometryStruct.PhotometryData(type=session["type"], id_eventsDict=session["events"], useCache=session["useCache"],
+                                               animalMap=session["animalMap"])
+    channel1.readData(session["workbook"])
+    channel1.clean()
+    if session["lowpass"] is not None:
+        channel1.filterSignals(lowpass=session["lowpass"])
+    channel1.normalize(method=session["normMethod"])
+    if session["type"] == "pulsed":
+        channel1.binData()
+    if channel1.timestamp_data is not None and "id_trialStart" in session["events"]:
+        channel1.alignEvents()
+
+    with resultWriter(session, name, outdir) as results:
+        results.writePhotometry(channel1)
+        #save each animal of multi-animal recordings separately
+        if channel1.numAnimals > 1:
+            binned = channel1.splitByAnimal(binned=True) if channel1.pt_binned is not None else {}
+            for animal, data in channel1.splitByAnimal().items():
+                results.writeFrame(str(animal) + "_cleaned", data)
+                results.writeFrame(str(animal) + "_binned", binned.get(animal), summary=True)
+
+    if session["plots"]:
+        pairs = channel1.channelPairs
+        figures = [("photometryFigure", {"cleaned": channel1.pt_cleaned, "pairs": pairs, "binned": channel1.pt_binned,
+                                         "dest": os.path.join(outdir, name + "_Signal.png")}),
+                   ("scatterFigure", {"cleaned": channel1.pt_cleaned, "x": pairs.isosbestic.iloc[0], "y": pairs.signal.iloc[0],
+                                      "dest": os.path.join(outdir, name + "_Scatter.png")})]
+        for key, value in channel1.pt_alignedEvents.items():
+            figures.append(("eventsFigure", {"events": {key: value}, "ylabel": "f/f", "dest": os.path.join(outdir, name + "_" + key + ".png")}))
+        Plotting.renderFigures(figures, workers=1)
+    return len(channel1.pt_raw)
+
+
+def runBehavior(session, name, outdir):
+    beh_struct = BehaviorStruct.BehaviorData(type=session["behavior"], id_eventsDict=session["events"],
+                                             videoPath=session["video"], useCache=session["useCache"], maxGap=session["maxGap"])
+    if session.get("behaviorFile") is not None:
+        beh_struct.readFiles(session["behaviorFile"], session.get("eventsFile"), session.get("ttlFile"))
+    else:
+        beh_struct.readData(session["workbook"])
+    beh_struct.clean()
+    if beh_struct.beh_cleaned is None:
+        raise RuntimeError("Behavioral data could not be cleaned. Was a video file found for this session?")
+
+    if session["type"] == "brainmata" and beh_struct.type == "deeplabcut":
+        beh_struct.booleanEvent(part="Tongue_x")
+        beh_struct.alignEvents(part="Tongue_x_bool", baseline=5, outcome=10)
+        beh_struct.annotatePerievent(LICK_WINDOWS)
+    else:
+        part = session["part"] or DEFAULT_PARTS.get(beh_struct.type)
+        if beh_struct.type == "deeplabcut":
+            beh_struct.alignEvents(part=part, baseline=10, outcome=10)
+        else:
+            beh_struct.alignEvents(part=part, baseline=5, outcome=10)
+
+    with resultWriter(session, name, outdir) as results:
+        results.writeBehavior(beh_struct)
+
+    if session["plots"] and len(beh_struct.beh_alignedEvents) > 0:
+        Plotting.renderFigures([("eventsFigure", {"events": beh_struct.beh_alignedEvents, "title": beh_struct.type,
+                                                  "dest": os.path.join(outdir, name + "_Aligned.png")})], workers=1)
+    return len(beh_struct.beh_data)
+
+
+#Processes a single session. Output of the pipeline is written to <outdir>/<name>.log and the run report of every stage to
+#<outdir>/<name>_report.json (and a cProfile dump to <outdir>/<name>.prof if session["profile"] is set)
+#Returns a dictionary describing the outcome, which never raises so that one bad session does not stop the batch
+def runSession(session):
+    name = os.path.splitext(os.path.basename(sessionSource(session)))[0]
+    outdir = session["outdir"] or os.path.dirname(os.path.abspath(sessionSource(session)))
+    result = {"workbook": sessionSource(session), "status": "ok", "seconds": 0.0, "rows": 0, "rows_per_second": 0.0,
+              "slowest_stage": "", "error": ""}
+    start = time.perf_counter()
+    report = Instrumentation.RunReport(name, traceMemory=session.get("traceMemory", False),
+                                       profile=os.path.join(outdir, name + ".prof") if session.get("profile") else None,
+                                       metadata={"session": session})
+    try:
+        os.makedirs(outdir, exist_ok=True)
+        with open(os.path.join(outdir, name + ".log"), "w") as log, contextlib.redirect_stdout(log):
+            Instrumentation.configureLogging(session.get("logLevel", "INFO"), stream=log)
+            logger.info("Session: %s", json.dumps(session, default=str))
+            with report:
+                if session["type"] in ["continuous", "pulsed"]:
+                    result["rows"] = runPhotometry(session, name, outdir)
+                elif session["type"] in ["brainmata", "behavior-only"] and session["behavior"] != "none":
+                    result["rows"] = runBehavior(session, name, outdir)
+                else:
+                    raise ValueError("Nothing to process for recording type " + str(session["type"]) + " with behavior " + str(session["behavior"]))
+            report.log()
+    except Exception as e:
+        result["status"] = "failed"
+        result["error"] = repr(e)
+        result["traceback"] = traceback.format_exc()
+    finally:
+        Instrumentation.configureLogging(session.get("logLevel", "INFO"))
+    result["slowest_stage"] = report.slowestStage() or ""
+    try:
+        report.write(os.path.join(outdir, name + "_report.json"))
+    except OSError:
+        pass
+    result["seconds"] = time.perf_counter() - start
+    if result["seconds"] > 0:
+        result["rows_per_second"] = result["rows"] / result["seconds"]
+    return result
+
+
+#runs every session in a pool of workers, printing progress as sessions finish. Returns a dataframe with one row per session
+def runBatch(sessions, workers = None):
+    results = []
+    start = time.perf_counter()
+    #sessions render their figures in their own worker, which has no display
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=Plotting.setHeadless) as pool:
+        futures = [pool.submit(runSession, session) for session in sessions]
+        for future in concurrent.futures.as_completed(futures):
+            result = future.result()
+            results.append(result)
+            logger.info("[%d/%d] %-6s %7.1f s  %s", len(results), len(sessions), result["status"], result["seconds"], result["workbook"])
+            if result["status"] != "ok":
+                logger.error("     %s", result["error"])
+    elapsed = time.perf_counter() - start
+
+    summary = pd.DataFrame(results)
+    failed = summary[summary.status != "ok"] if len(summary) > 0 else summary
+    logger.info("\nProcessed %d of %d session(s) in %.1f s", len(summary) - len(failed), len(summary), elapsed)
+    if len(summary) > 0:
+        logger.info("Throughput: %.2f sessions/minute, %.1f s per session on average", len(summary) / elapsed * 60, summary.seconds.mean())
+        logger.info("Slowest stage: %s", summary.slowest_stage.value_counts().to_dict())
+    for workbook in failed.get("workbook", []):
+        logger.error("Failed: %s", workbook)
+    return summary
+
+
+def parseArgs(argv = None):
+    parser = argparse.ArgumentParser(description="Process many photometry/behavior sessions without user interaction.")
+    parser.add_argument("--manifest", help="csv or json file with one session per row")
+    parser.add_argument("--glob", help="glob of .xlsx workbooks which share the parameters given on the command line")
+    parser.add_argument("--type", choices=RECORDING_TYPES, default="pulsed", help="recording type (default pulsed)")
+    parser.add_argument("--paradigm", choices=PARADIGMS, default="none", help="paradigm (default none)")
+    parser.add_argument("--behavior", choices=BEHAVIOR_TYPES, default="deeplabcut", help="behavioral recording type (default deeplabcut)")
+    parser.add_argument("--event", action="append", help="event id override as name=id, can be repeated")
+    parser.add_argument("--animal-map", help="fiber to animal mapping for multi-animal RWD recordings, e.g. \"1=M1;2=M1;3=M2\"")
+    parser.add_argument("--norm-method", choices=["endpoints", "ols", "irls", "sliding"], default="endpoints",
+                        help="photometry normalization method (default endpoints)")
+    parser.add_argument("--lowpass", type=float, help="low-pass filter raw photometry channels at this cutoff in Hz before normalizing")
+    parser.add_argument("--part", help="behavioral part to align to events (default depends on the behavioral data type)")
+    parser.add_argument("--max-gap", type=int, default=0,
+                        help="interpolate DeepLabCut gaps of at most this many low-likelihood frames (default 0, no interpolation)")
+    parser.add_argument("--video-ext", default=".avi", help="extension of videos found next to each workbook (default .avi)")
+    parser.add_argument("--out", help="output directory (default is the directory of each workbook)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="number of worker processes (default all cores)")
+    parser.add_argument("--no-cache", action="store_true", help="do not use the parsed workbook cache")
+    parser.add_argument("--backend", choices=["parquet", "hdf5"], default="parquet", help="format of the result store (default parquet)")
+    parser.add_argument("--no-excel", action="store_true", help="do not write the Excel summary of each session")
+    parser.add_argument("--no-plots", action="store_true", help="do not render figures")
+    parser.add_argument("--log-level", choices=["DEBUG", "INFO", "WARNING", "ERROR"], default="INFO", help="level of messages (default INFO)")
+    parser.add_argument("--trace-memory", action="store_true", help="measure the peak memory of every stage with tracemalloc (slower)")
+    parser.add_argument("--profile", action="store_true", help="write a cProfile dump of every session to <name>.prof")
+    args = parser.parse_args(argv)
+    if args.manifest is None and args.glob is None:
+        parser.error("one of --manifest or --glob is required")
+    return args
+
+
+def main(argv = None):
+    args = parseArgs(argv)
+    Instrumentation.configureLogging(args.log_level)
+    sessions = collectSessions(args)
+    logger.info("Found %d session(s), processing with %d worker(s)...", len(sessions), args.workers)
+    #probe every video up front so that sessions read their video metadata from the sidecars
+    videos = [s["video"] for s in sessions if s["video"] is not None]
+    if len(videos) > 0 and not args.no_cache:
+        probed = VideoMetadata.probeVideos(videos, workers=args.workers)
+        logger.info("Read the metadata of %d of %d video(s)", len(probed), len(set(videos)))
+    summary = runBatch(sessions, args.workers)
+    dest = os.path.join(args.out or os.getcwd(), "batch_summary.csv")
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    summary.drop(columns=["traceback"], errors="ignore").to_csv(dest, index=False)
+    logger.info("Summary written to %s", dest)
+    return 0 if (summary.status == "ok").all() else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,14 +1,27 @@
+import os
 import numpy as np
 import pandas as pd
 import openpyxl
 import math
-import cv2
+import VelocityEngine
+import EventAlignment
+import EventIndex
+import ClockSync
+import SessionCache
+import Instrumentation
+import VideoMetadata
+import PoseData
+import SignalProcessing
+
+logger = Instrumentation.getLogger("behavior")
 
 class BehaviorData:
-    def __init__(self, type = "deeplabcut", id_eventsDict = {}, mpcDF = None, behaviorData = None, threshold = 0.6, videoPath = None):
+    def __init__(self, type = "deeplabcut", id_eventsDict = {}, mpcDF = None, behaviorData = None, threshold = 0.6, videoPath = None, useCache = True, maxGap = 0):
         #dataframes
         #event timestamps, either from MedPc or BrainMata control software
         self.timestamp_data = mpcDF
+        #sorted times of every Med-Pc ID or BrainMata event column, see eventIndex()
+        self.timestamp_index = None
         self.beh_data = behaviorData
         #timstamps of TTLs from video recording software, to align with
         self.beh_TTL = None
@@ -18,195 +31,210 @@ class BehaviorData:
         #events
         self.id_events = id_eventsDict
         self.beh_alignedEvents = {}
+        #(trials x samples x signals) arrays behind beh_alignedEvents, see EventAlignment.AlignedTrials
+        self.beh_alignedTrials = {}
+        #per-trial results of annotatePerievent, one row per window and trial
+        self.beh_annotations = None
 
         #labeling confidence threshold for DLC data types
         self.threshold = threshold
+        #gaps of at most maxGap frames below the threshold are linearly interpolated (0 leaves them as nan)
+        self.maxGap = maxGap
+        #DLC positions as a (frames x parts x [x, y, likelihood]) array after thresholding and interpolation, see pose()
+        self.beh_pose = None
+        self.bodyParts = []
 
         #fps and path to .avi file
         self.videoPath = videoPath
         self.fps = None
         self.trueFrames = None
         self.videoLength = None
+        #presentation time of every video frame in seconds, see VideoMetadata.VideoInfo
+        self.frameTimes = None
 
         #type
         self.type = type
         self.control_type = None
 
+        #whether parsed excel sheets are stored in (and loaded from) the session cache
+        self.useCache = useCache
+
 
     #Given an eventID int, part name string, baseline interval int, and outcome int.
     #Align trace of data to closest trialstart TTL timestamp and apply the pre-calculated offset compared to MED-Pc timestamp.
     #This function should be theorhetically recording FPS agnostic, as it locates closest rows in dataframe based on the time, not by frame index.
-    def processEvent(self, eventID, part, baseline, outcome):
+    #If eventName is given, the (trials x samples x signals) array is also stored in beh_alignedTrials
+    def processEvent(self, eventID, part, baseline, outcome, eventName = None):
         # get the timestamps for each event with passed ID
-        events = self.getEventTimes(eventID)
-        df = pd.DataFrame()
-
-        for y in range(len(events)):
-            # find closest DLC-TTL event to behavioral event
-            # these are the trail start TTls - they should be approximate to each event
-            closest = self.beh_TTL['onset'].sub(events[y]).abs().idxmin()
-            closestON = self.beh_TTL.at[closest, 'onset']
-            offset = self.beh_TTL.at[closest, 'offset_MPC']
-            tMin = (closestON + offset) - baseline
-            tMax = (closestON + offset) + outcome
-
-            #find closest timepoints in DLC data to start and stop times
-            min = self.beh_cleaned['Time'].sub(tMin).abs().idxmin()
-            max = self.beh_cleaned['Time'].sub(tMax).abs().idxmin()
-
-            #write exact time interval to behavioral TTL dataframe
-            self.beh_TTL.at[closest, 'interval_min_sec'] = self.beh_cleaned.at[min, 'Time']
-            self.beh_TTL.at[closest, 'interval_max_sec'] = self.beh_cleaned.at[max, 'Time']
-
-            trace = self.beh_cleaned.iloc[min:max][part]
-            trace.reset_index(drop=True, inplace=True)
-            df[y] = trace
-
-        #take SD
-        df['SD'] = df.std(axis=1, skipna=True)
-        #take row average
-        df['Average'] = df.mean(axis=1, skipna=True)
-        mov = np.convolve(df['Average'], np.ones(10), 'valid') / 10
-        # first 5 and last 5 samples cannot be calculated, so pad array so that dimensions fit with existing data
-        mov = np.concatenate([[np.nan, np.nan, np.nan, np.nan, np.nan], mov, [np.nan, np.nan, np.nan, np.nan]])
-        df['Average'] = mov
-        #reindex dataframe so times are event centric
-        time = np.linspace(0 - baseline, 0 + outcome, df.shape[0])
-        df['Time'] = time
-        df.set_index('Time')
-        return df
+        events = np.asarray(self.getEventTimes(eventID), dtype=float)
+
+        # find closest DLC-TTL event to every behavioral event
+        # these are the trail start TTls - they should be approximate to each event
+        onsets = self.beh_TTL['onset'].to_numpy(dtype=float)
+        order = np.argsort(onsets, kind="stable")
+        closest = order[EventAlignment.nearestIndex(onsets[order], events)]
+        centers = onsets[closest] + self.beh_TTL['offset_MPC'].to_numpy(dtype=float)[closest]
+
+        #cut every trial at once, using the closest timepoints in DLC data to each point of the event-centric time axis
+        time = self.beh_cleaned['Time'].to_numpy(dtype=float)
+        aligned = EventAlignment.alignTrials(time, self.beh_cleaned[[part]], centers, baseline, outcome, rate=self.fps)
+        if eventName is not None:
+            self.beh_alignedTrials[eventName] = aligned
+
+        #write exact time interval to behavioral TTL dataframe
+        labels = self.beh_TTL.index[closest]
+        self.beh_TTL.loc[labels, 'interval_min_sec'] = time[EventAlignment.nearestIndex(time, centers - baseline)]
+        self.beh_TTL.loc[labels, 'interval_max_sec'] = time[EventAlignment.nearestIndex(time, centers + outcome)]
+
+        #take SD and row average, with times that are event centric
+        return EventAlignment.trialsFrame(aligned, part)
 
 
+    #sorted, read-only array of the times of a Med-Pc ID or BrainMata event column
     def getEventTimes(self, timestampID):
-        if self.timestamp_data is not None:
-            if self.control_type == 'medpc':
-                tmp = self.timestamp_data[self.timestamp_data.ID == timestampID].secs
-                return tmp.values
-            if self.control_type == 'brainmata':
-                print(timestampID)
-                tmp = self.timestamp_data[timestampID].dropna()
-                return tmp.values
-        else:
+        index = self.eventIndex()
+        if index is None:
+            return None
+        if self.control_type == 'brainmata':
+            logger.debug("Event column %s", timestampID)
+            if timestampID not in index:
+                raise KeyError(timestampID)
+        return index.get(timestampID)
+
+
+    #index of the event times (see EventIndex), built when the events are read and rebuilt if timestamp_data is replaced
+    def eventIndex(self):
+        if self.timestamp_data is None:
             raise UserWarning("Cannot retrieve timestamps from empty events dataframe. Does the original data include events Data?")
-        return None
+        if self.control_type not in ['medpc', 'brainmata']:
+            return None
+        if self.timestamp_index is None or not self.timestamp_index.isCurrent(self.timestamp_data):
+            if self.control_type == 'medpc':
+                self.timestamp_index = EventIndex.fromMedPC(self.timestamp_data)
+            else:
+                self.timestamp_index = EventIndex.fromColumns(self.timestamp_data)
+        return self.timestamp_index
 
 
     #aligns segment of data to each type of event using the id_eventsDict
-    def alignEvents(self, part, baseline = 10, outcome = 10):
+    #maxGap: largest distance in seconds between a trial start event and the camera TTL it is matched to (None accepts any distance)
+    @Instrumentation.stage("align", rowsIn="beh_cleaned", rowsOut="beh_alignedTrials")
+    def alignEvents(self, part, baseline = 10, outcome = 10, maxGap = None):
         if self.beh_cleaned is None:
-            print("Error: Cannot align events if data has not been cleaned")
+            logger.error("Error: Cannot align events if data has not been cleaned")
         else:
-            print("Aligning behavioral data to timestamps...")
+            logger.info("Aligning behavioral data to timestamps...")
             if len(self.id_events) < 1:
-                print("Error: No dictionary of events provided. Cannot align events.")
+                logger.error("Error: No dictionary of events provided. Cannot align events.")
             else:
                 #Calculate offsets of each TLL pulse detected by camera compared to each TrialStart
                 MPC = self.getEventTimes(self.id_events.get("id_trialStart"))
-                for x in range(len(MPC)):
-                    closest = self.beh_TTL.sub(MPC[x]).abs().idxmin()
-                    closest = closest['onset']
-                    offset = self.beh_TTL.at[closest, 'onset'] - MPC[x]
-                    self.beh_TTL.at[closest, 'offset_MPC'] = offset
+                matches, report = ClockSync.matchEvents(MPC, self.beh_TTL['onset'], maxGap)
+                #if several trial starts matched the same pulse, the last one sets its offset
+                matches = matches.dropna(subset=["ttl"]).drop_duplicates("ttl", keep="last")
+                self.beh_TTL['offset_MPC'] = np.nan
+                self.beh_TTL.iloc[matches["ttl"].to_numpy(dtype=int), self.beh_TTL.columns.get_loc('offset_MPC')] = matches["offset"].to_numpy()
+
+                for key, value in report.items():
+                    self.beh_stats["Sync_" + key] = value
+                logger.info("Matched %d of %d trial starts to camera TTLs, clock drift: %s ppm", report["Matched"], report["Events"], report["Drift_PPM"])
+                if report["Unmatched"] > 0:
+                    logger.warning("Warning: %d trial start(s) had no camera TTL within %s seconds", report["Unmatched"], maxGap)
+                if report["Duplicate_Matches"] > 0:
+                    logger.warning("Warning: %d trial starts share a camera TTL with another trial start. Check your TTL data.", report["Duplicate_Matches"])
 
                 #loop though event dictionary to process each event, using TTL offsets to align animal velocity
                 for key, value in self.id_events.items():
                     eventName = key.split("_")
                     eventName = eventName[1]
-                    print("Processing event", eventName, "...")
-                    self.beh_alignedEvents[eventName] = self.processEvent(value, part, baseline, outcome)
+                    logger.info("Processing event %s ...", eventName)
+                    self.beh_alignedEvents[eventName] = self.processEvent(value, part, baseline, outcome, eventName)
 
     #annote a behavior event (i.e as 0 or 1 for each time point) given a deeplabcut part name and a minimum number of samples
+    @Instrumentation.stage("annotate", rowsIn="beh_cleaned")
     def booleanEvent(self, part):
         if self.type == "deeplabcut":
             newName = part + "_bool"
             self.beh_cleaned[newName] = [0 if np.isnan(x) else 1 if not np.isnan(x) else np.isnan() for x in self.beh_cleaned[part]]
 
-    #annotate a behavior event in a range around an event window. Uses aligned events to label number of behavior events in a given range (0 is TTL)
-    #expects boolean event annotations (weather a behavior happened at a time point) to have been previously calculated
+    #Scores behavior in windows around events, for many (window, event) specs in one pass over the aligned trials of each event.
+    #expects boolean event annotations (weather a behavior happened at a time point) to have been aligned with alignEvents
+    #specs: list of (window, isCorrect, eventName, part) tuples or dictionaries with those keys
+    #   window: [x, y] min and max times in seconds to look (0 is the event)
+    #   isCorrect: whether a behavior in the window is the correct response (True) or an incorrect response (False)
+    #   eventName: name of the aligned event, part: label of the window, e.g. "Tongue_predictive"
+    #Returns a table with one row per spec and trial holding the number of samples with behavior, the latency from the start of
+    #the window to the first of them and the Correct/Incorrect annotation. The table is added to beh_annotations, and every
+    #spec's annotations and fraction of correct trials are stored in beh_stats as <part>_<eventName>_annotations and _correct.
+    @Instrumentation.stage("annotate", rowsIn="beh_alignedTrials")
+    def annotatePerievent(self, specs):
+        specs = [dict(zip(["window", "isCorrect", "eventName", "part"], spec)) if not isinstance(spec, dict) else spec for spec in specs]
+        tables = []
+        #score every window of an event at once
+        for eventName in dict.fromkeys(spec["eventName"] for spec in specs):
+            eventSpecs = [spec for spec in specs if spec["eventName"] == eventName]
+            aligned = self.beh_alignedTrials.get(eventName)
+            if aligned is not None:
+                time, trials = aligned.Time, aligned.trials[:, :, 0]
+            else:
+                eventData = self.beh_alignedEvents[eventName]
+                trialColumns = [c for c in eventData.columns if c not in ["SD", "Average", "Time"]]
+                time, trials = eventData["Time"].to_numpy(dtype=float), eventData[trialColumns].to_numpy(dtype=float).T
+            counts, latencies = EventAlignment.scoreWindows(time, trials, [spec["window"] for spec in eventSpecs])
+
+            for x, spec in enumerate(eventSpecs):
+                responded = counts[:, x] > 0
+                correct = responded if spec["isCorrect"] else ~responded
+                annotations = np.where(correct, "Correct", "Incorrect")
+                label = spec["part"] + "_" + eventName
+                self.beh_stats[label + "_annotations"] = pd.DataFrame({"num_" + label: counts[:, x], "annotation_" + label: annotations})
+                percentCorrect = float(correct.mean()) if len(correct) > 0 else np.nan
+                self.beh_stats[label + "_correct"] = percentCorrect
+                logger.info("Annotations for event %s: %d trial(s), fraction correct: %s", label, len(correct), percentCorrect)
+                tables.append(pd.DataFrame({"part": spec["part"], "event": eventName, "window_start": spec["window"][0],
+                                            "window_end": spec["window"][1], "isCorrect": bool(spec["isCorrect"]),
+                                            "trial": np.arange(len(correct)), "count": counts[:, x], "latency": latencies[:, x],
+                                            "annotation": annotations}))
+
+        table = pd.concat(tables, ignore_index=True) if len(tables) > 0 else None
+        if table is not None:
+            logger.debug("%s", table)
+            self.beh_annotations = table if self.beh_annotations is None else pd.concat([self.beh_annotations, table], ignore_index=True)
+        return table
+
+
+    #annotate a behavior event in a range around an event window, see annotatePerievent, which scores many windows at once
     #window: array [x, y] of min and max times in seconds to look
     #isCorrect: #if the event is a correct or incorrect behavioral response
     #eventName: Name of event to search for in dictionary
     #part: Name of the data segment which we are analyzing
     def annotatePerieventBehavior(self, window, isCorrect, eventName, part):
-        tmin = window[0]
-        tmax = window[1]
-        annotations = []
-        counts = []
-        eventData = None
-        if self.beh_alignedEvents is not None:
-            eventData = self.beh_alignedEvents[eventName]
-            if eventData is not None:
-                wMin = eventData['Time'].sub(tmin).abs().idxmin()
-                wMax = eventData['Time'].sub(tmax).abs().idxmin()
-                numTrials = eventData.shape[1] - 3
-                numCorrect = 0
-                for x in range(numTrials): #ignore SD, Average, and Time so subtract 3
-                    slice = eventData.iloc[wMin:wMax][x]
-                    tmp = slice[slice >= 1].shape[0]
-                    counts.append(tmp)
-                    if isCorrect == True:
-                        if tmp > 0:
-                            annotations.append("Correct")
-                            numCorrect += 1
-                        elif tmp <= 0:
-                            annotations.append("Incorrect")
-                        else:
-                            annotations.append("Indeterminate")
-
-                    if isCorrect == False:
-                        if tmp <= 0:
-                            annotations.append("Correct")
-                            numCorrect += 1
-                        elif tmp > 0:
-                            annotations.append("Incorrect")
-                        else:
-                            annotations.append("Indeterminate")
-
-                print("Annotations for event: ", part + "_" + eventName)
-                colName = "num_" + part + "_" + eventName
-                colName2 = "annotation_" + part + "_" + eventName
-                d = {colName: counts, colName2: annotations}
-                df = pd.DataFrame(data = d)
-                print(df)
-                dictName = part + "_" + eventName + "_annotations"
-                self.beh_stats[dictName] = df
-                percentCorrect = numCorrect / numTrials
-                dictName = part + "_" + eventName + "_correct"
-                self.beh_stats[dictName] = percentCorrect
-                print("Number of correct events:", percentCorrect)
+        return self.annotatePerievent([(window, isCorrect, eventName, part)])
 
 
+    #Filters columns of the cleaned data (e.g. ["Nose_x", "Nose_y"] or velocities) in place with a zero-phase Butterworth
+    #filter at the frame rate of the video. lowpass and highpass are cutoff frequencies in Hz (either or both).
+    #Frames without a position (below the labeling threshold) are bridged for filtering and stay nan.
+    @Instrumentation.stage("filter", rowsIn="beh_cleaned", rowsOut="beh_cleaned")
+    def filterSignals(self, columns, lowpass = None, highpass = None, order = 4):
+        if self.beh_cleaned is None or self.fps is None:
+            raise UserWarning("This data has not been cleaned. Please run clean() before proceeding.")
+        values = self.beh_cleaned[columns].to_numpy(dtype=float)
+        values = SignalProcessing.bandFilter(values, self.fps, lowpass, highpass, order)
+        self.beh_cleaned[columns] = values
 
 
+    #calculate velocity and total locomotion of a single part, given a dataframe whose first two columns are x and y
+    #see VelocityEngine.calcVelocity for processing many parts at once
     def calcVel(self, df, movingAverage = False, threshold = 100):
-        vel = np.array([])
-        vel = np.append(vel, 0)
-        locomotion = float(0)
-        for x in range(1, int(df.shape[0])):
-            #calculate euclidian distance
-            dist = math.dist((df.iloc[x-1, 0] , df.iloc[x-1, 1]), (df.iloc[x,0] , df.iloc[x, 1]))
-            #if velocity is greater than a threshold value, make NA as it is a putative outlier
-            if dist >= threshold:
-                vel = np.append(vel, np.nan)
-            else:
-                if np.isnan(dist) is False or math.isnan(dist) is False:
-                    locomotion = locomotion + dist
-                vel = np.append(vel, dist)
-
-        #calculate moving average for a 10 sample windwow
-        if movingAverage == True:
-            print("Warning: calculating the moving average causes unexpected results with Nan values. Use with caution")
-            test = np.convolve(vel, np.ones(10), 'valid') / 10
-            #first 5 and last 5 samples cannot be calculated, so pad array so that dimensions fit with existing data
-            test = np.concatenate([[0, 0, 0, 0, 0], test, [0,0,0,0,0]])
-            return test, locomotion
-        else:
-            return vel, locomotion
+        coords = df.iloc[:, 0:2].to_numpy(dtype=float)
+        return VelocityEngine.calcVelocity(coords, threshold=threshold, movingAverage=movingAverage)
 
 
+    @Instrumentation.stage("clean", rowsIn="beh_data", rowsOut="beh_cleaned")
     def clean(self):
         if self.videoPath is None or self.trueFrames is None or self.fps is None:
-            print("Error: no video file was passed. Cannot process behavioral data without accurate fps")
+            logger.error("Error: no video file was passed. Cannot process behavioral data without accurate fps")
         else:
             #check what type of behavioral data has been passed
             #current types checked for: DeepLabCut, ezTrack Location Analysis, ezTrack Freezing Analysis
@@ -214,7 +242,7 @@ class BehaviorData:
             if test == "File":
                 if "Freezing" in self.beh_data.columns:
                     self.type = "ezt_freezing"
-                    print("Detected ezTrack freezing data")
+                    logger.info("Detected ezTrack freezing data")
                     #remove redundent columns
                     self.beh_cleaned = self.beh_data.iloc[:,5:]
                     self.beh_cleaned["Freezing"] = self.beh_cleaned["Freezing"] / 100
@@ -222,55 +250,62 @@ class BehaviorData:
 
                 elif "X" in self.beh_data.columns:
                     self.type = "ezt_location"
-                    print("Detected ezTrack location data")
+                    logger.info("Detected ezTrack location data")
                     # remove redundent columns
                     self.beh_cleaned = self.beh_data.iloc[:,7:]
                 else:
-                    print("Error: Detected ezTrack style data but could not identify the type...")
+                    logger.error("Error: Detected ezTrack style data but could not identify the type...")
 
-            elif test == "scorer":
+            elif test == "scorer" or (len(self.bodyParts) > 0 and list(self.beh_data.columns) == PoseData.flatColumns(self.bodyParts)):
                 self.type = "deeplabcut"
-                print("Detected Deeplabcut data...")
-                #remove existing headers
-                newHeaders = self.beh_data.iloc[0]
-                self.beh_data = self.beh_data[1:]
-                self.beh_data.columns = newHeaders
-                #rename columns in original dataframe
-                tmp = self.beh_data.iloc[1:].set_axis(self.beh_data.columns + '_' + self.beh_data.iloc[0], axis=1)
-                self.beh_data = tmp
-                self.beh_data = self.beh_data.reset_index(drop=True)
-                self.beh_data.drop(self.beh_data.columns[0], axis=1, inplace=True)
-                #process each part independently, and remove coordinate pairs which fall below confidence threshold
-                self.beh_cleaned = self.beh_data[["Nose_x"]]
-                for x in range(0, int(self.beh_data.shape[1]) - 1, 3):
-                    tmp = self.beh_data.iloc[:, x:x+3]
-                    #set points where labeling is not above threshold to nan
-                    tmp = tmp.where(tmp.iloc[:, 2] >= self.threshold)
-                    pName = tmp.columns[0].split("_")
-                    pName = pName[0]
-                    dictName = pName + "_Total_Locomotion"
-                    pName = pName + "_Vel"
-                    #calculate velocity and total locomotion
-                    tmp[pName], total = self.calcVel(tmp)
-                    self.beh_cleaned = pd.concat([self.beh_cleaned, tmp], axis=1)
-                    self.beh_stats[dictName] = total
-
-                #drop first placeholder column
-                self.beh_cleaned = self.beh_cleaned.iloc[:, 1:]
+                logger.info("Detected Deeplabcut data...")
+                if test == "scorer":
+                    #read every part into a (frames x parts x [x, y, likelihood]) array, dropping the header rows and frame numbers
+                    parts, coords = PoseData.parseDLCSheet(self.beh_data)
+                    self.bodyParts = parts
+                    self.beh_data = pd.DataFrame(coords.reshape(coords.shape[0], -1), columns=PoseData.flatColumns(parts))
+                else:
+                    #already parsed by readFiles
+                    parts = self.bodyParts
+                    coords = self.beh_data.to_numpy(dtype=float, copy=True).reshape(-1, len(parts), 3)
+                #set points where labeling is not above threshold to nan, then fill short gaps
+                PoseData.applyThreshold(coords, self.threshold)
+                if self.maxGap > 0:
+                    coords[:, :, 0:2] = SignalProcessing.interpolateGaps(coords[:, :, 0:2], self.maxGap)
+                self.beh_pose = coords
+                #calculate velocity and total locomotion for all parts in one pass
+                vel, total = VelocityEngine.calcVelocity(coords[:, :, 0:2])
+                for x in range(len(parts)):
+                    self.beh_stats[parts[x] + "_Total_Locomotion"] = float(total[x])
+                #x, y, likelihood and velocity of every part as one block
+                block = np.concatenate([coords, vel[:, :, np.newaxis]], axis=2).reshape(coords.shape[0], -1)
+                self.beh_cleaned = pd.DataFrame(block, index=self.beh_data.index, columns=PoseData.flatColumns(parts, PoseData.COORDS + ["Vel"]))
 
 
             #caluclate fps from video file to produce accurate timestamps
-            self.beh_cleaned['Time'] = self.beh_data.index / self.fps
+            #use the frame times of the video where it has one per row, e.g. for variable frame rate videos
+            if self.frameTimes is not None and len(self.frameTimes) == self.beh_cleaned.shape[0]:
+                self.beh_cleaned['Time'] = self.frameTimes
+            else:
+                self.beh_cleaned['Time'] = self.beh_data.index / self.fps
 
             if int(self.beh_cleaned.shape[0]) != self.trueFrames:
-                print("Error: cleaned behavioral data contains", int(self.beh_cleaned.shape[0]), "frames while cv2 reports", self.trueFrames, ". Is this the correct video and behavioral data?")
+                logger.error("Error: cleaned behavioral data contains %d frames while the video has %s. Is this the correct video and behavioral data?", int(self.beh_cleaned.shape[0]), self.trueFrames)
             else:
-                print("Confirmed detected number of frames matches amount in behavioral data...")
+                logger.info("Confirmed detected number of frames matches amount in behavioral data...")
 
             #rename DLC-TTL data columns
-            self.beh_TTL.columns = ['onset', 'offset']
+            if self.beh_TTL is not None:
+                self.beh_TTL.columns = ['onset', 'offset']
+
+            logger.debug("%s", self.beh_stats)
 
-            print(self.beh_stats)
+
+    #DLC positions with (part, coord) MultiIndex columns over beh_pose, e.g. pose()["Nose", "x"] or pose().xs("x", axis=1, level="coord")
+    def pose(self):
+        if self.beh_pose is None:
+            return None
+        return PoseData.poseFrame(self.bodyParts, self.beh_pose, index=self.beh_data.index)
 
 
     def determineControlType(self):
@@ -279,58 +314,102 @@ class BehaviorData:
         else:
             test = self.timestamp_data.columns[0]
             if test == "SOLENOID_WATER":
-                print("Found BrainMata event data...")
+                logger.info("Found BrainMata event data...")
                 self.control_type = "brainmata"
             elif test == "Index":
-                print("Found Med-Pc event data...")
+                logger.info("Found Med-Pc event data...")
                 self.control_type = "medpc"
             else:
-                print("Warning: event data is not a recognized format")
+                logger.warning("Warning: event data is not a recognized format")
 
 
-    def readData(self, fpath):
-        print("Reading data...")
-        timestampData = None
-        DLCData = None
-        DLCTTL = None
-        #look for Med-Pc Data
+    #parsed sheets are cached (see SessionCache), pass refreshCache = True to re-parse the workbook
+    @Instrumentation.stage("read", rowsOut="beh_data")
+    def readData(self, fpath, refreshCache = False):
+        logger.info("Reading data...")
+        #behavior data is ALWAYS ASSUMED TO BE THE FIRST SHEET
+        sheets = {"events": {"sheet_name": "Events"},
+                  "behavior": {"sheet_name": 0, "header": 0},
+                  "ttl": {"sheet_name": "Behavior-TTL", "header": 0, "index_col": 0}}
         try:
-            timestampData = pd.read_excel(fpath, sheet_name="Events")
+            sheets = SessionCache.readSheets(fpath, sheets, useCache=self.useCache, refresh=refreshCache)
         except:
-            print("Warning: Could not find events data in file. Is there an excel tab labeled 'Events'?")
+            sheets = {}
+
+        #look for Med-Pc Data
+        timestampData = sheets.get("events")
+        if timestampData is None:
+            logger.warning("Warning: Could not find events data in file. Is there an excel tab labeled 'Events'?")
 
         #look for behavior data
-        #ALWAYS ASSUME IT IS THE FIRST SHEET
-        try:
-            DLCData = pd.read_excel(fpath, sheet_name=0, header=0)
-        except:
-            print("Warning: Could not find behavioral data. Is there an excel tab labeled 'Behavior'?")
+        DLCData = sheets.get("behavior")
+        if DLCData is None:
+            logger.warning("Warning: Could not find behavioral data. Is there an excel tab labeled 'Behavior'?")
 
         #look for behavioral data TTL timestamps
-        try:
-            DLCTTL = pd.read_excel(fpath, sheet_name="Behavior-TTL", header=0, index_col=0)
-        except:
-            print("Warning: Could not find behavioral recording TTL timestamps. Is there an excel tab labeled 'Behavior-TTL'?")
+        DLCTTL = sheets.get("ttl")
+        if DLCTTL is None:
+            logger.warning("Warning: Could not find behavioral recording TTL timestamps. Is there an excel tab labeled 'Behavior-TTL'?")
 
         self.beh_data = DLCData
         self.beh_TTL = DLCTTL
         self.timestamp_data = timestampData
 
+        self.readVideo(refreshCache)
+        self.formatEvents()
+
+
+    #Reads behavioral data straight from the files written by the tracking software, without an excel workbook:
+    #behaviorPath: DeepLabCut .h5 or .csv output, or ezTrack .csv output
+    #eventsPath: .csv of Med-Pc or BrainMata events, in the layout of the 'Events' sheet
+    #ttlPath: .csv of the camera TTLs, in the layout of the 'Behavior-TTL' sheet (first column is the index)
+    @Instrumentation.stage("read", rowsOut="beh_data")
+    def readFiles(self, behaviorPath, eventsPath = None, ttlPath = None, refreshCache = False):
+        logger.info("Reading data...")
+        extension = os.path.splitext(behaviorPath)[1].lower()
+        if extension in [".h5", ".hdf5"] or (extension == ".csv" and len(PoseData.dlcHeader(behaviorPath)) > 0):
+            parts, coords = PoseData.readDLC(behaviorPath)
+            self.bodyParts = parts
+            self.beh_data = pd.DataFrame(coords.reshape(coords.shape[0], -1), columns=PoseData.flatColumns(parts))
+        elif extension == ".csv":
+            self.beh_data = pd.read_csv(behaviorPath)
+        else:
+            raise ValueError("Expected a DeepLabCut .h5/.csv or ezTrack .csv file, got " + str(behaviorPath))
+
+        self.timestamp_data = pd.read_csv(eventsPath) if eventsPath is not None else None
+        if self.timestamp_data is None:
+            logger.warning("Warning: No events file was given. Events cannot be aligned.")
+        self.beh_TTL = pd.read_csv(ttlPath, index_col=0) if ttlPath is not None else None
+        if self.beh_TTL is None:
+            logger.warning("Warning: No behavioral recording TTL file was given.")
+
+        self.readVideo(refreshCache)
+        #without events the control software is unknown and control_type stays None
+        if self.timestamp_data is not None:
+            self.formatEvents()
+
+
+    #reads the frame count, fps and frame times of videoPath from the video's index (or its cached sidecar) without decoding it
+    def readVideo(self, refreshCache = False):
         if self.videoPath is not None:
-            video = cv2.VideoCapture(self.videoPath)
-            self.trueFrames = video.get(cv2.CAP_PROP_FRAME_COUNT)
-            self.fps = video.get(cv2.CAP_PROP_FPS)
-            self.videoLength = self.trueFrames / self.fps
+            video = VideoMetadata.probeVideo(self.videoPath, useCache=self.useCache, refresh=refreshCache)
+            self.trueFrames = video.frames
+            self.fps = video.fps
+            self.videoLength = video.duration
+            self.frameTimes = video.timestamps
             self.beh_stats['True_FPS'] = self.fps
             self.beh_stats['cv2_Video_Length'] = self.videoLength
-            print("Detected video with", self.trueFrames, "frames recorded at", self.fps, "fps")
+            logger.info("Detected video with %s frames recorded at %s fps (%s)", self.trueFrames, self.fps, video.source)
 
+
+    #determines the control software of timestamp_data and reformats BrainMata events to one <event>_timestamp column per event
+    def formatEvents(self):
         self.determineControlType()
         #reformat event datafram
         if self.control_type == "brainmata":
             tmp = self.timestamp_data.iloc[1:].set_axis(self.timestamp_data.columns + '_' + self.timestamp_data.iloc[0], axis = 1)
-            self.timestamp_data = tmp
+            #times are read as text from .csv files
+            self.timestamp_data = tmp.apply(pd.to_numeric, errors="coerce")
             self.timestamp_data = self.timestamp_data.reset_index(drop=True)
-        else:
-            self.timestamp_data = timestampData
+        self.eventIndex()
 
@@ -0,0 +1,32 @@
+import numpy as np
+import pandas as pd
+
+
+#Matches every event timestamp from the control software (Med-Pc or BrainMata) to the nearest TTL onset recorded by the camera
+#in one sorted merge. Events with no onset within maxGap seconds are left unmatched (maxGap = None matches every event).
+#Returns a dataframe with one row per event (in the original order) holding the event time, the position of the matched
+#onset in onsets (nan if unmatched), the onset time and offset (onset - event), and a report dictionary describing the
+#quality of the sync: number of matched, unmatched and duplicate matches (several events matched to the same onset),
+#and a linear drift model onset = slope * event + intercept fitted over the matched pairs, with its residuals.
+def matchEvents(eventTimes, onsets, maxGap = None):
+    events = pd.DataFrame({"event": np.arange(len(eventTimes)), "eventTime": np.asarray(eventTimes, dtype=float)})
+    ttl = pd.DataFrame({"ttl": np.arange(len(onsets)), "onset": np.asarray(onsets, dtype=float)})
+    ttl = ttl.dropna().sort_values("onset", kind="stable")
+
+    matches = pd.merge_asof(events.dropna().sort_values("eventTime", kind="stable"), ttl, left_on="eventTime",
+                            right_on="onset", direction="nearest", tolerance=maxGap)
+    #events without a timestamp are kept, unmatched
+    matches = events.merge(matches[["event", "ttl", "onset"]], on="event", how="left")
+    matches["offset"] = matches["onset"] - matches["eventTime"]
+
+    matched = matches.dropna(subset=["ttl"])
+    duplicates = matched["ttl"].duplicated(keep=False)
+    report = {"Events": len(matches), "Matched": len(matched), "Unmatched": len(matches) - len(matched),
+              "Duplicate_Matches": int(duplicates.sum()), "Drift_Slope": np.nan, "Drift_Intercept": np.nan,
+              "Drift_PPM": np.nan, "Residual_SD": np.nan, "Max_Residual": np.nan}
+    if len(matched) >= 2:
+        slope, intercept = np.polyfit(matched["eventTime"], matched["onset"], 1)
+        residual = matched["onset"] - (slope * matched["eventTime"] + intercept)
+        report.update({"Drift_Slope": slope, "Drift_Intercept": intercept, "Drift_PPM": (slope - 1) * 1e6,
+                       "Residual_SD": residual.std(), "Max_Residual": residual.abs().max()})
+    return matches, report
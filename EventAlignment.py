@@ -0,0 +1,102 @@
+import warnings
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+import SignalProcessing
+
+#peri-event data for one event type
+#Time: (samples) event-centric time axis shared by every trial, in seconds
+#trials: (trials x samples x signals) array, nan where a trial has no data
+#signals: names of the signals along the last axis of trials
+AlignedTrials = namedtuple("AlignedTrials", ["Time", "trials", "signals"])
+
+
+#Given a sorted array of times and an array of target times (any shape), returns the index of the closest time to every target
+def nearestIndex(time, targets):
+    time = np.asarray(time, dtype=float)
+    targets = np.asarray(targets, dtype=float)
+    right = np.clip(np.searchsorted(time, targets), 0, len(time) - 1)
+    left = np.clip(right - 1, 0, len(time) - 1)
+    useLeft = np.abs(targets - time[left]) <= np.abs(time[right] - targets)
+    return np.where(useLeft, left, right)
+
+
+#Cuts a window of data from baseline seconds before to outcome seconds after every event, all at once.
+#time: sorted sample times, signals: (samples x signals) array or dataframe, eventTimes: time of every event (same clock as time)
+#rate: samples per second of the event-centric time axis, estimated from the median sample interval if not given
+#tolerance: samples further than this from a point on the time axis are treated as missing (default is half a sample interval,
+#so gaps in pulsed recordings and the edges of the recording come out as nan)
+#returns an AlignedTrials with a preallocated (trials x samples x signals) array
+def alignTrials(time, signals, eventTimes, baseline, outcome, rate = None, tolerance = None):
+    names = list(signals.columns) if isinstance(signals, pd.DataFrame) else None
+    time = np.asarray(time, dtype=float)
+    signals = np.asarray(signals, dtype=float)
+    if signals.ndim == 1:
+        signals = signals[:, np.newaxis]
+    if names is None:
+        names = list(range(signals.shape[1]))
+    eventTimes = np.asarray(eventTimes, dtype=float).ravel()
+
+    if rate is None:
+        rate = 1 / np.median(np.diff(time))
+    if tolerance is None:
+        tolerance = 0.5 / rate * 1.001
+    numSamples = int(round((baseline + outcome) * rate))
+    timeAxis = np.arange(numSamples) / rate - baseline
+
+    trials = np.full((len(eventTimes), numSamples, signals.shape[1]), np.nan)
+    if len(time) < 1 or len(eventTimes) < 1:
+        return AlignedTrials(timeAxis, trials, names)
+    targets = eventTimes[:, np.newaxis] + timeAxis[np.newaxis, :]
+    idx = nearestIndex(time, targets)
+    found = np.abs(time[idx] - targets) <= tolerance
+    trials[found] = signals[idx[found]]
+    return AlignedTrials(timeAxis, trials, names)
+
+
+#Summarizes one signal (name or position) of an AlignedTrials as a dataframe with one column per trial, followed by SD, Average and Time columns
+#The average is smoothed with a 10 sample moving average (see SignalProcessing.movingAverage)
+def trialsFrame(aligned, signal = 0):
+    if signal in aligned.signals:
+        signal = aligned.signals.index(signal)
+    data = aligned.trials[:, :, signal]
+
+    df = {}
+    for y in range(data.shape[0]):
+        df[y] = data[y]
+    with warnings.catch_warnings():
+        #samples without data in any trial have no mean or SD
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        df['SD'] = np.nanstd(data, axis=0, ddof=1)
+        average = np.nanmean(data, axis=0)
+    #first 5 and last 4 samples have no full window, so they are nan. Samples without data are skipped rather than spread
+    df['Average'] = SignalProcessing.movingAverage(average, 10)
+    df['Time'] = aligned.Time
+    return pd.DataFrame(df)
+
+
+#Counts the samples of every trial at or above threshold within every window, for all trials and windows at once.
+#time: event-centric time axis, trials: (trials x samples) array, windows: [start, end] pairs in seconds
+#The edges of a window are the samples closest to start and end, the end sample is not included. Nan samples never count.
+#returns (counts, latencies), both (trials x windows): the number of samples at or above threshold, and the seconds from the
+#start of the window to the first of them (nan if there is none)
+def scoreWindows(time, trials, windows, threshold = 1):
+    time = np.asarray(time, dtype=float)
+    trials = np.asarray(trials, dtype=float)
+    windows = np.asarray(windows, dtype=float).reshape(-1, 2)
+    start = nearestIndex(time, windows[:, 0])
+    stop = np.maximum(nearestIndex(time, windows[:, 1]), start)
+    hits = trials >= threshold
+    numTrials, numSamples = hits.shape
+
+    #counts of every window are differences of the running count of hits
+    running = np.zeros((numTrials, numSamples + 1), dtype=np.int64)
+    np.cumsum(hits, axis=1, out=running[:, 1:])
+    counts = running[:, stop] - running[:, start]
+
+    #index of the first hit at or after every sample (numSamples if there is none)
+    firstHit = np.minimum.accumulate(np.where(hits, np.arange(numSamples), numSamples)[:, ::-1], axis=1)[:, ::-1]
+    first = firstHit[:, start]
+    found = first < stop[np.newaxis, :]
+    latencies = np.where(found, time[np.minimum(first, numSamples - 1)] - time[start], np.nan)
+    return counts, latencies
@@ -0,0 +1,18 @@
+import pandas as pd
+
+#Parsing of the event settings given on command lines and in manifests, shared by BatchRunner.py and OnlineProcessor.py.
+#Kept free of the pipeline's heavier modules, so that importing it does not load the batch or plotting stack.
+
+
+#parses "name=id;name=id" into an events dictionary. Numeric ids (Med-Pc) are converted to int, others (BrainMata) are kept as strings
+def parseEvents(text):
+    events = {}
+    if text is None or (isinstance(text, float) and pd.isna(text)):
+        return events
+    for pair in str(text).replace(",", ";").split(";"):
+        if pair.strip() == "":
+            continue
+        name, value = pair.split("=", 1)
+        value = value.strip()
+        events[name.strip()] = int(value) if value.lstrip("-").isdigit() else value
+    return events
@@ -0,0 +1,103 @@
+import numpy as np
+import pandas as pd
+
+#Index of the event times of a session, built once from its events table so that looking up the times of an event does not
+#scan the whole table. Times of every event are sorted and stored back to back in one array, and each event maps to a
+#read-only slice of it, so get() is a dictionary lookup and between() is two binary searches.
+#
+#   index = EventIndex.fromMedPC(data.timestamp_data)      #keys are Med-Pc IDs
+#   index.get(71)                                           #times of every ID 71 event
+#   index.between(71, 100, 200)                             #times of the ID 71 events from 100 to 200 s
+#   index = EventIndex.fromColumns(brainmataEvents)         #keys are column names, e.g. "TONE_timestamp"
+
+EMPTY = np.zeros(0)
+EMPTY.flags.writeable = False
+#isCurrent compares every value of the indexed columns of tables of up to FULL_ROWS rows, and SAMPLE_SIZE evenly spaced values
+#of larger ones
+FULL_ROWS = 20000
+SAMPLE_SIZE = 64
+
+
+class EventIndex:
+    #keys: event of every time, times: time of every event, events without a time (nan) are left out
+    #source: the table the index was built from, and columns: its columns the index was built from (see isCurrent)
+    def __init__(self, keys, times, source = None, columns = None):
+        keys = np.asarray(keys)
+        times = np.asarray(times, dtype=float)
+        valid = ~np.isnan(times)
+        keys, times = keys[valid], times[valid]
+        order = np.lexsort((times, keys)) if len(keys) > 0 else np.zeros(0, dtype=np.int64)
+        keys = keys[order]
+        self.times = times[order]
+        self.times.flags.writeable = False
+        starts = np.concatenate([[0], np.flatnonzero(keys[1:] != keys[:-1]) + 1]) if len(keys) > 0 else np.zeros(0, dtype=np.int64)
+        ends = np.concatenate([starts[1:], [len(keys)]])
+        self.events = {key: self.times[start:end] for key, start, end in zip(keys[starts].tolist(), starts, ends)}
+        self.source = source
+        self.columns = list(columns if columns is not None else (source.columns if source is not None else []))
+        self.fingerprint = fingerprint(source, self.columns) if source is not None else None
+
+    #sorted times of every event of key, an empty array for events which never happened
+    def get(self, key):
+        return self.events.get(key, EMPTY)
+
+    #sorted times of the events of key from t0 to t1 (both included)
+    def between(self, key, t0, t1):
+        times = self.get(key)
+        return times[np.searchsorted(times, t0, side="left"):np.searchsorted(times, t1, side="right")]
+
+    def count(self, key):
+        return len(self.get(key))
+
+    def keys(self):
+        return list(self.events)
+
+    def __contains__(self, key):
+        return key in self.events
+
+    def __len__(self):
+        return len(self.times)
+
+    #Whether the index still describes frame: frame is the table it was built from, and that table has not been changed since
+    #(see fingerprint), e.g. by assigning an indexed column or appending rows
+    def isCurrent(self, frame):
+        if self.source is not frame:
+            return False
+        try:
+            current = fingerprint(frame, self.columns)
+        except KeyError:
+            return False
+        return current[0:3] == self.fingerprint[0:3] and all(
+            np.array_equal(a, b, equal_nan=a.dtype.kind == "f") for a, b in zip(current[3], self.fingerprint[3]))
+
+
+#Cheap fingerprint of columns of frame: the number of rows, the column names, where the data of every column is (assigning a
+#column or appending rows moves it) and its values, to catch values changed in place. Tables of more than FULL_ROWS rows are
+#not read whole, only an evenly spaced sample of their values is kept, so a value changed in place between the sampled rows of
+#such a table is missed. Returns (rows, column names, data addresses, sampled values)
+def fingerprint(frame, columns):
+    values = [frame[column].to_numpy() for column in columns]
+    if len(frame) <= FULL_ROWS:
+        sample = slice(None)
+    else:
+        sample = np.linspace(0, len(frame) - 1, SAMPLE_SIZE).astype(np.int64)
+    return (len(frame), tuple(frame.columns), tuple(v.__array_interface__["data"][0] for v in values),
+            [v[sample].copy() for v in values])
+
+
+#index of a Med-Pc events table (ID and secs columns), keyed by event ID
+def fromMedPC(frame):
+    return EventIndex(frame["ID"].to_numpy(), pd.to_numeric(frame["secs"], errors="coerce").to_numpy(dtype=float), source=frame,
+                      columns=["ID", "secs"])
+
+
+#index of a table with one column of times per event (e.g. reformatted BrainMata events), keyed by column name
+def fromColumns(frame):
+    values = frame.apply(pd.to_numeric, errors="coerce").to_numpy(dtype=float)
+    keys = np.tile(np.arange(frame.shape[1]), frame.shape[0])
+    index = EventIndex(keys, values.ravel(), source=frame, columns=list(frame.columns))
+    #positions are used while building so that column names of any type sort, then replaced by the names
+    index.events = {frame.columns[x]: times for x, times in index.events.items()}
+    for column in frame.columns:
+        index.events.setdefault(column, EMPTY)
+    return index
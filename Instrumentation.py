@@ -0,0 +1,272 @@
+import contextlib
+import cProfile
+import datetime
+import functools
+import json
+import logging
+import platform
+import sys
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+#Logging and per-stage instrumentation of the pipeline.
+#Messages of every module go to the "pypline" logger (see getLogger). Unless configureLogging is called they are written to
+#stdout at INFO level, as the print statements they replace were.
+#Methods decorated with stage() are timed whenever a RunReport is active:
+#
+#   with Instrumentation.RunReport("session1", traceMemory=True, profile="session1.prof") as report:
+#       data.readData(fpath)
+#       data.clean()
+#   report.write("session1_report.json")
+
+LOGGER_NAME = "pypline"
+#handlers added by configureLogging, so that reconfiguring replaces them
+_handlers = []
+#stack of active reports, stages are recorded in the last one
+_reports = []
+
+
+#sets the level and destination of the pipeline's messages, replacing the previous configuration
+#stream: file-like object to write to (default stdout), logFile: optional path of a file which receives every message as well
+def configureLogging(level = "INFO", stream = None, logFile = None, messageFormat = "%(message)s"):
+    base = logging.getLogger(LOGGER_NAME)
+    for handler in _handlers:
+        base.removeHandler(handler)
+        if isinstance(handler, logging.FileHandler):
+            handler.close()
+    _handlers.clear()
+    _handlers.append(logging.StreamHandler(stream if stream is not None else sys.stdout))
+    if logFile is not None:
+        _handlers.append(logging.FileHandler(logFile))
+    for handler in _handlers:
+        handler.setFormatter(logging.Formatter(messageFormat))
+        base.addHandler(handler)
+    base.setLevel(level.upper() if isinstance(level, str) else level)
+    base.propagate = False
+    return base
+
+
+#returns the logger of a module, e.g. getLogger("photometry") -> "pypline.photometry"
+def getLogger(name):
+    if len(_handlers) < 1:
+        configureLogging()
+    return logging.getLogger(LOGGER_NAME + "." + name)
+
+
+logger = getLogger("instrumentation")
+
+
+#returns the active RunReport, or None
+def activeReport():
+    return _reports[-1] if len(_reports) > 0 else None
+
+
+#number of rows of a dataframe, array, dictionary of those (summed) or EventAlignment.AlignedTrials (trials x samples)
+def countRows(value):
+    if value is None:
+        return None
+    if hasattr(value, "trials"):
+        return int(value.trials.shape[0] * value.trials.shape[1])
+    if isinstance(value, dict):
+        counts = [countRows(v) for v in value.values()]
+        counts = [c for c in counts if c is not None]
+        return int(sum(counts)) if len(counts) > 0 else None
+    if hasattr(value, "__len__"):
+        return len(value)
+    return None
+
+
+#returns a function which picks an argument of a call by keyword name, or by position if it was passed positionally
+#used to count the rows of the inputs of stage() functions, e.g. rowsIn=argument("cleaned", 0)
+def argument(name, position = 0):
+    def pick(*args, **kwargs):
+        if name in kwargs:
+            return kwargs[name]
+        return args[position] if len(args) > position else None
+    return pick
+
+
+#Decorator which records every call of a function as a stage of the active RunReport (calls are not slowed down otherwise).
+#rowsIn and rowsOut give the input and output data of the stage, whose rows are counted: either the name of an attribute of
+#the first argument (self), or a function taking the same arguments as the decorated function. rowsIn is evaluated before
+#the call and rowsOut after it.
+def stage(name, rowsIn = None, rowsOut = None):
+    def evaluate(spec, args, kwargs):
+        if spec is None or len(args) + len(kwargs) < 1:
+            return None
+        try:
+            value = getattr(args[0], spec, None) if isinstance(spec, str) else spec(*args, **kwargs)
+            return countRows(value)
+        except Exception:
+            return None
+
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            report = activeReport()
+            if report is None:
+                return function(*args, **kwargs)
+            with report.stage(name, function.__qualname__, evaluate(rowsIn, args, kwargs)) as record:
+                result = function(*args, **kwargs)
+                record["rowsOut"] = evaluate(rowsOut, args, kwargs)
+            return result
+        return wrapper
+    return decorate
+
+
+#largest resident set size of the process so far in bytes, None where the resource module is not available (Windows)
+def maxRss():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    #kilobytes on linux, bytes on macOS
+    return int(rss if sys.platform == "darwin" else rss * 1024)
+
+
+#Records the wall time, CPU time, memory and row counts of every stage run while it is active, and writes them as JSON.
+#traceMemory: measure the peak memory allocated by every stage with tracemalloc (accurate, but slows down allocation-heavy
+#code), otherwise only the process' peak resident set size after each stage is recorded
+#profile: optional path of a cProfile dump of the whole run (readable with pstats or snakeviz)
+#Stages can be nested (e.g. plots rendered while writing results); a nested stage's time is included in its parent's.
+class RunReport:
+    def __init__(self, session, traceMemory = False, profile = None, metadata = None):
+        self.session = session
+        self.traceMemory = traceMemory
+        self.profile = profile
+        self.metadata = metadata or {}
+        self.stages = []
+        self.stack = []
+        self.started = None
+        self.wall = None
+        self.cpu = None
+        self.peakBytes = None
+        self.profiler = None
+        self.startWall = None
+        self.startCpu = None
+        self.tracing = False
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, excType, excValue, traceback):
+        self.stop()
+
+    def start(self):
+        self.started = datetime.datetime.now().isoformat()
+        self.startWall = time.perf_counter()
+        self.startCpu = time.process_time()
+        if self.traceMemory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.tracing = True
+        if self.profile is not None:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        _reports.append(self)
+        return self
+
+    def stop(self):
+        if self in _reports:
+            _reports.remove(self)
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.profiler.dump_stats(self.profile)
+            self.profiler = None
+        self.wall = time.perf_counter() - self.startWall
+        self.cpu = time.process_time() - self.startCpu
+        if self.tracing:
+            self.peakBytes = max([s["peakBytes"] or 0 for s in self.stages] + [tracemalloc.get_traced_memory()[1]])
+            tracemalloc.stop()
+            self.tracing = False
+        return self
+
+    #context manager recording one stage, yields the stage's record so rowsOut can be filled in
+    @contextlib.contextmanager
+    def stage(self, name, function = None, rowsIn = None):
+        parent = self.stack[-1] if len(self.stack) > 0 else None
+        record = {"stage": name, "function": function, "parent": parent["stage"] if parent is not None else None,
+                  "start": time.perf_counter() - self.startWall, "wall": None, "cpu": None, "peakBytes": None,
+                  "maxRssBytes": None, "rowsIn": rowsIn, "rowsOut": None, "error": None}
+        tracing = tracemalloc.is_tracing() and self.traceMemory
+        if tracing:
+            current, peak = tracemalloc.get_traced_memory()
+            #keep the parent's peak so far before resetting it for this stage
+            if parent is not None:
+                parent["_peak"] = max(parent.get("_peak", 0), peak)
+            tracemalloc.reset_peak()
+            record["_current"] = current
+        self.stack.append(record)
+        startWall = time.perf_counter()
+        startCpu = time.process_time()
+        try:
+            yield record
+        except Exception as e:
+            record["error"] = repr(e)
+            raise
+        finally:
+            record["wall"] = time.perf_counter() - startWall
+            record["cpu"] = time.process_time() - startCpu
+            if tracing:
+                peak = max(tracemalloc.get_traced_memory()[1], record.pop("_peak", 0))
+                record["peakBytes"] = int(peak - record.pop("_current"))
+                if parent is not None:
+                    parent["_peak"] = max(parent.get("_peak", 0), peak)
+            record["maxRssBytes"] = maxRss()
+            self.stack.pop()
+            self.stages.append(record)
+            logger.debug("%s (%s) took %.3f s", name, function, record["wall"])
+
+    #one row per stage name with the number of calls, total wall and CPU time, share of the run's wall time, largest peak
+    #memory and total rows in and out, sorted by wall time
+    def summary(self):
+        if len(self.stages) < 1:
+            return pd.DataFrame(columns=["stage", "calls", "wall", "cpu", "share", "peakBytes", "rowsIn", "rowsOut"])
+        frame = pd.DataFrame(self.stages)
+        summary = frame.groupby("stage", sort=False).agg(calls=("wall", "size"), wall=("wall", "sum"), cpu=("cpu", "sum"),
+                                                         peakBytes=("peakBytes", "max"), rowsIn=("rowsIn", sumRows),
+                                                         rowsOut=("rowsOut", sumRows)).reset_index()
+        total = self.wall if self.wall is not None else time.perf_counter() - self.startWall
+        summary.insert(4, "share", summary["wall"] / total if total > 0 else np.nan)
+        return summary.sort_values("wall", ascending=False, kind="stable").reset_index(drop=True)
+
+    #name of the stage with the largest total wall time
+    def slowestStage(self):
+        summary = self.summary()
+        return summary["stage"].iloc[0] if len(summary) > 0 else None
+
+    def toDict(self):
+        summary = self.summary()
+        return {"session": self.session, "started": self.started, "wall": self.wall, "cpu": self.cpu, "peakBytes": self.peakBytes,
+                "maxRssBytes": maxRss(), "profile": self.profile, "python": platform.python_version(),
+                "platform": platform.platform(), "metadata": self.metadata,
+                "stages": sorted(self.stages, key=lambda s: s["start"]),
+                "summary": json.loads(summary.to_json(orient="records"))}
+
+    #writes the report as JSON
+    def write(self, fpath):
+        with open(fpath, "w") as f:
+            json.dump(self.toDict(), f, indent=2, default=jsonValue)
+        return fpath
+
+    #logs the time spent in every stage
+    def log(self, level = logging.INFO):
+        for row in self.summary().itertuples():
+            logger.log(level, "%-10s %4d call(s) %9.3f s wall %9.3f s cpu %5.1f%%", row.stage, row.calls, row.wall, row.cpu, row.share * 100)
+
+
+#sum of row counts, None if no stage counted its rows
+def sumRows(values):
+    return pd.to_numeric(values).sum(min_count=1)
+
+
+#converts numpy values for json
+def jsonValue(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    return str(value)
@@ -0,0 +1,116 @@
+import numpy as np
+
+#Fits of the signal channel (Y) on the isosbestic control channel (X), fitted = intercept + slope * X.
+#Every function works on (samples x channels) arrays and fits all channels at once. Nan samples are ignored.
+
+
+#weighted least squares fit of every column of Y on the same column of X. W holds the weight of every sample (0 excludes it)
+def weightedFit(X, Y, W):
+    W = np.where(np.isnan(X) | np.isnan(Y), 0, W)
+    X = np.where(W > 0, X, 0)
+    Y = np.where(W > 0, Y, 0)
+    sw = W.sum(axis=0)
+    #center before summing to avoid losing precision on large signals
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mx = (W * X).sum(axis=0) / sw
+        my = (W * Y).sum(axis=0) / sw
+        dx = np.where(W > 0, X - mx, 0)
+        dy = np.where(W > 0, Y - my, 0)
+        slope = (W * dx * dy).sum(axis=0) / (W * dx * dx).sum(axis=0)
+    intercept = my - slope * mx
+    return slope, intercept
+
+
+#ordinary least squares fit
+def fitOLS(X, Y):
+    X, Y = asMatrix(X), asMatrix(Y)
+    return weightedFit(X, Y, np.ones(X.shape))
+
+
+#robust fit by iteratively reweighted least squares with Tukey's bisquare weights, which ignores samples far from the fit
+#(e.g. large transients in the signal channel). c is the bisquare tuning constant in units of the residuals' robust SD.
+def fitIRLS(X, Y, iterations = 20, c = 4.685, tol = 1e-8):
+    X, Y = asMatrix(X), asMatrix(Y)
+    W = np.ones(X.shape)
+    slope, intercept = weightedFit(X, Y, W)
+    #columns which are still being refit
+    active = np.ones(X.shape[1], dtype=bool)
+    for x in range(iterations):
+        residual = Y - (intercept + slope * X)
+        scale = 1.4826 * np.nanmedian(np.abs(residual - np.nanmedian(residual, axis=0)), axis=0)
+        #a scale of 0 means most samples are exactly on the current fit (e.g. a perfectly linear pair with a few outliers),
+        #so the current estimate of that column is kept
+        active &= scale > 0
+        if not active.any():
+            break
+        u = residual / (c * np.where(active, scale, 1))
+        W = np.where(np.abs(u) < 1, (1 - u ** 2) ** 2, 0)
+        newSlope, newIntercept = weightedFit(X, Y, W)
+        newSlope = np.where(active, newSlope, slope)
+        newIntercept = np.where(active, newIntercept, intercept)
+        done = np.all(np.abs(newSlope - slope) <= tol * (1 + np.abs(slope)))
+        slope, intercept = newSlope, newIntercept
+        if done:
+            break
+    return slope, intercept
+
+
+#Least squares fit within a sliding window of width seconds centered on every sample, so the fit can follow slow bleaching.
+#Window sums are taken from cumulative sums, so the cost does not depend on the window width. Gaps in time (e.g. between the
+#recording windows of pulsed recordings) are respected, since windows are defined in time rather than in samples.
+#returns (samples x channels) arrays of slope and intercept
+def fitSliding(time, X, Y, width):
+    X, Y = asMatrix(X), asMatrix(Y)
+    time = np.asarray(time, dtype=float)
+    valid = ~(np.isnan(X) | np.isnan(Y))
+    #center every channel before summing to avoid losing precision in the cumulative sums
+    mx = np.nanmean(np.where(valid, X, np.nan), axis=0)
+    my = np.nanmean(np.where(valid, Y, np.nan), axis=0)
+    dx = np.where(valid, X - mx, 0)
+    dy = np.where(valid, Y - my, 0)
+
+    left = np.searchsorted(time, time - width / 2, side="left")
+    right = np.searchsorted(time, time + width / 2, side="right")
+
+    def windowSum(values):
+        sums = np.concatenate([np.zeros((1, values.shape[1])), np.cumsum(values, axis=0)])
+        return sums[right] - sums[left]
+
+    n = windowSum(valid.astype(float))
+    sx = windowSum(dx)
+    sy = windowSum(dy)
+    sxx = windowSum(dx * dx)
+    sxy = windowSum(dx * dy)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        slope = (n * sxy - sx * sy) / (n * sxx - sx * sx)
+        intercept = (sy - slope * sx) / n
+    #convert intercept back from centered units
+    intercept = intercept + my - slope * mx
+    return slope, intercept
+
+
+#returns dF/F of the signal against the fitted control, and its z-score over the whole recording
+def deltaF(X, Y, slope, intercept):
+    X, Y = asMatrix(X), asMatrix(Y)
+    fitted = intercept + slope * X
+    dFF = (Y - fitted) / fitted
+    z = (dFF - np.nanmean(dFF, axis=0)) / np.nanstd(dFF, axis=0, ddof=1)
+    return fitted, dFF, z
+
+
+#coefficient of determination and residual SD of a fit, per channel
+def fitQuality(X, Y, slope, intercept):
+    X, Y = asMatrix(X), asMatrix(Y)
+    residual = Y - (intercept + slope * X)
+    ssRes = np.nansum(residual ** 2, axis=0)
+    ssTot = np.nansum((Y - np.nanmean(Y, axis=0)) ** 2, axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        r2 = 1 - ssRes / ssTot
+    return r2, np.nanstd(residual, axis=0, ddof=1)
+
+
+def asMatrix(values):
+    values = np.asarray(values, dtype=float)
+    if values.ndim == 1:
+        values = values[:, np.newaxis]
+    return values
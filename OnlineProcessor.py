@@ -0,0 +1,615 @@
+import argparse
+import collections
+import io
+import json
+import os
+import select
+import socket
+import time
+import numpy as np
+import pandas as pd
+import EventAlignment
+import EventConfig
+import Instrumentation
+import PhotometryStruct
+import SessionCache
+import SignalProcessing
+
+#Live processing of a photometry recording while it is being recorded: samples and Med-Pc events are read from a tailed
+#.csv file or a local socket as they are written, cleaned and normalized as they arrive, and every trial updates the running
+#mean and SD of its event's peri-event trace as soon as the outcome period after it has been recorded.
+#   cleaning: the same TTL, cutoff and session bounds as PhotometryData.clean(). Pulsed recording windows are trimmed and
+#             binned when the next window starts, so pulsed data lags by one recording window.
+#   normalization: an ordinary least squares fit of every signal on its isosbestic channel, updated with every sample
+#             (see RunningFit), giving norm = signal / fitted control and dF/F = (signal - fit) / fit with the current fit.
+#   peri-event averages: Welford accumulators per event, time point and signal, see Welford.
+#Memory is bounded: only the last baseline + outcome + maxEventDelay seconds of processed samples are kept.
+#
+#   processor = OnlineProcessor.OnlineProcessor(type="pulsed", events={"id_trialStart": 71, "id_sessionStart": 1})
+#   processor.run(OnlineProcessor.TailSource("live.csv", "live_events.csv"), idleTimeout=30)
+#   processor.averages()["trialStart"]
+#
+#A recorded session can be replayed at real time (or faster) into a file or socket, to try the online mode without a rig:
+#   python OnlineProcessor.py replay session1.xlsx --to live.csv --events-to live_events.csv --speed 10
+#   python OnlineProcessor.py watch --tail live.csv --events live_events.csv --type pulsed --event id_trialStart=71
+
+#session and recording bookkeeping events, which are not trials
+BOOKKEEPING_EVENTS = ["id_sessionStart", "id_sessionEnd", "id_recordingStart", "id_recordingStop"]
+
+logger = Instrumentation.getLogger("online")
+
+
+#NaN-aware running mean and variance of arrays of a fixed shape (e.g. samples x signals of a peri-event trace), updated
+#one array at a time with Welford's algorithm, so the mean and SD are exact without keeping past trials.
+class Welford:
+    def __init__(self, shape):
+        self.count = np.zeros(shape, dtype=np.int64)
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape)
+        self.updates = 0
+
+    def update(self, values):
+        values = np.asarray(values, dtype=float)
+        valid = ~np.isnan(values)
+        values = np.where(valid, values, 0)
+        self.count += valid
+        delta = np.where(valid, values - self.mean, 0)
+        self.mean += delta / np.maximum(self.count, 1)
+        self.m2 += np.where(valid, delta * (values - self.mean), 0)
+        self.updates += 1
+
+    def average(self):
+        return np.where(self.count > 0, self.mean, np.nan)
+
+    def sd(self, ddof = 1):
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(self.count > ddof, np.sqrt(self.m2 / (self.count - ddof)), np.nan)
+
+
+#Ordinary least squares fit of Y on X for every column (channel pair), updated with batches of samples by merging the
+#batch's means and co-moments into the running ones (Chan et al.), so the fit of a whole recording never needs its samples.
+#Samples where either channel is nan are skipped.
+class RunningFit:
+    def __init__(self, numPairs):
+        self.n = np.zeros(numPairs)
+        self.meanX = np.zeros(numPairs)
+        self.meanY = np.zeros(numPairs)
+        self.m2X = np.zeros(numPairs)
+        self.cXY = np.zeros(numPairs)
+
+    def update(self, X, Y):
+        X, Y = np.asarray(X, dtype=float), np.asarray(Y, dtype=float)
+        valid = ~np.isnan(X) & ~np.isnan(Y)
+        m = valid.sum(axis=0)
+        if not m.any():
+            return
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mx = np.where(valid, X, 0).sum(axis=0) / m
+            my = np.where(valid, Y, 0).sum(axis=0) / m
+            dxs = np.where(valid, X - mx, 0)
+            m2x = (dxs ** 2).sum(axis=0)
+            cxy = (dxs * np.where(valid, Y - my, 0)).sum(axis=0)
+            total = self.n + m
+            dx, dy = mx - self.meanX, my - self.meanY
+            weight = self.n * m / total
+            update = m > 0
+            self.m2X = np.where(update, self.m2X + m2x + dx * dx * weight, self.m2X)
+            self.cXY = np.where(update, self.cXY + cxy + dx * dy * weight, self.cXY)
+            self.meanX = np.where(update, self.meanX + dx * m / total, self.meanX)
+            self.meanY = np.where(update, self.meanY + dy * m / total, self.meanY)
+        self.n = total
+
+    #(slope, intercept) of every pair, nan until a pair has two distinct isosbestic values
+    def params(self):
+        with np.errstate(invalid="ignore", divide="ignore"):
+            slope = np.where((self.n > 1) & (self.m2X > 0), self.cXY / self.m2X, np.nan)
+        return slope, self.meanY - slope * self.meanX
+
+
+class OnlineProcessor:
+    #type: "continuous" or "pulsed", events: Med-Pc event ids as in PhotometryData (id_sessionStart/End bound the session)
+    #baseline, outcome: seconds before and after every trial event of the peri-event traces
+    #cutoff, animalMap, gap, trim: as in PhotometryData and segmentWindows
+    #maxEventDelay: seconds events may arrive after the samples around them, which sets how much data is kept
+    #minFitSamples: samples needed before the running fit is used, norm and dFF are nan before that
+    #onTrial: optional function called as onTrial(eventName, trial (samples x signals array), accumulator) for every trial
+    def __init__(self, type = "continuous", events = None, baseline = 10, outcome = 10, cutoff = 0.009, animalMap = None,
+                 gap = 1, trim = 2, maxEventDelay = 10, minFitSamples = 100, onTrial = None):
+        self.data = PhotometryStruct.PhotometryData(type=type, cutoff=cutoff, id_eventsDict=dict(events or {}), animalMap=animalMap)
+        self.pulsed = type.upper() == "PULSED"
+        self.baseline = baseline
+        self.outcome = outcome
+        self.gap = gap
+        self.trim = trim
+        self.maxEventDelay = maxEventDelay
+        self.minFitSamples = minFitSamples
+        self.onTrial = onTrial
+        self.eventKeys = {value: key for key, value in self.data.id_events.items()}
+
+        #renamed columns of the incoming samples, the running fit and names of the processed signals, set by the first samples
+        self.columns = None
+        self.fit = None
+        self.signals = None
+        #processed samples of the last baseline + outcome + maxEventDelay seconds
+        self.time = np.zeros(0)
+        self.values = None
+        #pulsed recordings: samples of the window being recorded, and whether the first window boundary has been seen
+        self.carry = None
+        self.started = False
+        self.windows = 0
+        self.sessionStart = -np.inf
+        self.sessionEnd = np.inf
+        #(event name, time) of trials waiting for their outcome period
+        self.pending = []
+        self.accumulators = {}
+        #samples per second of the processed samples, fixed by the first trial so every trial has the same time axis
+        self.rate = None
+        self.timeAxis = None
+        self.latestTime = -np.inf
+        self.samplesIn = 0
+        self.samplesOut = 0
+        #processing time of the last batches in seconds
+        self.latency = collections.deque(maxlen=1000)
+
+    #Cleans and normalizes a batch of raw samples (columns as exported by Doric or RWD), updates the peri-event averages of
+    #trials which are now complete, and returns the processed samples (binned windows for pulsed recordings)
+    def addSamples(self, frame):
+        start = time.perf_counter()
+        if self.columns is None:
+            frame = self.data.renameColumns(frame)
+            self.data.mapChannels(frame.columns)
+            if len(self.data.channelPairs) < 1:
+                raise UserWarning("Could not find any isosbestic and signal channel pairs to normalize.")
+            self.columns = list(frame.columns)
+            self.fit = RunningFit(len(self.data.channelPairs))
+        else:
+            frame = frame.set_axis(self.columns, axis=1)
+        frame = frame.apply(pd.to_numeric, errors="coerce")
+        self.samplesIn += len(frame)
+
+        cleaned = self.cleanWindows(frame) if self.pulsed else frame.reset_index(drop=True)
+        processed = self.normalize(cleaned)
+        self.store(processed)
+        self.completeTrials()
+        self.latency.append(time.perf_counter() - start)
+        return processed
+
+    #Adds Med-Pc events (ID and secs columns): session bounds, and trials which are aligned once their outcome period is recorded
+    def addEvents(self, frame):
+        start = time.perf_counter()
+        for eventId, secs in zip(frame["ID"], pd.to_numeric(frame["secs"], errors="coerce")):
+            key = self.eventKeys.get(eventId)
+            if key is None or np.isnan(secs):
+                continue
+            if key == "id_sessionStart":
+                self.sessionStart = secs
+            elif key == "id_sessionEnd":
+                self.sessionEnd = secs
+            elif key not in BOOKKEEPING_EVENTS:
+                self.pending.append((key.split("_")[1], float(secs)))
+        self.completeTrials()
+        self.latency.append(time.perf_counter() - start)
+
+    #removes samples as clean() does and returns the samples of recording windows which have ended, trimmed and numbered
+    def cleanWindows(self, frame):
+        frame = frame[self.data.recordingMask(frame, self.sessionStart, self.sessionEnd)]
+        if self.carry is not None:
+            frame = pd.concat([self.carry, frame], ignore_index=True)
+        if len(frame) < 1:
+            return frame
+        windowId, keep = PhotometryStruct.segmentWindows(frame["Time"].to_numpy(), self.gap, self.trim)
+        last = windowId[-1]
+        if not self.started:
+            if last == 0:
+                #no time jump yet, so we cannot tell where the first full window starts
+                self.carry = frame
+                return frame.iloc[0:0]
+            #samples before the first jump belong to a window which started before the recording, so skip them
+            keep &= windowId > 0
+            self.started = True
+        #the last window may continue in the next batch
+        complete = keep & (windowId < last)
+        self.carry = frame[windowId == last].reset_index(drop=True)
+        return self.numberWindows(frame[complete], windowId[complete])
+
+    def numberWindows(self, frame, windowId):
+        frame = frame.reset_index(drop=True)
+        ids, number = np.unique(windowId, return_inverse=True)
+        frame["Window"] = number + self.windows
+        self.windows += len(ids)
+        return frame
+
+    #processed samples: Time (and Window), then norm and dFF of every pair computed with the running fit
+    def normalize(self, cleaned):
+        pairs = self.data.channelPairs
+        if self.signals is None:
+            self.signals = list(pairs.norm) + list(pairs.dFF)
+        columns = ["Time"] + (["Window"] if self.pulsed else []) + self.signals
+        if len(cleaned) < 1:
+            return pd.DataFrame(columns=columns, dtype=float)
+        X = cleaned[list(pairs.isosbestic)].to_numpy(dtype=float)
+        Y = cleaned[list(pairs.signal)].to_numpy(dtype=float)
+        self.fit.update(X, Y)
+        slope, intercept = self.fit.params()
+        slope = np.where(self.fit.n >= self.minFitSamples, slope, np.nan)
+        fitted = intercept + slope * X
+        with np.errstate(invalid="ignore", divide="ignore"):
+            values = np.concatenate([Y / fitted, (Y - fitted) / fitted], axis=1)
+        processed = pd.DataFrame(values, columns=self.signals)
+        processed.insert(0, "Time", cleaned["Time"].to_numpy(dtype=float))
+        if not self.pulsed:
+            return processed
+        processed.insert(1, "Window", cleaned["Window"].to_numpy())
+        binned = PhotometryStruct.binWindows(processed["Time"].to_numpy(), processed["Window"].to_numpy(), processed[self.signals])
+        return binned[columns]
+
+    #adds processed samples to the kept history, dropping samples too old to be part of any future trial
+    def store(self, processed):
+        if len(processed) > 0:
+            self.samplesOut += len(processed)
+            values = processed[self.signals].to_numpy(dtype=float)
+            self.time = np.concatenate([self.time, processed["Time"].to_numpy(dtype=float)])
+            self.values = values if self.values is None else np.concatenate([self.values, values])
+            self.latestTime = max(self.latestTime, self.time[-1])
+        keep = self.time >= self.latestTime - (self.baseline + self.outcome + self.maxEventDelay)
+        if not keep.all():
+            self.time = self.time[keep]
+            self.values = self.values[keep]
+
+    #aligns every pending trial whose outcome period has been recorded, or every pending trial if final is True.
+    #Trials need at least 2 kept samples, at the end of a recording with fewer the pending trials are logged and dropped
+    def completeTrials(self, final = False):
+        ready = [p for p in self.pending if final or p[1] + self.outcome <= self.latestTime]
+        if len(ready) < 1:
+            return
+        if len(self.time) < 2:
+            if final:
+                logger.warning("Warning: %d trial(s) were not averaged, the recording has %d processed sample(s)", len(ready), len(self.time))
+                self.pending = []
+            return
+        self.pending = [p for p in self.pending if p not in ready]
+        if self.rate is None:
+            self.rate = SignalProcessing.sampleRate(self.time)
+        for eventName in dict.fromkeys(p[0] for p in ready):
+            eventTimes = [p[1] for p in ready if p[0] == eventName]
+            aligned = EventAlignment.alignTrials(self.time, self.values, eventTimes, self.baseline, self.outcome, rate=self.rate)
+            self.timeAxis = aligned.Time
+            if eventName not in self.accumulators:
+                self.accumulators[eventName] = Welford(aligned.trials.shape[1:])
+            accumulator = self.accumulators[eventName]
+            for trial in aligned.trials:
+                accumulator.update(trial)
+                if self.onTrial is not None:
+                    self.onTrial(eventName, trial, accumulator)
+            logger.debug("%s: %d trial(s) averaged", eventName, accumulator.updates)
+
+    #processes what is left at the end of a recording: the last recording window and trials still waiting for data
+    def finish(self):
+        if self.pulsed and self.carry is not None and len(self.carry) > 0 and self.started:
+            windowId, keep = PhotometryStruct.segmentWindows(self.carry["Time"].to_numpy(), self.gap, self.trim)
+            self.store(self.normalize(self.numberWindows(self.carry[keep], windowId[keep])))
+            self.carry = None
+        self.completeTrials(final=True)
+        return self.averages()
+
+    #running peri-event average of every event as a dataframe with the Average, SD and number of trials (Trials) of signal
+    #at every point of the event-centric time axis (Time), as in EventAlignment.trialsFrame.
+    #signal: name of a processed signal (default the first norm column)
+    def averages(self, signal = None):
+        if self.signals is None:
+            return {}
+        column = self.signals.index(signal if signal is not None else self.signals[0])
+        frames = {}
+        for eventName, accumulator in self.accumulators.items():
+            frames[eventName] = pd.DataFrame({"Average": accumulator.average()[:, column], "SD": accumulator.sd()[:, column],
+                                              "Trials": accumulator.count[:, column], "Time": self.timeAxis})
+        return frames
+
+    #counts of samples, windows and trials, and the mean and largest processing time of the last batches in seconds
+    def status(self):
+        latency = np.array(self.latency) if len(self.latency) > 0 else np.array([np.nan])
+        return {"samplesIn": self.samplesIn, "samplesOut": self.samplesOut, "windows": self.windows, "latestTime": self.latestTime,
+                "pendingTrials": len(self.pending), "trials": {k: a.updates for k, a in self.accumulators.items()},
+                "keptSamples": len(self.time), "meanLatency": float(np.mean(latency)), "maxLatency": float(np.max(latency))}
+
+    #Processes everything a source delivers until it is closed, nothing arrived for idleTimeout seconds, or duration seconds
+    #have passed, then finishes the recording (see finish). Logs the status every logInterval seconds. Returns the averages.
+    def run(self, source, idleTimeout = None, duration = None, logInterval = 10, pollTimeout = 0.1):
+        start = time.monotonic()
+        lastData = start
+        lastLog = start
+        while True:
+            now = time.monotonic()
+            if duration is not None and now - start >= duration:
+                break
+            if idleTimeout is not None and now - lastData >= idleTimeout:
+                break
+            messages = source.read(pollTimeout)
+            for kind, frame in messages:
+                if kind == "samples":
+                    self.addSamples(frame)
+                elif kind == "events":
+                    self.addEvents(frame)
+            if len(messages) > 0:
+                lastData = time.monotonic()
+            elif source.closed:
+                break
+            if logInterval is not None and time.monotonic() - lastLog >= logInterval:
+                lastLog = time.monotonic()
+                logger.info("%s", self.status())
+        return self.finish()
+
+
+#################
+#### SOURCES ####
+#################
+
+#Follows a file which is being appended to, returning the rows written since the last read as a dataframe.
+#Rows are only returned once their line is complete. isHeader: function telling whether a line holds the column names,
+#lines above it are skipped (e.g. the metadata line of Doric exports)
+class TailFile:
+    def __init__(self, fpath, isHeader = None):
+        self.fpath = fpath
+        self.isHeader = isHeader if isHeader is not None else (lambda line: True)
+        self.position = 0
+        self.remainder = ""
+        self.header = None
+
+    def read(self):
+        if not os.path.exists(self.fpath):
+            return None
+        with open(self.fpath) as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell() < self.position:
+                #the file was replaced or truncated, start over
+                self.position, self.remainder, self.header = 0, "", None
+            f.seek(self.position)
+            text = self.remainder + f.read()
+            self.position = f.tell()
+        lines = text.split("\n")
+        self.remainder = lines.pop()
+        lines = [line for line in lines if line.strip() != ""]
+        if self.header is None:
+            for x, line in enumerate(lines):
+                if self.isHeader(line):
+                    self.header = next(iter(pd.read_csv(io.StringIO(line), header=None, dtype=str).itertuples(index=False)))
+                    lines = lines[x + 1:]
+                    break
+            else:
+                return None
+        if len(lines) < 1:
+            return None
+        return pd.read_csv(io.StringIO("\n".join(lines)), header=None, names=list(self.header))
+
+
+def isRecordingHeader(line):
+    first = line.split(",")[0].strip().strip('"')
+    return first == "Time(s)" or first.lower() == "timestamp"
+
+
+#Reads samples (a Doric or RWD .csv export being written) and optionally Med-Pc events (a .csv with ID and secs columns)
+#from files as they grow
+class TailSource:
+    def __init__(self, samplesPath, eventsPath = None, pollInterval = 0.05):
+        self.files = {"samples": TailFile(samplesPath, isRecordingHeader)}
+        if eventsPath is not None:
+            self.files["events"] = TailFile(eventsPath)
+        self.pollInterval = pollInterval
+        self.closed = False
+
+    #returns a list of ("samples" or "events", dataframe), waiting up to timeout seconds for data
+    def read(self, timeout = None):
+        deadline = time.monotonic() + (timeout or 0)
+        while True:
+            messages = []
+            for kind, tail in self.files.items():
+                frame = tail.read()
+                if frame is not None:
+                    messages.append((kind, frame))
+            if len(messages) > 0 or time.monotonic() >= deadline:
+                return messages
+            time.sleep(self.pollInterval)
+
+    def close(self):
+        self.closed = True
+
+
+#Listens on a local TCP port for samples and events sent as one JSON object per line:
+#   {"kind": "samples", "columns": ["Time(s)", ...], "rows": [[0.0, ...], ...]}
+#   {"kind": "events", "columns": ["ID", "secs"], "rows": [[71, 12.5], ...]}
+#closed becomes True once every client which connected has disconnected. port 0 picks a free port, see address
+class SocketSource:
+    def __init__(self, port = 0, host = "127.0.0.1"):
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind((host, port))
+        self.server.listen()
+        self.server.setblocking(False)
+        self.address = self.server.getsockname()
+        self.clients = {}
+        self.connected = False
+
+    @property
+    def closed(self):
+        return self.connected and len(self.clients) < 1
+
+    def read(self, timeout = None):
+        ready, _, _ = select.select([self.server] + list(self.clients), [], [], timeout)
+        messages = []
+        for sock in ready:
+            if sock is self.server:
+                client, _ = self.server.accept()
+                self.clients[client] = b""
+                self.connected = True
+                continue
+            data = sock.recv(1 << 20)
+            if not data:
+                del self.clients[sock]
+                sock.close()
+                continue
+            lines = (self.clients[sock] + data).split(b"\n")
+            self.clients[sock] = lines.pop()
+            for line in lines:
+                if line.strip():
+                    message = json.loads(line)
+                    messages.append((message["kind"], pd.DataFrame(message["rows"], columns=message["columns"])))
+        return messages
+
+    def close(self):
+        for sock in list(self.clients):
+            sock.close()
+        self.clients = {}
+        self.server.close()
+
+
+################
+#### REPLAY ####
+################
+
+#appends replayed samples and events to .csv files, as recording software would. Events are not written without eventsPath
+class FileSink:
+    def __init__(self, samplesPath, eventsPath = None):
+        if samplesPath is None:
+            raise ValueError("A file sink needs a samples .csv path to write to")
+        self.paths = {"samples": samplesPath, "events": eventsPath}
+        self.started = set()
+        for path in self.paths.values():
+            if path is not None and os.path.exists(path):
+                os.remove(path)
+
+    def write(self, kind, frame):
+        path = self.paths.get(kind)
+        if path is None and kind not in self.started:
+            logger.warning("Warning: no file was given for %s, they are not replayed", kind)
+            self.started.add(kind)
+        if path is None or len(frame) < 1:
+            return
+        with open(path, "a") as f:
+            frame.to_csv(f, header=kind not in self.started, index=False, lineterminator="\n")
+            f.flush()
+        self.started.add(kind)
+
+    def close(self):
+        pass
+
+
+#sends replayed samples and events to a SocketSource
+class SocketSink:
+    def __init__(self, address):
+        self.sock = socket.create_connection(tuple(address))
+
+    def write(self, kind, frame):
+        if len(frame) < 1:
+            return
+        message = {"kind": kind, "columns": [str(c) for c in frame.columns], "rows": frame.to_numpy().tolist()}
+        self.sock.sendall(json.dumps(message).encode() + b"\n")
+
+    def close(self):
+        self.sock.close()
+
+
+#(samples, events) of a recorded session: a photometry workbook, or a Doric/RWD .csv export with an optional events .csv
+def readRecording(fpath, eventsPath = None):
+    if fpath.lower().endswith(".csv"):
+        samples = pd.read_csv(fpath, header=PhotometryStruct.findCSVHeader(fpath))
+        events = None
+    else:
+        sheets = SessionCache.readSheets(fpath, {"photometry": {"sheet_name": 0, "header": 1}, "events": {"sheet_name": "Events", "header": 0}})
+        samples, events = sheets.get("photometry"), sheets.get("events")
+    if eventsPath is not None:
+        events = pd.read_csv(eventsPath)
+    if samples is None:
+        raise RuntimeError("Could not read photometry data from " + str(fpath))
+    return samples, events
+
+
+#Feeds a recorded session to sink (FileSink or SocketSink) in batches of batchSeconds of recording time, at speed times
+#real time (speed None or 0 sends everything as fast as possible). Events are sent with the batch their time falls in.
+#Returns the number of samples and events sent and the wall time it took.
+def replay(samples, sink, events = None, speed = 1.0, batchSeconds = 0.1):
+    sampleTimes = samples.iloc[:, 0].to_numpy(dtype=float)
+    eventTimes = events["secs"].to_numpy(dtype=float) if events is not None else np.zeros(0)
+    if len(sampleTimes) < 1:
+        return {"samples": 0, "events": 0, "seconds": 0.0}
+    origin = sampleTimes[0]
+    ends = np.arange(origin + batchSeconds, max(sampleTimes[-1], eventTimes.max() if len(eventTimes) > 0 else origin) + batchSeconds, batchSeconds)
+    sampleStops = np.searchsorted(sampleTimes, ends, side="left")
+    #events before the recording start go with the first batch
+    eventOrder = np.argsort(eventTimes, kind="stable")
+    eventStops = np.searchsorted(eventTimes[eventOrder], ends, side="left")
+    start = time.monotonic()
+    sampleStart = eventStart = 0
+    for end, sampleStop, eventStop in zip(ends, sampleStops, eventStops):
+        if speed:
+            wait = start + (end - origin) / speed - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+        if sampleStop > sampleStart:
+            sink.write("samples", samples.iloc[sampleStart:sampleStop])
+            sampleStart = sampleStop
+        if eventStop > eventStart:
+            sink.write("events", events.iloc[eventOrder[eventStart:eventStop]])
+            eventStart = eventStop
+    if sampleStart < len(samples):
+        sink.write("samples", samples.iloc[sampleStart:])
+    if events is not None and eventStart < len(events):
+        sink.write("events", events.iloc[eventOrder[eventStart:]])
+    sink.close()
+    return {"samples": len(samples), "events": len(eventTimes), "seconds": time.monotonic() - start}
+
+
+def parseArgs(argv = None):
+    parser = argparse.ArgumentParser(description="Live processing of photometry recordings, and replay of recorded sessions")
+    commands = parser.add_subparsers(dest="command", required=True)
+    replayArgs = commands.add_parser("replay", help="feed a recorded session to a file or socket as if it was being recorded")
+    replayArgs.add_argument("recording", help="photometry workbook, or Doric/RWD .csv export")
+    replayArgs.add_argument("--events", help="Med-Pc events .csv (ID and secs columns), default the Events sheet of the workbook")
+    destination = replayArgs.add_mutually_exclusive_group(required=True)
+    destination.add_argument("--to", help="samples .csv file to append to")
+    destination.add_argument("--port", type=int, help="send to a watch --port process on this local port instead")
+    replayArgs.add_argument("--events-to", help="events .csv file to append to (with --to)")
+    replayArgs.add_argument("--speed", type=float, default=1.0, help="times real time, 0 for as fast as possible (default 1)")
+    watchArgs = commands.add_parser("watch", help="process samples and events as they are recorded")
+    source = watchArgs.add_mutually_exclusive_group(required=True)
+    source.add_argument("--tail", help="samples .csv file being written")
+    source.add_argument("--port", type=int, help="listen for samples and events on this local port instead")
+    watchArgs.add_argument("--events", help="events .csv file being written (with --tail)")
+    watchArgs.add_argument("--type", choices=["continuous", "pulsed"], default="continuous", help="recording type (default continuous)")
+    watchArgs.add_argument("--event", action="append", help="Med-Pc event id as name=id, can be repeated, e.g. id_trialStart=71")
+    watchArgs.add_argument("--baseline", type=float, default=10, help="seconds before every event (default 10)")
+    watchArgs.add_argument("--outcome", type=float, default=10, help="seconds after every event (default 10)")
+    watchArgs.add_argument("--idle", type=float, default=30, help="stop after this many seconds without data (default 30)")
+    watchArgs.add_argument("--out", help="directory to write the peri-event averages of every event to when the recording ends")
+    return parser.parse_args(argv)
+
+
+def main(argv = None):
+    args = parseArgs(argv)
+    if args.command == "replay":
+        samples, events = readRecording(args.recording, args.events)
+        sink = SocketSink(("127.0.0.1", args.port)) if args.port is not None else FileSink(args.to, args.events_to)
+        stats = replay(samples, sink, events, args.speed)
+        logger.info("Replayed %d samples and %d events in %.1f s", stats["samples"], stats["events"], stats["seconds"])
+        return 0
+
+    events = EventConfig.parseEvents(args.event and ";".join(args.event))
+    processor = OnlineProcessor(type=args.type, events=events, baseline=args.baseline, outcome=args.outcome)
+    if args.port is not None:
+        source = SocketSource(args.port)
+        logger.info("Listening on %s:%d", *source.address)
+    else:
+        source = TailSource(args.tail, args.events)
+    try:
+        averages = processor.run(source, idleTimeout=args.idle)
+    finally:
+        source.close()
+    logger.info("%s", processor.status())
+    for eventName, frame in averages.items():
+        if args.out is not None:
+            os.makedirs(args.out, exist_ok=True)
+            frame.to_csv(os.path.join(args.out, eventName + "_online.csv"), index=False)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,227 @@
+import concurrent.futures
+import contextlib
+import itertools
+import logging
+import os
+import numpy as np
+import pandas as pd
+import Instrumentation
+import IsosbesticFit
+import PhotometryStruct
+import BehaviorStruct
+import PipelineDAG
+import PoseData
+import SharedSession
+import SignalProcessing
+import VelocityEngine
+
+#Sweeps cleaning and normalization parameters over a grid, returning a table of quality metrics per combination, to choose
+#settings without running the whole pipeline by hand for every value.
+#The session is read once. Its raw numeric columns are placed in shared memory (see SharedSession), which every worker
+#process attaches to, so workers start without receiving a pickled copy of the recording. Combinations with the same cleaning
+#parameters are cleaned once and normalized for every normalization setting.
+#
+#   grid = {"cutoff": [0.005, 0.009, 0.02], "numSamples": [10, 20, 50], "autoFlProfile": [0, 0.01], "useIntercept": [True]}
+#   metrics = ParameterSweep.sweepPhotometry("session1.xlsx", grid, type="pulsed", events=events, workers=8)
+#   metrics = ParameterSweep.sweepBehavior(behaviorData, {"threshold": [0.5, 0.6, 0.8, 0.95], "maxGap": [0, 5, 15]})
+
+#parameters of PhotometryData which change what clean() keeps, and parameters of normalize()
+PHOTOMETRY_CLEAN_PARAMS = {"cutoff": 0.009}
+PHOTOMETRY_NORM_PARAMS = {"autoFlProfile": 0, "numSamples": 20, "useIntercept": False, "method": "endpoints", "window": 60}
+BEHAVIOR_PARAMS = {"threshold": 0.6, "maxGap": 0}
+
+logger = Instrumentation.getLogger("sweep")
+
+#state of a worker process: the attached session, which stays attached for the life of the worker
+_worker = {}
+
+
+#expands {name: [values]} into a list of {name: value} dictionaries, one per combination. Lists of dictionaries are returned as is
+def expandGrid(grid):
+    if isinstance(grid, dict):
+        names = list(grid)
+        return [dict(zip(names, values)) for values in itertools.product(*[list(grid[n]) for n in names])]
+    return [dict(combination) for combination in grid]
+
+
+#raises a TypeError naming any parameter which cannot be swept
+def checkParams(combinations, known):
+    unknown = sorted(set(name for combination in combinations for name in combination) - set(known))
+    if len(unknown) > 0:
+        raise TypeError("Cannot sweep parameter(s) " + ", ".join(unknown) + ". Parameters: " + ", ".join(known))
+
+
+#runs the body with the pipeline's messages limited to warnings, as every combination would otherwise log its progress
+@contextlib.contextmanager
+def quiet(level = logging.WARNING):
+    base = logging.getLogger(Instrumentation.LOGGER_NAME)
+    previous = base.level
+    base.setLevel(max(level, previous))
+    try:
+        yield
+    finally:
+        base.setLevel(previous)
+
+
+#Shares session, then runs tasks with function in a pool of workers which attach to it first, or in this process if
+#workers is 1. Tasks read the session from _worker["session"].data
+def runTasks(function, tasks, session, workers):
+    with SharedSession.SharedSession(session) as shared:
+        if workers == 1 or len(tasks) < 2:
+            initWorker(shared.handle, quietLogs=False)
+            try:
+                with quiet():
+                    return [function(task) for task in tasks]
+            finally:
+                _worker.pop("session").close()
+        workers = min(workers or os.cpu_count() or 1, len(tasks))
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=initWorker, initargs=(shared.handle,)) as pool:
+            return list(pool.map(function, tasks))
+
+
+def initWorker(handle, quietLogs = True):
+    _worker["session"] = SharedSession.attach(handle)
+    if quietLogs:
+        logging.getLogger(Instrumentation.LOGGER_NAME).setLevel(logging.WARNING)
+
+
+###########################
+#### PHOTOMETRY SWEEPS ####
+###########################
+
+#Sweeps cleaning (cutoff) and normalization (autoFlProfile, numSamples, useIntercept, method, window) parameters of a
+#photometry session. session: path of a workbook, or a PhotometryData whose data has been read (pt_raw and timestamp_data)
+#grid: {parameter: [values]} or a list of {parameter: value}, parameters which are not given keep their defaults
+#Returns one row per combination and channel pair with the parameters and:
+#   samples: samples kept by clean(), windows: recording windows found (pulsed recordings), intercept: normalization intercept,
+#   r2, residualSD: quality of the isosbestic fit (of the normalization method, or of an OLS fit for "endpoints"),
+#   normSD: SD of the normalized signal, error: why the combination failed, if it did
+def sweepPhotometry(session, grid, type = "pulsed", events = None, animalMap = None, workers = None):
+    if isinstance(session, PhotometryStruct.PhotometryData):
+        data = session
+    else:
+        data = PhotometryStruct.PhotometryData(type=type, id_eventsDict=events or {}, animalMap=animalMap)
+        data.readData(session)
+    if data.pt_raw is None:
+        raise UserWarning("No photometry data has been added to this struct. Call readData(fpath) before proceeding")
+
+    combinations = expandGrid(grid)
+    checkParams(combinations, list(PHOTOMETRY_CLEAN_PARAMS) + list(PHOTOMETRY_NORM_PARAMS))
+    combinations = [dict(PHOTOMETRY_CLEAN_PARAMS, **dict(PHOTOMETRY_NORM_PARAMS, **c)) for c in combinations]
+    #one task per cleaning setting, holding the normalization settings to run on the cleaned data. Settings are split into
+    #several tasks if there are fewer of them than workers, so that every worker gets a share of the normalizations
+    workers = workers or os.cpu_count() or 1
+    groups = {}
+    for combination in combinations:
+        cleanParams = tuple((name, combination[name]) for name in PHOTOMETRY_CLEAN_PARAMS)
+        groups.setdefault(cleanParams, []).append(combination)
+    size = max(int(np.ceil(len(combinations) / workers)), 1)
+    tasks = [group[x:x + size] for group in groups.values() for x in range(0, len(group), size)]
+
+    #only the raw data and the settings clean() needs are sent to workers
+    source = PhotometryStruct.PhotometryData(type=data.type, id_eventsDict=data.id_events, animalMap=data.animalMap, compact=data.compact)
+    source.pt_raw = data.pt_raw
+    source.timestamp_data = data.timestamp_data
+    logger.info("Sweeping %d combination(s) in %d cleaning setting(s)...", len(combinations), len(groups))
+    results = runTasks(photometryTask, tasks, source, workers)
+    return pd.DataFrame([row for rows in results for row in rows])
+
+
+#cleans the shared recording once with the cleaning parameters of the task's combinations, then normalizes it with each
+def photometryTask(combinations):
+    data = PipelineDAG.snapshot(_worker["session"].data)
+    data.cutoff = combinations[0]["cutoff"]
+    rows = []
+    try:
+        data.clean()
+    except Exception as e:
+        return [dict(c, error=repr(e)) for c in combinations]
+    for combination in combinations:
+        rows.extend(photometryMetrics(PipelineDAG.snapshot(data), combination))
+    return rows
+
+
+def photometryMetrics(data, combination):
+    try:
+        data.autoFlProfile = combination["autoFlProfile"]
+        data.normalize(numSamples=combination["numSamples"], useIntercept=combination["useIntercept"],
+                       method=combination["method"], window=combination["window"])
+    except Exception as e:
+        return [dict(combination, error=repr(e))]
+    pairs = data.channelPairs
+    X = data.pt_cleaned[list(pairs.isosbestic)].to_numpy(dtype=float)
+    Y = data.pt_cleaned[list(pairs.signal)].to_numpy(dtype=float)
+    fit = data.fitParams
+    if "r2" in fit.columns:
+        r2, residualSD = fit["r2"].to_numpy(), fit["residualSD"].to_numpy()
+    else:
+        r2, residualSD = IsosbesticFit.fitQuality(X, Y, *IsosbesticFit.fitOLS(X, Y))
+    normSD = np.nanstd(data.pt_cleaned[list(pairs.norm)].to_numpy(dtype=float), axis=0, ddof=1) if len(X) > 1 else np.full(len(pairs), np.nan)
+    windows = data.pt_cleaned["Window"].nunique() if "Window" in data.pt_cleaned.columns else np.nan
+    rows = []
+    for x, signal in enumerate(pairs.signal):
+        rows.append(dict(combination, signal=signal, samples=len(data.pt_cleaned), windows=windows,
+                         intercept=float(np.atleast_1d(fit["intercept"].to_numpy(dtype=float))[x]), r2=float(r2[x]),
+                         residualSD=float(residualSD[x]), normSD=float(normSD[x]), error=None))
+    return rows
+
+
+#########################
+#### BEHAVIOR SWEEPS ####
+#########################
+
+#Sweeps the DeepLabCut likelihood threshold and the largest interpolated gap (maxGap) of a behavioral session.
+#session: a BehaviorData whose DeepLabCut data has been read (readData or readFiles), or the path of a DeepLabCut .h5/.csv file
+#Returns one row per combination and body part with the parameters and:
+#   frames: frames of the recording, framesKept: frames with a position after thresholding and interpolation,
+#   fractionKept: framesKept / frames, longestGap: longest run of frames without a position,
+#   locomotion: total locomotion of the part in pixels (see VelocityEngine.calcVelocity)
+def sweepBehavior(session, grid, workers = None):
+    if isinstance(session, BehaviorStruct.BehaviorData):
+        parts, coords = behaviorPose(session)
+    else:
+        parts, coords = PoseData.readDLC(session)
+    combinations = expandGrid(grid)
+    checkParams(combinations, list(BEHAVIOR_PARAMS))
+    combinations = [dict(BEHAVIOR_PARAMS, **c) for c in combinations]
+
+    logger.info("Sweeping %d combination(s) over %d part(s)...", len(combinations), len(parts))
+    results = runTasks(behaviorTask, combinations, {"parts": parts, "coords": np.ascontiguousarray(coords, dtype=float)}, workers)
+    return pd.DataFrame([row for rows in results for row in rows])
+
+
+#(parts, frames x parts x 3 array) of the DeepLabCut data of a BehaviorData, before any thresholding
+def behaviorPose(data):
+    if data.beh_data is None:
+        raise UserWarning("No behavioral data has been added to this struct. Call readData(fpath) or readFiles(...) first")
+    if data.beh_data.columns[0] == "scorer":
+        return PoseData.parseDLCSheet(data.beh_data)
+    if len(data.bodyParts) > 0 and list(data.beh_data.columns) == PoseData.flatColumns(data.bodyParts):
+        return data.bodyParts, data.beh_data.to_numpy(dtype=float).reshape(-1, len(data.bodyParts), 3)
+    raise TypeError("Only DeepLabCut data can be swept, got columns " + str(list(data.beh_data.columns[0:5])))
+
+
+#thresholds and interpolates every part as BehaviorData.clean does, and measures what is left
+def behaviorTask(combination):
+    parts = _worker["session"].data["parts"]
+    coords = _worker["session"].data["coords"].copy()
+    PoseData.applyThreshold(coords, combination["threshold"])
+    if combination["maxGap"] > 0:
+        coords[:, :, 0:2] = SignalProcessing.interpolateGaps(coords[:, :, 0:2], combination["maxGap"])
+    vel, locomotion = VelocityEngine.calcVelocity(coords[:, :, 0:2])
+    kept = ~np.isnan(coords[:, :, 0])
+    frames = coords.shape[0]
+    rows = []
+    for x, part in enumerate(parts):
+        rows.append(dict(combination, part=part, frames=frames, framesKept=int(kept[:, x].sum()),
+                         fractionKept=float(kept[:, x].mean()) if frames > 0 else np.nan,
+                         longestGap=longestRun(~kept[:, x]), locomotion=float(locomotion[x])))
+    return rows
+
+
+#length of the longest run of True values
+def longestRun(mask):
+    if not mask.any():
+        return 0
+    edges = np.flatnonzero(np.diff(np.concatenate([[0], mask.astype(np.int8), [0]])))
+    return int((edges[1::2] - edges[0::2]).max())
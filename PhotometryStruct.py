@@ -1,10 +1,144 @@
+import os
+import numpy as np
 import pandas as pd
 import openpyxl
 import math
+import re
+import SessionCache
+import EventAlignment
+import EventIndex
+import IsosbesticFit
+import SignalProcessing
+import Instrumentation
+
+logger = Instrumentation.getLogger("photometry")
+
+#column names of Doric recordings, single channel only
+DORIC_MAPPING = {"Time(s)": "Time", "AIn-1 - Dem (AOut-1)": "_405", "AIn-1 - Dem (AOut-2)": "_465",
+                 "DI/O-3": "TTL_6", "DI/O-4": "TTL_8"}
+#excitation wavelengths (nm) which are treated as the isosbestic control, every other wavelength is a signal
+ISOSBESTIC_WAVELENGTHS = range(400, 421)
+
+
+#Given the columns of a recording, returns a dataframe with one row per photometry channel, holding the column name,
+#fiber number, excitation wavelength, whether it is an isosbestic control, and the animal it was recorded from.
+#Recognizes RWD style (CH1-410, CH1-470, CH2-410, ...) and Doric style (_405, _465, single fiber) column names.
+#animalMap: optional dictionary of {fiber number: animal}, by default every fiber is its own animal
+def mapChannels(columns, animalMap = None):
+    rows = []
+    for col in columns:
+        match = re.fullmatch(r"CH(\d+)-(\d+)", str(col), re.IGNORECASE)
+        if match is not None:
+            channel, wavelength = int(match.group(1)), int(match.group(2))
+        else:
+            match = re.fullmatch(r"_(\d+)", str(col))
+            if match is None:
+                continue
+            channel, wavelength = 1, int(match.group(1))
+        animal = channel if animalMap is None else animalMap.get(channel, channel)
+        rows.append([col, channel, wavelength, wavelength in ISOSBESTIC_WAVELENGTHS, animal])
+    return pd.DataFrame(rows, columns=["column", "channel", "wavelength", "isosbestic", "animal"])
+
+
+#Given a channel map (see mapChannels), pairs every signal channel with the isosbestic channel of the same fiber.
+#Returns a dataframe with one row per pair, holding the isosbestic, signal and normalized column names, fiber and animal.
+#The normalized column of a Doric recording is called norm, RWD ones are named after the signal column (e.g. CH1-470_norm),
+#and likewise for the fitted control (fit), dF/F (dFF) and z-scored dF/F (z) columns written by the fit methods of normalize()
+def pairChannels(channels):
+    pairs = []
+    for channel, group in channels.groupby("channel", sort=True):
+        iso = group[group.isosbestic]
+        if len(iso) < 1:
+            continue
+        for row in group[~group.isosbestic].itertuples():
+            prefix = "" if row.column == "_465" else str(row.column) + "_"
+            pairs.append([iso.column.iloc[0], row.column, prefix + "norm", prefix + "fit", prefix + "dFF", prefix + "z", channel, row.animal])
+    return pd.DataFrame(pairs, columns=["isosbestic", "signal", "norm", "fit", "dFF", "z", "channel", "animal"])
+
+
+#Given an array of sample times, splits a pulsed recording into recording windows wherever the time jumps by more than gap seconds.
+#Returns an integer window id for every sample (0 for samples before the first jump, 1 for the first full window, etc.)
+#and a boolean mask which is False for the first and last trim samples of every window, where the laser was partially on/off
+def segmentWindows(time, gap = 1, trim = 2):
+    time = np.asarray(time, dtype=float)
+    numSamples = len(time)
+    starts = np.flatnonzero(np.diff(time) > gap) + 1
+    windowId = np.zeros(numSamples, dtype=np.int64)
+    windowId[starts] = 1
+    windowId = np.cumsum(windowId)
+
+    #position of each sample relative to the first and last sample of its window
+    bounds = np.concatenate([[0], starts, [numSamples]])
+    pos = np.arange(numSamples)
+    keep = (pos - bounds[windowId] >= trim) & (bounds[windowId + 1] - pos > trim)
+    return windowId, keep
+
+
+#Given sample times, a non-decreasing integer window id for every sample and a dataframe of signal columns, returns one row per window
+#with the window id, mean time, start and end time, number of samples and the mean, median and SD of every signal column.
+#Means take the signal column's own name so that binned data can be used in place of cleaned data. Nan samples are ignored.
+def binWindows(time, windowId, signals):
+    starts = np.flatnonzero(np.diff(windowId) != 0) + 1
+    starts = np.concatenate([[0], starts])
+    ends = np.concatenate([starts[1:], [len(windowId)]])
+    counts = ends - starts
+
+    binned = {"Window": windowId[starts], "Time": np.add.reduceat(time, starts) / counts,
+              "StartTime": time[starts], "EndTime": time[ends - 1], "Samples": counts}
+    values = signals.to_numpy(dtype=float)
+    valid = ~np.isnan(values)
+    n = np.add.reduceat(valid, starts, axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.add.reduceat(np.where(valid, values, 0), starts, axis=0) / n
+        dev = np.where(valid, values - np.repeat(mean, counts, axis=0), 0)
+        sd = np.sqrt(np.add.reduceat(dev ** 2, starts, axis=0) / (n - 1))
+    sd[n < 2] = np.nan
+    median = signals.groupby(windowId, sort=False).median().to_numpy(dtype=float)
+
+    for x in range(len(signals.columns)):
+        col = signals.columns[x]
+        binned[col] = mean[:, x]
+        binned[str(col) + "_median"] = median[:, x]
+        binned[str(col) + "_SD"] = sd[:, x]
+    return pd.DataFrame(binned)
+
+
+#returns the row number of the column header line of a native Doric (Time(s)) or RWD (Timestamp) .csv export
+#both systems may write a line of metadata above the column headers
+def findCSVHeader(fpath, maxLines = 10):
+    with open(fpath) as f:
+        for x in range(maxLines):
+            first = f.readline().split(",")[0].strip().strip('"')
+            if first == "Time(s)" or first.lower() == "timestamp":
+                return x
+    raise RuntimeError("Could not find a Doric (Time(s)) or RWD (Timestamp) header in " + str(fpath))
+
+
+#makes the arrays behind every numpy column of frame read-only, so that in-place writes to frame raise instead of changing it.
+#Frames which share its data (e.g. the renamed frame of renameColumns) still copy the columns they modify. Returns frame
+def lockFrame(frame):
+    for x in range(frame.shape[1]):
+        if isinstance(frame.dtypes.iloc[x], np.dtype):
+            base = frame.iloc[:, x].to_numpy()
+            while isinstance(base.base, np.ndarray):
+                base = base.base
+            base.flags.writeable = False
+    return frame
+
+
+#returns frame with every float64 column except the first (time, which needs the full precision) stored as float32
+def compactFrame(frame):
+    dtypes = {}
+    for col in frame.columns[1:]:
+        if frame[col].dtype == np.float64:
+            dtypes[col] = np.float32
+    if len(dtypes) < 1:
+        return frame
+    return frame.astype(dtypes)
 
 
 class PhotometryData:
-    def __init__(self, type="CONTINUOUS", autoFlProfile=0, cutoff=0.009, id_eventsDict = {}):
+    def __init__(self, type="CONTINUOUS", autoFlProfile=0, cutoff=0.009, id_eventsDict = {}, useCache = True, animalMap = None, compact = False):
         self.autoFlProfile = autoFlProfile
         #threshold value which we remove samples under (these are samples which the laser was not active for in pulsed recordings)
         self.cutoff = cutoff
@@ -14,15 +148,26 @@ class PhotometryData:
         self.pt_cleaned = None
         self.pt_binned = None
         self.pt_alignedEvents = {}
+        #(trials x samples x signals) arrays behind pt_alignedEvents, see EventAlignment.AlignedTrials
+        self.pt_alignedTrials = {}
         self.numChan = 1
+        self.numAnimals = 1
+        #channel to animal and wavelength mapping (see mapChannels), and isosbestic/signal pairs (see pairChannels)
+        self.animalMap = animalMap
+        self.channels = None
+        self.channelPairs = None
 
         #Med-Pc Data
         self.timestamp_data = None
         #dictonary of ID ints for Med-Pc Events
         self.id_events = id_eventsDict
+        #sorted times of every Med-Pc ID, see eventIndex()
+        self.timestamp_index = None
 
-        #normaliztion constant, which is functionally the slope from the caluclated linear regression
+        #normaliztion constant, which is the intercept of the line between the start and end of the recording
         self.normConst = 0
+        #parameters of the isosbestic fit of every channel pair, see normalize()
+        self.fitParams = None
 
         #type of recording
         self.type = type
@@ -30,187 +175,439 @@ class PhotometryData:
         #recording hardware
         self.recorderType = None
 
-    #Helper function which takes a Med-Pc ID integer and returns a pandas dataframe with all of the timestamps for that ID
+        #whether parsed excel sheets are stored in (and loaded from) the session cache
+        self.useCache = useCache
+        #store signal columns as float32 instead of float64, halving their memory use
+        self.compact = compact
+
+    #Helper function which takes a Med-Pc ID integer and returns a sorted, read-only array with all of the timestamps for that ID
     def getMPCTimes(self, timestampID):
-        if self.timestamp_data is not None:
-            tmp = self.timestamp_data[self.timestamp_data.ID == timestampID].secs
-            return tmp.values
-        else:
-            raise UserWarning("Cannot retrieve timestamps from empty Med-pc dataframe. Does the original data include Med-Pc Data?")
+        return self.eventIndex().get(timestampID)
 
-    #work in progress
-    def alignEvents(self):
+    #index of the Med-Pc timestamps (see EventIndex), built when the data is read and rebuilt if timestamp_data is replaced
+    def eventIndex(self):
+        if self.timestamp_data is None:
+            raise UserWarning("Cannot retrieve timestamps from empty Med-pc dataframe. Does the original data include Med-Pc Data?")
+        if self.timestamp_index is None or not self.timestamp_index.isCurrent(self.timestamp_data):
+            self.timestamp_index = EventIndex.fromMedPC(self.timestamp_data)
+        return self.timestamp_index
+
+    #aligns photometry signals to each type of event in the id_eventsDict, from baseline seconds before to outcome seconds after each event
+    #pulsed recordings are aligned using the binned data (one sample per recording window) if binData() has been run
+    #signal: name of the signal summarized in pt_alignedEvents (defaults to norm if the data has been normalized)
+    #the (trials x samples x signals) arrays of every signal are stored in pt_alignedTrials
+    @Instrumentation.stage("align", rowsIn="pt_cleaned", rowsOut="pt_alignedTrials")
+    def alignEvents(self, signal = None, baseline = 10, outcome = 10):
         if self.timestamp_data is None:
             raise UserWarning("Cannot align events to non-existent Med-Pc Data")
-        else:
-            trials = []
-            try:
-                id_trialStart = self.id_events["id_trialStart"]
-                trials = self.getMPCTimes(id_trialStart)
-            except:
-                raise TypeError("No Med-pc events for id_trialStart")
+        if self.pt_cleaned is None:
+            raise UserWarning("This data has not been cleaned. Please run clean() before proceeding.")
 
+        data = self.pt_cleaned
+        if self.type.upper() == "PULSED" and self.pt_binned is not None:
+            data = self.pt_binned
+        signals = self.signalColumns()
+        if signal is None:
+            signal = "norm" if "norm" in signals else signals[0]
+
+        logger.info("Aligning photometry data to timestamps...")
+        time = data["Time"].to_numpy(dtype=float)
+        for key, value in self.id_events.items():
+            #session and recording bookkeeping events are not trials
+            if key in ["id_sessionStart", "id_sessionEnd", "id_recordingStart", "id_recordingStop"]:
+                continue
+            eventName = key.split("_")
+            eventName = eventName[1]
+            logger.info("Processing event %s ...", eventName)
+            aligned = EventAlignment.alignTrials(time, data[signals], self.getMPCTimes(value), baseline, outcome)
+            self.pt_alignedTrials[eventName] = aligned
+            self.pt_alignedEvents[eventName] = EventAlignment.trialsFrame(aligned, signal)
+
+    #names of the signal columns of the cleaned data (everything except time, TTL and window bookkeeping columns)
+    def signalColumns(self):
+        cols = []
+        for col in self.pt_cleaned.columns:
+            if col in ["Time", "Window", "StartIdx"] or str(col).startswith("TTL"):
+                continue
+            if pd.api.types.is_numeric_dtype(self.pt_cleaned[col]):
+                cols.append(col)
+        return cols
+
+    #Filters the signal columns of the cleaned data in place with a zero-phase Butterworth filter, all channels at once.
+    #Run before normalize() to filter the raw channels. lowpass and highpass are cutoff frequencies in Hz (either or both),
+    #e.g. lowpass=10 removes high frequency noise and highpass=0.01 removes slow bleaching.
+    #Recording windows of pulsed recordings are filtered separately, so the filter does not bridge the gaps between them.
+    #columns: signal columns to filter (default every signal column)
+    @Instrumentation.stage("filter", rowsIn="pt_cleaned", rowsOut="pt_cleaned")
+    def filterSignals(self, lowpass = None, highpass = None, order = 4, columns = None):
+        if self.pt_cleaned is None:
+            raise UserWarning("This data has not been cleaned. Please run clean() before proceeding.")
+        columns = columns or self.signalColumns()
+        segments = self.pt_cleaned["Window"].to_numpy() if "Window" in self.pt_cleaned.columns else None
+        rate = SignalProcessing.sampleRate(self.pt_cleaned["Time"].to_numpy(), segments)
+        values = self.pt_cleaned[columns].to_numpy(dtype=float)
+        values = SignalProcessing.bandFilter(values, rate, lowpass, highpass, order, segments)
+        self.pt_cleaned[columns] = values.astype(np.float32 if self.compact else np.float64)
+        logger.info("Filtered %d channel(s) recorded at %.1f Hz (lowpass %s Hz, highpass %s Hz)", len(columns), rate, lowpass, highpass)
+
+    #Reduces continuous recordings to targetRate samples per second, low-pass filtering every signal first so that faster
+    #fluctuations do not alias into the kept samples. Time and TTL columns keep the value of every kept sample.
+    @Instrumentation.stage("filter", rowsIn="pt_cleaned", rowsOut="pt_cleaned")
+    def decimate(self, targetRate):
+        if self.pt_cleaned is None:
+            raise UserWarning("This data has not been cleaned. Please run clean() before proceeding.")
+        if self.type.upper() == "PULSED":
+            raise TypeError("Recording type is pulsed. Use binData() to reduce pulsed recordings to one sample per window")
+        columns = self.signalColumns()
+        rate = SignalProcessing.sampleRate(self.pt_cleaned["Time"].to_numpy())
+        values, factor = SignalProcessing.decimate(self.pt_cleaned[columns].to_numpy(dtype=float), rate, targetRate)
+        if factor > 1:
+            decimated = self.pt_cleaned.iloc[::factor].reset_index(drop=True)
+            decimated[columns] = values.astype(np.float32 if self.compact else np.float64)
+            self.pt_cleaned = decimated
+        logger.info("Decimated from %.1f Hz to %.1f Hz", rate, rate / factor)
 
     #uses cleaned data from pulsed recordings to create bins of each recording window
-    #for each recording window, takes the mean of the signal.
-    def binData(self):
-        if self.type.upper() == "PULSED":
-            raise TypeError("Recording type is continuous. Cannot bin data for non-pulsed recordings")
+    #for each recording window, takes the mean, median and SD of every signal.
+    #binSize: if given, bins the data into fixed windows of binSize seconds instead (required for continuous recordings)
+    @Instrumentation.stage("bin", rowsIn="pt_cleaned", rowsOut="pt_binned")
+    def binData(self, binSize = None):
         if self.pt_cleaned is None:
             raise UserWarning("This data has not been cleaned. Please run clean() before proceeding.")
-        else:
-            idxs = self.pt_cleaned[self.pt_cleaned["StartIdx"] == True].index.tolist()
-            if len(idxs) < 1:
+        if binSize is None:
+            if self.type.upper() != "PULSED":
+                raise TypeError("Recording type is continuous. Pass binSize to bin data from non-pulsed recordings")
+            if "Window" not in self.pt_cleaned.columns or len(self.pt_cleaned) < 1:
                 raise IndexError("Could not find any samples which would indicate the start of a new recording window")
-            rowsList = []
-            #find start and end times based on idxs where the time "jumps", signifying a new recording window
-            #remove 1 sample at start and end to exclude points were laser was partially on/off
-            for i in range(1, len(idxs)):
-                end = None
-                start = None
-                if i == len(idxs):
-                    end = self.pt_raw._465.iloc[-1]
-                else:
-                    end = idxs[i]
-                start = idxs[i - 1]
-
-                window = self.pt_cleaned.iloc[start:end].mean()
-                rowsList.append([window.Time, window._405, window._465, window.norm])
+            windowId = self.pt_cleaned["Window"].to_numpy()
+        else:
+            time = self.pt_cleaned["Time"].to_numpy()
+            windowId = np.floor((time - time[0]) / binSize).astype(np.int64)
+
+        self.pt_binned = binWindows(self.pt_cleaned["Time"].to_numpy(), windowId, self.pt_cleaned[self.signalColumns()])
+        logger.debug("%s", self.pt_binned)
+
+    #builds the channel map and channel pairs of a recording from its (renamed) columns
+    def mapChannels(self, columns):
+        self.channels = mapChannels(columns, self.animalMap)
+        self.channelPairs = pairChannels(self.channels)
+        self.numChan = self.channels.channel.nunique()
+        self.numAnimals = self.channels.animal.nunique()
+        logger.info("Found %d channel(s) across %d animal(s)...", self.numChan, self.numAnimals)
+
+    #splits cleaned (or binned, if binned = True) data into one dataframe per animal, holding the Time column and every column
+    #derived from that animal's channels. Returns a dictionary of {animal: dataframe}
+    def splitByAnimal(self, binned = False):
+        data = self.pt_binned if binned else self.pt_cleaned
+        if data is None or self.channels is None:
+            raise UserWarning("This data has not been cleaned. Please run clean() before proceeding.")
+        shared = [c for c in data.columns if c in ["Time", "Window", "StartIdx", "StartTime", "EndTime", "Samples"]]
+        animals = {}
+        for animal in self.channels.animal.unique():
+            names = list(self.channels[self.channels.animal == animal].column)
+            pairs = self.channelPairs[self.channelPairs.animal == animal]
+            names += list(pairs.norm) + list(pairs.fit) + list(pairs.dFF) + list(pairs.z)
+            cols = [c for c in data.columns if c not in shared and any([str(c).startswith(str(n)) for n in names])]
+            animals[animal] = data[shared + cols]
+        return animals
+
+    #returns the session start and end times from the Med-Pc data
+    def sessionBounds(self):
+        start = self.getMPCTimes(self.id_events.get("id_sessionStart"))
+        end = self.getMPCTimes(self.id_events.get("id_sessionEnd"))
+        if len(start) == 1:
+            start = start[0]
+        else:
+            raise TypeError("Found more or less than one session start timestamps in Med-Pc data. Check your Med-Pc file.")
 
-            self.pt_binned = pd.DataFrame(rowsList)
-            self.pt_binned.columns = ["Time", "_405", "_465", "norm"]
-            self.pt_binned.reset_index(drop=True, inplace=True)
-            print(self.pt_binned)
+        if len(end) == 1:
+            end = end[0]
+        else:
+            raise TypeError("Found more or less than than one session end timestamps in Med-Pc data. Check your Med-Pc file.")
+        return start, end
 
     #cleans raw photometry data (Doric-type only).
+    #pt_raw is never modified: its arrays are made read-only (see lockFrame), columns are renamed on a new frame, and for pulsed
+    #recordings every cleaning condition is combined into a single mask, so the cleaned rows are copied out of the raw data exactly once
+    @Instrumentation.stage("clean", rowsIn="pt_raw", rowsOut="pt_cleaned")
     def clean(self):
         if self.pt_raw is None:
             raise UserWarning("No photometry data has been added to this struct. Call readData(fpath) before proceeding")
         else:
-            print("Cleaning Photometry data...")
+            logger.info("Cleaning Photometry data...")
+            lockFrame(self.pt_raw)
 
             #determine type of data (Doric or RWD system)
-            self.pt_cleaned = self.pt_raw
-            test = self.pt_raw.columns[0]
-
-            if test == "Time(s)":
-                print("Detected Doric style recording...")
-                #single channel only, so change all column names based on mapping
-                mapping = {"Time(s)": "Time", "AIn-1 - Dem (AOut-1)": "CH1-405", "AIn-1 - Dem (AOut-2)": "Ch2-465",
-                           "DI/O-3": "TTL_6", "DI/O-4": "TTL_8"}
-                self.pt_cleaned.rename(columns=mapping, inplace=True)
-                self.recorderType = 'doric'
-                self.numChan = 1
-
-            elif test == "Timestamp":
-                print("Detected RWD style recording...")
-                self.pt_cleaned.columns.values[0] = "Time"
-                self.recorderType = 'rwd'
-
-            if self.recorderType == 'rwd':
-                self.numChan = (self.pt_cleaned.shape[1] / 2) - 1
-                numAnimals = math.floor(self.numChan / 4)
-                print("Found", self.numChan, "channel(s) across", numAnimals, "animal(s)...")
-
-            if self.type.upper() == "PULSED":
-                #remove samples which are outside recording windows
-                self.pt_cleaned = self.pt_cleaned.drop(self.pt_cleaned[self.pt_cleaned.TTL_6 < 1].index)
-                #remove samples in which signal is close to 0
-                #these are samples where the TTL turned on the recording, but the laser is not fully on
-                self.pt_cleaned = self.pt_cleaned.drop(self.pt_cleaned[self.pt_cleaned._465 < self.cutoff].index)
-
-                #remove samples which are before or after session start and end times (if Med-Pc data as been loaded into data structure)
+            data = self.renameColumns(self.pt_raw)
+            self.mapChannels(data.columns)
+
+            if self.type.upper() != "PULSED":
+                self.pt_cleaned = data
+            else:
+                #remove samples which are outside recording windows, where the laser is not fully on,
+                #or before or after session start and end times (if Med-Pc data as been loaded into data structure)
+                start, end = -np.inf, np.inf
                 if self.timestamp_data is not None:
-                    start = self.getMPCTimes(self.id_events.get("id_sessionStart"))
-                    end = self.getMPCTimes(self.id_events.get("id_sessionEnd"))
-                    if len(start) == 1:
-                        start = start[0]
-                    else:
-                        raise TypeError("Found more or less than one session start timestamps in Med-Pc data. Check your Med-Pc file.")
-
-                    if len(end) == 1:
-                        end = end[0]
-                    else:
-                        raise TypeError("Found more or less than than one session end timestamps in Med-Pc data. Check your Med-Pc file.")
-                    self.pt_cleaned = self.pt_cleaned.drop(self.pt_cleaned[self.pt_cleaned.Time < start].index)
-                    self.pt_cleaned = self.pt_cleaned.drop(self.pt_cleaned[self.pt_cleaned.Time > end].index)
-
-                #reset index to consecutive
-                self.pt_cleaned.reset_index(drop=True, inplace=True)
+                    start, end = self.sessionBounds()
+                rows = np.flatnonzero(self.recordingMask(data, start, end))
 
                 # find start and end times based on idxs where the time "jumps", signifying a new recording window
                 # remove 2 samples at start and end to exclude points where laser was partially on/off
-                self.pt_cleaned["StartIdx"] = self.pt_cleaned["Time"].diff() > 1
-                idxs = self.pt_cleaned[self.pt_cleaned.StartIdx].index
-                if len(idxs) < 1:
+                windowId, keep = segmentWindows(data["Time"].to_numpy()[rows])
+                if len(windowId) < 1 or windowId[-1] < 1:
                     raise TypeError("Could not find any samples which would indicate the start of a new recording window")
-                rowsList = []
-                print(idxs)
-                for i in range(1, len(idxs)):
-                    end = None
-                    start = None
-                    if i == len(idxs):
-                        end = self.pt_cleaned._465.iloc[-1]
-                        end -= 2
-                    else:
-                        end = idxs[i]
-                        end -= 2
-                    start = idxs[i - 1]
-                    start += 2
-                    #need to flag this sample as new start of window
-                    self.pt_cleaned["StartIdx"][start] = True
-
-                    window = self.pt_cleaned.iloc[start:end]
-                    rowsList.append(window)
-
-                    self.pt_cleaned = pd.concat(rowsList)
-                    self.pt_cleaned.reset_index(drop=True, inplace=True)
+                #samples before the first jump belong to a window which started before the session, so skip them
+                keep &= windowId > 0
+                logger.info("Found %d recording window(s)...", windowId[-1])
+
+                self.pt_cleaned = data.take(rows[keep]).reset_index(drop=True)
+                self.pt_cleaned["Window"] = windowId[keep] - 1
+                #flag first remaining sample of each window as the start of a new window
+                self.pt_cleaned["StartIdx"] = self.pt_cleaned["Window"].diff() != 0
 
+            if self.compact:
+                self.pt_cleaned = compactFrame(self.pt_cleaned)
             self.cleaned = True
 
+    #returns a frame with Doric or RWD column names replaced by the names used in this pipeline, sharing data with the original
+    def renameColumns(self, frame):
+        test = frame.columns[0]
+        if test == "Time(s)":
+            logger.info("Detected Doric style recording...")
+            #single channel only, so change all column names based on mapping
+            self.recorderType = 'doric'
+            return frame.rename(columns=DORIC_MAPPING)
+        elif str(test).lower() == "timestamp":
+            logger.info("Detected RWD style recording...")
+            self.recorderType = 'rwd'
+            return frame.rename(columns={test: "Time"})
+        return frame
+
+    #boolean mask of the samples of a pulsed recording which are inside recording windows (TTL_6 is high), where the laser is fully on
+    #(at least one signal channel is at or above cutoff) and which are between the session start and end times
+    def recordingMask(self, frame, start = -np.inf, end = np.inf):
+        time = frame["Time"].to_numpy()
+        keep = (time >= start) & (time <= end)
+        keep &= frame[list(self.channelPairs.signal.unique())].to_numpy().max(axis=1) >= self.cutoff
+        if "TTL_6" in frame.columns:
+            keep &= frame["TTL_6"].to_numpy() >= 1
+        return keep
+
     #Normalizes cleaned photometry data
-    def normalize(self, numSamples = 20, useIntercept = False):
+    #method: "endpoints" uses the line between the mean of the first and last numSamples samples (see normIntercept),
+    #"ols" and "irls" (robust) fit the signal on the isosbestic channel over the whole recording,
+    #"sliding" fits within a sliding window of window seconds, to follow slow bleaching in long sessions.
+    #Fit methods also add the fitted control, dF/F and z-scored dF/F of every pair, with norm = signal / fitted control.
+    #Fit parameters of every pair are stored in fitParams
+    @Instrumentation.stage("normalize", rowsIn="pt_cleaned", rowsOut="pt_cleaned")
+    def normalize(self, numSamples = 20, useIntercept = False, method = "endpoints", window = 60):
         if self.pt_cleaned is None:
             raise UserWarning("This data has not been cleaned. Please run clean() before proceeding.")
+        elif self.channelPairs is None or len(self.channelPairs) < 1:
+            raise UserWarning("Could not find any isosbestic and signal channel pairs to normalize.")
         else:
-            #update code to be on per-channel basis!
+            #normalize every isosbestic/signal pair at once
+            pairs = self.channelPairs
+            X = self.pt_cleaned[list(pairs.isosbestic)].to_numpy(dtype=float)
+            Y = self.pt_cleaned[list(pairs.signal)].to_numpy(dtype=float)
+            method = method.lower()
+            dtype = np.float32 if self.compact else np.float64
+            if method != "endpoints":
+                if method == "ols":
+                    slope, intercept = IsosbesticFit.fitOLS(X, Y)
+                elif method == "irls":
+                    slope, intercept = IsosbesticFit.fitIRLS(X, Y)
+                elif method == "sliding":
+                    slope, intercept = IsosbesticFit.fitSliding(self.pt_cleaned["Time"].to_numpy(), X, Y, window)
+                else:
+                    raise ValueError("Unknown normalization method " + str(method) + ". Use endpoints, ols, irls or sliding")
+                fitted, dFF, z = IsosbesticFit.deltaF(X, Y, slope, intercept)
+                r2, residualSD = IsosbesticFit.fitQuality(X, Y, slope, intercept)
+                self.pt_cleaned[list(pairs.fit)] = fitted.astype(dtype)
+                self.pt_cleaned[list(pairs.norm)] = (Y / fitted).astype(dtype)
+                self.pt_cleaned[list(pairs.dFF)] = dFF.astype(dtype)
+                self.pt_cleaned[list(pairs.z)] = z.astype(dtype)
+                #sliding fits have one slope and intercept per sample, so summarize them with their median
+                if method == "sliding":
+                    slope = np.nanmedian(slope, axis=0)
+                    intercept = np.nanmedian(intercept, axis=0)
+                self.fitParams = pd.DataFrame({"signal": pairs.signal, "method": method, "slope": slope, "intercept": intercept,
+                                               "r2": r2, "residualSD": residualSD})
+                logger.info("%s", self.fitParams)
+                return
+
             #take first and last 20 samples, calculate x-intercept of line passing between the points
-            end = len(self.pt_cleaned._465)
-            y1 = self.pt_cleaned._465[0:numSamples].mean()
-            y2 = self.pt_cleaned._465[end - numSamples:end].mean()
-            x1 = self.pt_cleaned._405[0:numSamples].mean()
-            x2 = self.pt_cleaned._405[end - numSamples:end].mean()
-
-            intercept = x2 - (y2 * (x1 - x2)) / (y1 - y2)
-            print("Slope of regression: ", intercept)
-            if intercept > max(y1, y2) * 0.8:
-                intercept = 0
-                print("Warning: y-intercept is greater than actual y values, assuming slope is 0")
-            #add contribution of autofluorescence
-            self.normConst = intercept
-            intercept += self.autoFlProfile
-
-            if useIntercept == False:
-                intercept = 0
-
-            self.pt_cleaned["norm"] = self.pt_cleaned._465 / (self.pt_cleaned._405 - intercept)
-            print(self.pt_cleaned)
+            end = X.shape[0]
+            y1 = np.nanmean(Y[0:numSamples], axis=0)
+            y2 = np.nanmean(Y[end - numSamples:end], axis=0)
+            x1 = np.nanmean(X[0:numSamples], axis=0)
+            x2 = np.nanmean(X[end - numSamples:end], axis=0)
+
+            intercept = self.normIntercept(x1, x2, y1, y2, useIntercept)
+            self.channelPairs["normConst"] = self.normConst
+            self.pt_cleaned[list(self.channelPairs.norm)] = (Y / (X - intercept)).astype(dtype)
+            self.fitParams = pd.DataFrame({"signal": pairs.signal, "method": method, "slope": np.nan, "intercept": self.normConst})
+            logger.debug("%s", self.pt_cleaned)
+
+    #Given the mean 405 and 465 signals at the start (x1, y1) and end (x2, y2) of the recording, returns the intercept which is
+    #subtracted from the 405 signal during normalization and stores the uncorrected value in normConst
+    #accepts single values or arrays with one value per channel pair
+    def normIntercept(self, x1, x2, y1, y2, useIntercept = False):
+        intercept = x2 - (y2 * (x1 - x2)) / (y1 - y2)
+        logger.info("Intercept of regression: %s", intercept)
+        tooLarge = intercept > np.maximum(y1, y2) * 0.8
+        if np.any(tooLarge):
+            intercept = np.where(tooLarge, 0, intercept)
+            logger.warning("Warning: y-intercept is greater than actual y values, assuming slope is 0")
+        if np.ndim(intercept) == 0:
+            intercept = float(intercept)
+        #add contribution of autofluorescence
+        self.normConst = intercept
+        intercept = intercept + self.autoFlProfile
+
+        if useIntercept == False:
+            intercept = 0
+        return intercept
 
     #given a path to a .xlsx file, loads Med-P and Photometry data into data structure
-    def readData(self, fpath):
-        rawData = None
-        timestampData = None
-        #look for photometry data
+    #parsed sheets are cached (see SessionCache), pass refreshCache = True to re-parse the workbook
+    @Instrumentation.stage("read", rowsOut="pt_raw")
+    def readData(self, fpath, refreshCache = False):
+        #first sheet is always our photometry data
+        sheets = {"photometry": {"sheet_name": 0, "header": 1},
+                  "events": {"sheet_name": "Events", "header": 0}}
         try:
-            #first sheet is always our photometry data
-            rawData = pd.read_excel(fpath, sheet_name=0, header=1)
+            sheets = SessionCache.readSheets(fpath, sheets, useCache=self.useCache, refresh=refreshCache)
         except:
             raise RuntimeError("Could not read photometry data")
+        #look for photometry data
+        rawData = sheets.get("photometry")
+        if rawData is None:
+            raise RuntimeError("Could not read photometry data")
         #look for Med-Pc Data
-        try:
-            timestampData = pd.read_excel(fpath, sheet_name="Events", header=0)
-        except:
-            print("Warning: Could not find events data in file. Is there an excel tab labeled 'Events'?")
+        timestampData = sheets.get("events")
+        if timestampData is None:
+            logger.warning("Warning: Could not find events data in file. Is there an excel tab labeled 'Events'?")
 
-        self.pt_raw = rawData
+        if self.compact:
+            rawData = compactFrame(rawData)
+        self.pt_raw = lockFrame(rawData)
         self.timestamp_data = timestampData
+        if timestampData is not None:
+            self.eventIndex()
+
+    #Processes a native Doric or RWD .csv export in chunks of chunkSize rows, so that memory use does not grow with the length of the recording.
+    #Each chunk goes through the same cleaning steps as clean() (TTL_6 gating, cutoff filtering, session start/end trimming and
+    #recording window segmentation for pulsed recordings) and normalize(), and the results are appended to outPath as they are produced.
+    #The file is read twice: once to find the start and end signal used for normalization, once to normalize and write the data.
+    #Binned recording windows of pulsed recordings are written to outPath with a "_binned" suffix.
+    #eventsPath: optional .csv of Med-Pc events (ID and secs columns), used for session start/end trimming
+    #returns a dictionary with the output paths and the number of samples read and written
+    @Instrumentation.stage("stream")
+    def processCSV(self, fpath, outPath, chunkSize = 500000, numSamples = 20, useIntercept = False, eventsPath = None):
+        if eventsPath is not None:
+            self.timestamp_data = pd.read_csv(eventsPath)
+            self.eventIndex()
+
+        logger.info("Streaming photometry data from %s ...", fpath)
+        #first pass, keep the first and last numSamples cleaned samples
+        head = None
+        tail = None
+        for chunk in self.cleanCSVChunks(fpath, chunkSize):
+            if head is None or len(head) < numSamples:
+                head = chunk.iloc[0:numSamples] if head is None else pd.concat([head, chunk]).iloc[0:numSamples]
+            tail = chunk.iloc[-numSamples:] if tail is None else pd.concat([tail, chunk]).iloc[-numSamples:]
+        if head is None:
+            raise UserWarning("No samples were left after cleaning " + str(fpath))
+        iso = list(self.channelPairs.isosbestic)
+        sig = list(self.channelPairs.signal)
+        intercept = self.normIntercept(head[iso].mean().to_numpy(), tail[iso].mean().to_numpy(),
+                                       head[sig].mean().to_numpy(), tail[sig].mean().to_numpy(), useIntercept)
+
+        #second pass, normalize and write every chunk
+        binnedPath = None
+        if self.type.upper() == "PULSED":
+            binnedPath = os.path.splitext(outPath)[0] + "_binned" + os.path.splitext(outPath)[1]
+        stats = {"cleaned": outPath, "binned": binnedPath, "samplesRead": 0, "samplesWritten": 0, "windows": 0}
+        first = True
+        for chunk in self.cleanCSVChunks(fpath, chunkSize, stats):
+            chunk[list(self.channelPairs.norm)] = chunk[sig].to_numpy(dtype=float) / (chunk[iso].to_numpy(dtype=float) - intercept)
+            chunk.to_csv(outPath, mode="w" if first else "a", header=first, index=False)
+            stats["samplesWritten"] += len(chunk)
+            if binnedPath is not None:
+                #every chunk only holds complete recording windows, so each can be binned on its own
+                signals = [c for c in chunk.columns if c not in ["Time", "Window", "StartIdx"] and not str(c).startswith("TTL")]
+                binned = binWindows(chunk["Time"].to_numpy(), chunk["Window"].to_numpy(), chunk[signals])
+                binned.to_csv(binnedPath, mode="w" if first else "a", header=first, index=False)
+                stats["windows"] += len(binned)
+            first = False
+        logger.info("Wrote %d of %d samples to %s", stats["samplesWritten"], stats["samplesRead"], outPath)
+        return stats
+
+    #Generator which reads a native Doric or RWD .csv export chunkSize rows at a time and yields cleaned chunks.
+    #For pulsed recordings every yielded chunk holds only complete recording windows: the last window of each chunk is held back and
+    #prepended to the next one, so that windows which span two chunks are trimmed and numbered exactly as clean() would.
+    def cleanCSVChunks(self, fpath, chunkSize = 500000, stats = None):
+        header = findCSVHeader(fpath)
+        self.channelPairs = None
+        if self.type.upper() == "PULSED" and self.timestamp_data is not None:
+            start, end = self.sessionBounds()
+        else:
+            start, end = -np.inf, np.inf
+
+        carry = None
+        #Window number of the first window of the current chunk, None until the first full window has been found
+        base = None
+        for chunk in pd.read_csv(fpath, header=header, chunksize=chunkSize):
+            if stats is not None:
+                stats["samplesRead"] += len(chunk)
+            if self.channelPairs is None:
+                chunk = self.renameColumns(chunk)
+                self.mapChannels(chunk.columns)
+                columns = chunk.columns
+            else:
+                chunk.columns = columns
+            if self.compact:
+                chunk = compactFrame(chunk)
+
+            if self.type.upper() != "PULSED":
+                yield chunk
+                continue
+
+            #remove samples which are outside recording windows, close to 0 or outside of the session
+            chunk = chunk[self.recordingMask(chunk, start, end)]
+            if carry is not None:
+                chunk = pd.concat([carry, chunk], ignore_index=True)
+            if len(chunk) < 1:
+                continue
+
+            windowId, keep = segmentWindows(chunk["Time"].to_numpy())
+            last = windowId[-1]
+            if base is None:
+                if last == 0:
+                    #no time jump yet, so we cannot tell where the first full window starts
+                    carry = chunk
+                    continue
+                #samples before the first jump belong to a window which started before the session, so skip them
+                keep &= windowId > 0
+                base = -1
+            #the last window may continue in the next chunk
+            complete = keep & (windowId < last)
+            carry = chunk[windowId == last]
+            out = chunk[complete].reset_index(drop=True)
+            out["Window"] = windowId[complete] + base
+            out["StartIdx"] = out["Window"].diff() != 0
+            base += last
+            if len(out) > 0:
+                yield out
+
+        if self.type.upper() == "PULSED":
+            if base is None:
+                raise TypeError("Could not find any samples which would indicate the start of a new recording window")
+            if carry is not None and len(carry) > 0:
+                windowId, keep = segmentWindows(carry["Time"].to_numpy())
+                out = carry[keep].reset_index(drop=True)
+                out["Window"] = base
+                out["StartIdx"] = out["Window"].diff() != 0
+                if len(out) > 0:
+                    yield out
@@ -0,0 +1,420 @@
+import collections
+import copy
+import hashlib
+import json
+import os
+import pickle
+import numpy as np
+import pandas as pd
+import Instrumentation
+import SessionCache
+import PhotometryStruct
+import BehaviorStruct
+
+#The stages of a session as a dependency graph whose outputs are cached, so that changing one parameter only re-runs the
+#stages downstream of it. Every stage is a function of the outputs of the stages it depends on and of its own parameters.
+#Its output is cached in memory and on disk (only the tables it changes, see StageCache) under a key made of its name, its
+#parameters, the fingerprints (path, size and modification time) of the files it reads and the keys of its inputs, so a key
+#changes whenever anything upstream changes.
+#
+#   pipeline = PipelineDAG.photometryPipeline("session1.xlsx", type="pulsed", events=events)
+#   data = pipeline.run("align")                       #reads, cleans, normalizes, bins and aligns
+#   pipeline.set("align", baseline=5, outcome=20)
+#   data = pipeline.run("align")                       #only aligns again
+#   pipeline.set("normalize", method="irls")
+#   data = pipeline.run("align")                       #normalizes, bins and aligns again, the cleaned data is reused
+#
+#Stages receive a copy of their inputs (see snapshot), so they may modify and return them without changing cached outputs.
+
+#bump whenever the stage functions of this module change their outputs
+PIPELINE_VERSION = 3
+DEFAULT_STAGE_DIR = os.path.join(SessionCache.DEFAULT_CACHE_DIR, "stages")
+DEFAULT_STAGE_MAX_BYTES = int(os.environ.get("PYPLINE_STAGE_CACHE_MAX_BYTES", 1024 ** 3))
+
+logger = Instrumentation.getLogger("pipeline")
+
+#name: stage name, function: called as function(*outputs of inputs, **params), inputs: names of the stages it depends on
+#params: keyword arguments of function, files: names of params which are paths of files read by the stage
+#version: bump to discard cached outputs of this stage, persist: whether outputs are stored on disk as well as in memory
+Stage = collections.namedtuple("Stage", ["name", "function", "inputs", "params", "files", "version", "persist"])
+
+
+#Copy of a PhotometryData or BehaviorData (or any object) which can be modified without changing the original.
+#Dataframes are copied lazily when pandas copies on write (only columns which are modified are copied), and deep copied
+#otherwise, see copyOnWrite. Dictionaries and lists are copied one level deep. Arrays are shared, as the pipeline only ever
+#replaces them.
+def snapshot(value):
+    if isinstance(value, (pd.DataFrame, dict, list)) or not hasattr(value, "__dict__"):
+        return copyValue(value)
+    value = copy.copy(value)
+    for name, attribute in vars(value).items():
+        setattr(value, name, copyValue(attribute))
+    return value
+
+
+def copyValue(value):
+    if isinstance(value, pd.DataFrame):
+        return value.copy(deep=not copyOnWrite())
+    if isinstance(value, dict):
+        return {k: copyValue(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [copyValue(v) for v in value]
+    return value
+
+
+#whether shallow copies of dataframes are safe to modify: pandas 3 always copies shared data on write, pandas 2 only with
+#pd.options.mode.copy_on_write = True. Without it a stage modifying a shallow copy would change the cached output it came from
+def copyOnWrite():
+    if int(pd.__version__.split(".")[0]) >= 3:
+        return True
+    try:
+        return pd.get_option("mode.copy_on_write") is True
+    except (KeyError, pd.errors.OptionError):
+        return False
+
+
+#path, size and modification time of a file, which change whenever it is replaced or written (None for missing files)
+def fileFingerprint(fpath):
+    if fpath is None:
+        return None
+    stat = os.stat(fpath)
+    return [os.path.abspath(fpath), stat.st_size, stat.st_mtime_ns]
+
+
+#Least recently used cache of stage outputs: the last maxEntries outputs are kept in memory. Persisted stages also store on
+#disk, in cacheDir, only what they changed: the tables (dataframes and arrays) which differ from the output of their first
+#input, see changedTables (as feather files, see SessionCache.storeFrame, or .npy files for arrays), and the struct's small
+#attributes (settings, channel maps, aligned trials...). Tables a stage did not change are taken from its first input when it
+#is loaded, so a session's raw data is never stored again by the stages after the read. cacheDir is kept below maxBytes by
+#removing the least recently used files.
+class StageCache:
+    def __init__(self, cacheDir = None, maxEntries = 32, maxBytes = DEFAULT_STAGE_MAX_BYTES, useDisk = True):
+        self.cacheDir = cacheDir if cacheDir is not None else DEFAULT_STAGE_DIR
+        self.maxEntries = maxEntries
+        self.maxBytes = maxBytes
+        self.useDisk = useDisk
+        self.memory = collections.OrderedDict()
+
+    #returns ("memory", output) if the output is kept in memory, (None, None) otherwise
+    def get(self, key):
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            return "memory", self.memory[key]
+        return None, None
+
+    #whether a complete entry of key is stored on disk
+    def stored(self, key):
+        return self.useDisk and os.path.exists(self.path(key, "state.pkl"))
+
+    #Rebuilds the output of key from the disk entry and base, the output of the stage's first input.
+    #Returns None if the entry is missing or incomplete (e.g. partly evicted)
+    def load(self, key, base):
+        if not self.stored(key):
+            return None
+        try:
+            with open(self.path(key, "state.pkl"), "rb") as f:
+                state = pickle.load(f)
+            tables = {}
+            for name, kind in state.pop("__tables__").items():
+                if kind == "array":
+                    tables[name] = np.load(self.path(key, name + ".npy"), allow_pickle=False)
+                    os.utime(self.path(key, name + ".npy"))
+                else:
+                    found, tables[name] = SessionCache.loadFrame(self.path(key, name))
+                    if not found:
+                        return None
+        except (OSError, ValueError, KeyError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+            return None
+        #touch entry so that eviction treats it as recently used
+        os.utime(self.path(key, "state.pkl"))
+        value = snapshot(base)
+        for name, attribute in list(state.items()) + list(tables.items()):
+            setattr(value, name, attribute)
+        self.remember(key, value)
+        return value
+
+    #keeps value in memory, and stores the tables value changed from base and its small attributes on disk if persist is True
+    def put(self, key, value, base = None, persist = False):
+        self.remember(key, value)
+        if persist and self.useDisk and hasattr(value, "__dict__"):
+            try:
+                self.store(key, value, base)
+            except (OSError, ValueError, pickle.PicklingError, TypeError, AttributeError) as e:
+                logger.warning("Warning: could not store stage output on disk (%s)", e)
+            SessionCache.evictFiles(self.cacheDir, self.maxBytes)
+
+    def store(self, key, value, base):
+        os.makedirs(self.cacheDir, exist_ok=True)
+        state = {}
+        tables = {}
+        changed = changedTables(value, base)
+        for name, attribute in vars(value).items():
+            if name in changed and isinstance(attribute, pd.DataFrame):
+                SessionCache.storeFrame(self.path(key, name), attribute)
+                tables[name] = "frame"
+            elif name in changed:
+                np.save(self.path(key, name + ".npy"), attribute, allow_pickle=False)
+                tables[name] = "array"
+            elif not isinstance(attribute, (pd.DataFrame, np.ndarray)):
+                state[name] = attribute
+        state["__tables__"] = tables
+        #the state is written last, so an entry is only complete once it exists
+        path = self.path(key, "state.pkl")
+        with open(path + ".tmp", "wb") as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + ".tmp", path)
+
+    def path(self, key, name):
+        return os.path.join(self.cacheDir, key + "." + name)
+
+    def remember(self, key, value):
+        self.memory[key] = value
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.maxEntries:
+            self.memory.popitem(last=False)
+
+    #empties the memory cache, and the disk cache as well if disk is True
+    def clear(self, disk = False):
+        self.memory.clear()
+        if disk and os.path.isdir(self.cacheDir):
+            for entry in os.listdir(self.cacheDir):
+                if os.path.isfile(os.path.join(self.cacheDir, entry)):
+                    os.remove(os.path.join(self.cacheDir, entry))
+
+
+#names of the tables (dataframe and array attributes) of value which are not the same as the table of the same name of base,
+#e.g. because a stage replaced them, changed their values or renamed their columns. Every table of value changed if base is None
+def changedTables(value, base):
+    changed = []
+    for name, attribute in vars(value).items():
+        if isinstance(attribute, (pd.DataFrame, np.ndarray)) and not sameTable(attribute, getattr(base, name, None)):
+            changed.append(name)
+    return changed
+
+
+#whether tables a and b have the same shape, types, labels and values (nan equal to nan)
+def sameTable(a, b):
+    if a is b:
+        return True
+    if type(a) is not type(b) or a.shape != b.shape:
+        return False
+    if isinstance(a, np.ndarray):
+        return a.dtype == b.dtype and np.array_equal(a, b, equal_nan=a.dtype.kind in "fc")
+    return (a.columns.equals(b.columns) and list(a.columns.names) == list(b.columns.names) and a.index.equals(b.index)
+            and list(a.index.names) == list(b.index.names) and a.dtypes.equals(b.dtypes) and a.equals(b))
+
+
+_defaultCaches = {}
+
+
+#stage cache shared by every pipeline of the process, so pipelines rebuilt for the same session reuse each other's outputs.
+#useDisk = False returns a cache which is only kept in memory, e.g. for interactive runs
+def getDefaultCache(useDisk = True):
+    if useDisk not in _defaultCaches:
+        _defaultCaches[useDisk] = StageCache(useDisk=useDisk)
+    return _defaultCaches[useDisk]
+
+
+class Pipeline:
+    def __init__(self, cache = None):
+        self.stages = collections.OrderedDict()
+        self.cache = cache if cache is not None else getDefaultCache()
+        #how the output of every stage of the last run was obtained: "memory", "disk" or "run"
+        self.lastRun = {}
+
+    #adds a stage, see Stage. Stages must be added after the stages they depend on.
+    #Only stages with inputs are stored on disk (a stage without inputs reads files, which SessionCache already caches)
+    def add(self, name, function, inputs = (), params = None, files = (), version = 1, persist = True):
+        for inputName in inputs:
+            if inputName not in self.stages:
+                raise ValueError("Stage " + str(name) + " depends on unknown stage " + str(inputName))
+        persist = persist and len(inputs) > 0
+        self.stages[name] = Stage(name, function, tuple(inputs), dict(params or {}), tuple(files), version, persist)
+        return self
+
+    #changes parameters of a stage, e.g. set("align", baseline=5). Only the stage and the stages downstream of it run again
+    def set(self, name, **params):
+        stage = self.stage(name)
+        unknown = [p for p in params if p not in stage.params]
+        if len(unknown) > 0:
+            raise TypeError("Stage " + str(name) + " has no parameter(s) " + ", ".join(unknown) + ". Parameters: " + ", ".join(stage.params))
+        stage.params.update(params)
+        return self
+
+    def stage(self, name):
+        if name not in self.stages:
+            raise KeyError("No stage named " + str(name) + ". Stages: " + ", ".join(self.stages))
+        return self.stages[name]
+
+    #cache key of the output of a stage, from its name, version, parameters, file fingerprints and the keys of its inputs
+    def key(self, name, keys = None):
+        keys = keys if keys is not None else {}
+        if name not in keys:
+            stage = self.stage(name)
+            description = {"stage": name, "version": [PIPELINE_VERSION, stage.version],
+                           "function": stage.function.__module__ + "." + stage.function.__qualname__,
+                           "params": stage.params, "files": {f: fileFingerprint(stage.params.get(f)) for f in stage.files},
+                           "inputs": [self.key(i, keys) for i in stage.inputs], "pandas": pd.__version__}
+            text = json.dumps(description, sort_keys=True, default=str)
+            keys[name] = name + "_" + hashlib.sha1(text.encode()).hexdigest()[0:24]
+        return keys[name]
+
+    #Returns a copy of the output of a stage (default: the last stage added), running it and whatever it depends on unless
+    #their outputs are cached. Only stages whose output is needed are loaded or run.
+    def run(self, name = None):
+        name = name if name is not None else next(reversed(self.stages))
+        self.lastRun = {}
+        return snapshot(self.output(name, {}))
+
+    def output(self, name, keys):
+        key = self.key(name, keys)
+        found, value = self.cache.get(key)
+        if found is not None:
+            self.lastRun[name] = found
+            logger.debug("Stage %s loaded from %s", name, found)
+            return value
+        stage = self.stage(name)
+        if stage.persist and self.cache.stored(key):
+            value = self.cache.load(key, self.output(stage.inputs[0], keys))
+            if value is not None:
+                self.lastRun[name] = "disk"
+                logger.debug("Stage %s loaded from disk", name)
+                return value
+        inputs = [self.output(i, keys) for i in stage.inputs]
+        logger.debug("Running stage %s", name)
+        value = stage.function(*[snapshot(i) for i in inputs], **stage.params)
+        self.cache.put(key, value, base=inputs[0] if len(inputs) > 0 else None, persist=stage.persist)
+        self.lastRun[name] = "run"
+        return value
+
+    #names of the stages which would run (rather than be loaded from the cache) if name was run now
+    def pending(self, name = None):
+        name = name if name is not None else next(reversed(self.stages))
+        keys = {}
+        stale = []
+        toVisit = [name]
+        while len(toVisit) > 0:
+            current = toVisit.pop()
+            if current in stale:
+                continue
+            key = self.key(current, keys)
+            if key in self.cache.memory or (self.stage(current).persist and self.cache.stored(key)):
+                continue
+            stale.append(current)
+            toVisit.extend(self.stage(current).inputs)
+        return [s for s in self.stages if s in stale]
+
+
+#############################
+#### PHOTOMETRY PIPELINE ####
+#############################
+
+def readPhotometry(fpath, compact = False):
+    data = PhotometryStruct.PhotometryData(compact=compact)
+    data.readData(fpath)
+    return data
+
+
+def cleanPhotometry(data, type = "pulsed", events = None, animalMap = None, cutoff = 0.009):
+    data.type = type
+    data.id_events = dict(events or {})
+    data.animalMap = animalMap
+    data.cutoff = cutoff
+    data.clean()
+    return data
+
+
+def filterPhotometry(data, lowpass = None, highpass = None, order = 4):
+    if lowpass is not None or highpass is not None:
+        data.filterSignals(lowpass=lowpass, highpass=highpass, order=order)
+    return data
+
+
+def normalizePhotometry(data, method = "endpoints", numSamples = 20, useIntercept = False, window = 60):
+    data.normalize(numSamples=numSamples, useIntercept=useIntercept, method=method, window=window)
+    return data
+
+
+#pulsed recordings are binned by recording window, continuous recordings only if binSize is given
+def binPhotometry(data, binSize = None):
+    if data.type.upper() == "PULSED" or binSize is not None:
+        data.binData(binSize=binSize)
+    return data
+
+
+def alignPhotometry(data, signal = None, baseline = 10, outcome = 10):
+    if data.timestamp_data is not None and "id_trialStart" in data.id_events:
+        data.alignEvents(signal=signal, baseline=baseline, outcome=outcome)
+    return data
+
+
+#read -> clean -> filter -> normalize -> bin -> align stages of a photometry workbook, with the default parameters of
+#PhotometryData. Parameters of each stage can be changed with Pipeline.set, e.g. set("normalize", numSamples=50)
+def photometryPipeline(fpath, type = "pulsed", events = None, animalMap = None, cache = None):
+    pipeline = Pipeline(cache)
+    pipeline.add("read", readPhotometry, params={"fpath": fpath, "compact": False}, files=["fpath"])
+    pipeline.add("clean", cleanPhotometry, ["read"], {"type": type, "events": events, "animalMap": animalMap, "cutoff": 0.009})
+    pipeline.add("filter", filterPhotometry, ["clean"], {"lowpass": None, "highpass": None, "order": 4})
+    pipeline.add("normalize", normalizePhotometry, ["filter"], {"method": "endpoints", "numSamples": 20, "useIntercept": False, "window": 60})
+    pipeline.add("bin", binPhotometry, ["normalize"], {"binSize": None})
+    pipeline.add("align", alignPhotometry, ["bin"], {"signal": None, "baseline": 10, "outcome": 10})
+    return pipeline
+
+
+###########################
+#### BEHAVIOR PIPELINE ####
+###########################
+
+#reads a workbook (fpath) or the tracking software's files (behaviorPath, eventsPath, ttlPath), see BehaviorData.readFiles
+def readBehavior(fpath = None, videoPath = None, behaviorPath = None, eventsPath = None, ttlPath = None, type = "deeplabcut"):
+    data = BehaviorStruct.BehaviorData(type=type, videoPath=videoPath)
+    if fpath is not None:
+        data.readData(fpath)
+    else:
+        data.readFiles(behaviorPath, eventsPath, ttlPath)
+    return data
+
+
+def cleanBehavior(data, threshold = 0.6, maxGap = 0):
+    data.threshold = threshold
+    data.maxGap = maxGap
+    data.clean()
+    return data
+
+
+#adds a <part>_bool column for every part, see BehaviorData.booleanEvent
+def booleanBehavior(data, parts = ()):
+    for part in parts:
+        data.booleanEvent(part=part)
+    return data
+
+
+def alignBehavior(data, part = None, events = None, baseline = 10, outcome = 10, maxGap = None):
+    if part is not None:
+        data.id_events = dict(events or {})
+        data.alignEvents(part=part, baseline=baseline, outcome=outcome, maxGap=maxGap)
+    return data
+
+
+def annotateBehavior(data, specs = ()):
+    if len(specs) > 0:
+        data.annotatePerievent(list(specs))
+    return data
+
+
+#read -> clean -> boolean -> align -> annotate stages of a behavioral session, with the default parameters of BehaviorData.
+#Pass either a workbook (fpath) or the tracking software's files. Nothing is aligned until the align stage is given a part,
+#e.g. set("align", part="Back1_Vel")
+def behaviorPipeline(fpath = None, videoPath = None, behaviorPath = None, eventsPath = None, ttlPath = None, type = "deeplabcut",
+                     events = None, cache = None):
+    if fpath is None and behaviorPath is None:
+        raise ValueError("A behavioral pipeline needs a workbook (fpath) or a behavior file (behaviorPath)")
+    files = ["fpath", "videoPath", "behaviorPath", "eventsPath", "ttlPath"]
+    pipeline = Pipeline(cache)
+    pipeline.add("read", readBehavior, params={"fpath": fpath, "videoPath": videoPath, "behaviorPath": behaviorPath,
+                                               "eventsPath": eventsPath, "ttlPath": ttlPath, "type": type}, files=files)
+    pipeline.add("clean", cleanBehavior, ["read"], {"threshold": 0.6, "maxGap": 0})
+    pipeline.add("boolean", booleanBehavior, ["clean"], {"parts": []})
+    pipeline.add("align", alignBehavior, ["boolean"], {"part": None, "events": events, "baseline": 10, "outcome": 10, "maxGap": None})
+    pipeline.add("annotate", annotateBehavior, ["align"], {"specs": []})
+    return pipeline
@@ -0,0 +1,229 @@
+import concurrent.futures
+import warnings
+import matplotlib
+import numpy as np
+import pandas as pd
+import Instrumentation
+
+#Plots of long recordings. Traces are decimated to the pixel width of the axes before they are handed to matplotlib,
+#so drawing time and memory do not grow with the length of the recording, and peri-event trials are drawn as a single
+#image (one row per trial) rather than one line per trial.
+#Every figure function returns the figure, and saves it to dest if given.
+
+
+#switches matplotlib to the non-interactive Agg backend, for batch runs and worker processes without a display
+#must be called before pyplot creates a figure
+def setHeadless():
+    matplotlib.use("Agg", force=True)
+
+
+#Indices of the minimum and maximum sample of y within numBins buckets of equal length, in order.
+#Keeps every peak and trough of the trace, so the decimated trace looks the same as the full trace at the given width.
+def minMaxIndices(y, numBins):
+    y = np.asarray(y, dtype=float)
+    n = len(y)
+    if numBins < 1 or n <= 2 * numBins:
+        return np.arange(n)
+    size = n // numBins
+    #nan samples are never picked unless the whole bucket is nan
+    low = np.where(np.isnan(y), np.inf, y)
+    high = np.where(np.isnan(y), -np.inf, y)
+    start = np.arange(numBins) * size
+    idx = [start + low[0:numBins * size].reshape(numBins, size).argmin(axis=1),
+           start + high[0:numBins * size].reshape(numBins, size).argmax(axis=1)]
+    #leftover samples form a last, shorter bucket
+    if numBins * size < n:
+        idx.append([numBins * size + low[numBins * size:].argmin(), numBins * size + high[numBins * size:].argmax()])
+    idx.append([0, n - 1])
+    return np.unique(np.concatenate(idx))
+
+
+#Indices of numPoints samples of (x, y) picked with the Largest-Triangle-Three-Buckets algorithm, which keeps the
+#visual shape of a trace with fewer points than min/max decimation. The first and last samples are always kept.
+def lttbIndices(x, y, numPoints):
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(y)
+    if numPoints < 3 or n <= numPoints:
+        return np.arange(n)
+    #numPoints - 2 buckets between the first and last samples
+    edges = np.linspace(1, n - 1, numPoints - 1).astype(int)
+    selected = np.zeros(numPoints, dtype=int)
+    selected[-1] = n - 1
+    a = 0
+    for bucket in range(numPoints - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        #the third point of the triangle is the average of the next bucket (or the last sample)
+        if bucket + 2 < len(edges):
+            with warnings.catch_warnings():
+                #empty or all nan buckets
+                warnings.simplefilter("ignore", category=RuntimeWarning)
+                cx = np.nanmean(x[end:edges[bucket + 2]])
+                cy = np.nanmean(y[end:edges[bucket + 2]])
+        else:
+            cx, cy = x[n - 1], y[n - 1]
+        area = np.abs((x[a] - cx) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (cy - y[a]))
+        a = start + int(np.argmax(np.where(np.isnan(area), -1, area)))
+        selected[bucket + 1] = a
+    return selected
+
+
+#returns the indices of y to draw within a budget of width pixels
+#method: "minmax" (two samples per pixel), "lttb" (one sample per pixel) or None (every sample)
+def decimate(x, y, width, method = "minmax"):
+    if method is None:
+        return np.arange(len(y))
+    if method == "minmax":
+        return minMaxIndices(y, int(width))
+    if method == "lttb":
+        return lttbIndices(x, y, int(width))
+    raise ValueError("Unknown decimation method " + str(method) + ". Use minmax, lttb or None")
+
+
+#pixel width of an axes
+def axesWidth(ax):
+    return max(int(ax.get_window_extent().width), 100)
+
+
+#draws every column of frame in columns against the x column, each decimated to the width of ax
+def plotTraces(ax, frame, x, columns, method = "minmax", width = None):
+    width = width or axesWidth(ax)
+    time = frame[x].to_numpy(dtype=float)
+    for column in columns:
+        values = frame[column].to_numpy(dtype=float)
+        idx = decimate(time, values, width, method)
+        #matplotlib hides labels starting with "_" (e.g. Doric's _405) from legends
+        ax.plot(time[idx], values[idx], label=str(column).lstrip("_"), linewidth=0.8)
+    if len(columns) > 1:
+        ax.legend(fontsize="small")
+    ax.set_xlabel(x)
+
+
+#scatter of y against x colored by c, with at most maxPoints evenly spaced samples
+def plotScatter(ax, frame, x, y, c = None, maxPoints = 20000):
+    step = max(len(frame) // maxPoints, 1)
+    sample = frame.iloc[::step]
+    points = ax.scatter(sample[x], sample[y], c=None if c is None else sample[c], s=2, cmap="viridis")
+    ax.set_xlabel(x)
+    ax.set_ylabel(y)
+    if c is not None:
+        ax.figure.colorbar(points, ax=ax, label=c)
+
+
+#draws peri-event trials as one image with a row per trial
+#trials is an EventAlignment.AlignedTrials (first signal is drawn), or a frame from EventAlignment.trialsFrame
+def plotHeatmap(ax, trials, label = None):
+    time, matrix = trialMatrix(trials)
+    if matrix.shape[0] == 0 or len(time) == 0:
+        return None
+    step = (time[-1] - time[0]) / max(len(time) - 1, 1)
+    image = ax.imshow(matrix, aspect="auto", interpolation="nearest", cmap="viridis",
+                      extent=[time[0] - step / 2, time[-1] + step / 2, matrix.shape[0] - 0.5, -0.5])
+    ax.axvline(0, color="white", linewidth=0.8, linestyle="--")
+    ax.set_ylabel("Trial")
+    ax.set_xlabel("Time(s)")
+    ax.figure.colorbar(image, ax=ax, label=label)
+    return image
+
+
+#returns (time axis, trials x samples matrix) of an AlignedTrials or a trialsFrame
+def trialMatrix(trials):
+    if hasattr(trials, "trials"):
+        return np.asarray(trials.Time, dtype=float), trials.trials[:, :, 0]
+    columns = [c for c in trials.columns if c not in ["SD", "Average", "Time"]]
+    return trials["Time"].to_numpy(dtype=float), trials[columns].to_numpy(dtype=float).T
+
+
+def saveFigure(fig, dest):
+    if dest is not None:
+        fig.savefig(dest)
+    return fig
+
+
+#raw, normalized and (for pulsed recordings) binned traces of every channel pair of a PhotometryData
+@Instrumentation.stage("plot", rowsIn=Instrumentation.argument("cleaned"))
+def photometryFigure(cleaned, pairs, binned = None, dest = None, method = "minmax"):
+    import matplotlib.pyplot as plt
+    fig, axes = plt.subplots(2, 2, figsize=(10, 5))
+    plotTraces(axes[0, 0], cleaned, "Time", list(pairs.signal) + list(pairs.isosbestic.unique()), method)
+    axes[0, 0].set_title("Raw Data")
+    axes[0, 0].set_ylabel("Current")
+    plotTraces(axes[0, 1], cleaned, "Time", list(pairs.norm), method)
+    axes[0, 1].set_title("Normalized")
+    axes[0, 1].set_ylabel("f/f")
+    if binned is not None:
+        plotTraces(axes[1, 0], binned, "Time", list(pairs.norm), method)
+        axes[1, 0].set_title("Binned and Normalized")
+        axes[1, 0].set_ylabel("f/f")
+    else:
+        axes[1, 0].axis("off")
+    axes[1, 1].axis("off")
+    fig.tight_layout()
+    return saveFigure(fig, dest)
+
+
+#isosbestic vs signal scatter of a channel pair, colored by time
+@Instrumentation.stage("plot", rowsIn=Instrumentation.argument("cleaned"))
+def scatterFigure(cleaned, x, y, dest = None, maxPoints = 20000):
+    import matplotlib.pyplot as plt
+    fig, ax = plt.subplots(figsize=(6, 5))
+    plotScatter(ax, cleaned, x, y, "Time", maxPoints)
+    fig.tight_layout()
+    return saveFigure(fig, dest)
+
+
+#single trace over the whole session, e.g. the velocity of a body part
+@Instrumentation.stage("plot", rowsIn=Instrumentation.argument("frame"))
+def traceFigure(frame, column, dest = None, title = None, x = "Time", method = "minmax"):
+    import matplotlib.pyplot as plt
+    fig, ax = plt.subplots(figsize=(10, 5))
+    plotTraces(ax, frame, x, [column], method)
+    ax.set_title(title or column)
+    fig.tight_layout()
+    return saveFigure(fig, dest)
+
+
+#one column per event with the smoothed average (+/- SD) above a heatmap of every trial
+#events: {name: trialsFrame or AlignedTrials}, averages are taken from trialsFrames or computed from AlignedTrials
+@Instrumentation.stage("plot", rowsIn=Instrumentation.argument("events"))
+def eventsFigure(events, dest = None, title = "", ylabel = ""):
+    import matplotlib.pyplot as plt
+    fig, axes = plt.subplots(2, max(len(events), 1), figsize=(5 * max(len(events), 1), 7), squeeze=False, sharex="col")
+    for x, (name, trials) in enumerate(events.items()):
+        time, matrix = trialMatrix(trials)
+        if isinstance(trials, pd.DataFrame):
+            average, sd = trials["Average"].to_numpy(dtype=float), trials["SD"].to_numpy(dtype=float)
+        else:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", category=RuntimeWarning)
+                average, sd = np.nanmean(matrix, axis=0), np.nanstd(matrix, axis=0, ddof=1)
+        axes[0, x].plot(time, average)
+        axes[0, x].fill_between(time, average - sd, average + sd, alpha=0.2)
+        axes[0, x].axvline(0, color="grey", linewidth=0.8, linestyle="--")
+        axes[0, x].set_title((title + ": " if title else "") + str(name))
+        axes[0, x].set_ylabel(ylabel)
+        axes[0, x].grid()
+        plotHeatmap(axes[1, x], trials, ylabel)
+    fig.tight_layout()
+    return saveFigure(fig, dest)
+
+
+#runs a single (figure function name, keyword arguments) job and closes the figure. Uses the process' current backend, which
+#renderFigures sets to Agg in its worker processes
+def renderJob(job):
+    import matplotlib.pyplot as plt
+    name, kwargs = job
+    fig = globals()[name](**kwargs)
+    plt.close(fig)
+    return kwargs.get("dest")
+
+
+#Renders many figures in parallel worker processes with the Agg backend, e.g. the figures of every session of a cohort.
+#jobs: list of (figure function name, keyword arguments), e.g. ("traceFigure", {"frame": df, "column": "Back1_Vel", "dest": "a.png"})
+#workers = 1 renders in this process without changing its backend, so an interactive session can still show figures
+#returns the saved paths in the order of jobs
+def renderFigures(jobs, workers = None):
+    if workers == 1:
+        return [renderJob(job) for job in jobs]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=setHeadless) as pool:
+        return list(pool.map(renderJob, jobs))
@@ -0,0 +1,95 @@
+import os
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+#DeepLabCut pose estimates as a numeric (frames x parts x [x, y, likelihood]) array, so that thresholding, interpolation
+#and velocity run on every body part at once instead of part by part on string-typed spreadsheet columns.
+
+COORDS = ["x", "y", "likelihood"]
+#first cells of the header rows of DeepLabCut .csv files, individuals is only written by multi-animal projects
+HEADER_ROWS = ["scorer", "individuals", "bodyparts", "coords"]
+
+
+#Given the first sheet of a DeepLabCut export read with header=0 (columns "scorer", <scorer>..., then a bodyparts row,
+#a coords row and one row per frame whose first column is the frame number), returns (list of parts, float array shaped
+#frames x parts x 3)
+def parseDLCSheet(sheet):
+    numParts = (sheet.shape[1] - 1) // 3
+    if numParts < 1 or sheet.shape[0] < 2:
+        raise ValueError("Expected a DeepLabCut sheet with bodyparts and coords rows, got shape " + str(sheet.shape))
+    header = sheet.iloc[0:2, 1:numParts * 3 + 1].astype(str).to_numpy()
+    if list(header[1, 0:3]) != COORDS:
+        raise ValueError("Expected x, y and likelihood columns for every part, got " + str(list(header[1, 0:3])))
+    parts = [str(p) for p in header[0, 0::3]]
+    coords = sheet.iloc[2:, 1:numParts * 3 + 1].to_numpy(dtype=float, copy=True).reshape(-1, numParts, 3)
+    return parts, coords
+
+
+#Reads a DeepLabCut output file (.h5 or .csv) without going through Excel, returns (list of parts, float array shaped
+#frames x parts x 3). Parts of multi-animal projects are named <individual>_<part>.
+def readDLC(fpath):
+    extension = os.path.splitext(fpath)[1].lower()
+    if extension in [".h5", ".hdf5"]:
+        frame = pd.read_hdf(fpath)
+    elif extension == ".csv":
+        #the header rows are read on their own so that the numbers can be parsed by pyarrow's multithreaded reader
+        rows = dlcHeader(fpath)
+        header = pd.read_csv(fpath, header=None, nrows=len(rows), index_col=0, dtype=str)
+        body = pd.read_csv(fpath, header=None, skiprows=len(rows), engine="pyarrow" if pyarrow is not None else "c")
+        frame = pd.DataFrame(body.iloc[:, 1:].to_numpy(dtype=float), index=body.iloc[:, 0].to_numpy(),
+                             columns=pd.MultiIndex.from_arrays(header.to_numpy(), names=rows))
+    else:
+        raise ValueError("Expected a DeepLabCut .h5 or .csv file, got " + str(fpath))
+    return fromMultiIndex(frame)
+
+
+#names of the header rows of a DeepLabCut .csv file (e.g. ["scorer", "bodyparts", "coords"]), empty if it is not one
+def dlcHeader(fpath):
+    rows = []
+    with open(fpath) as f:
+        for line in f:
+            name = line.split(",", 1)[0].strip()
+            if name not in HEADER_ROWS:
+                break
+            rows.append(name)
+    return rows
+
+
+#Given a dataframe with DeepLabCut's (scorer, [individuals,] bodyparts, coords) MultiIndex columns, returns (list of parts,
+#float array shaped frames x parts x 3)
+def fromMultiIndex(frame):
+    names = list(frame.columns.names)
+    if "bodyparts" not in names or "coords" not in names:
+        raise ValueError("Expected bodyparts and coords column levels, got " + str(names))
+    if "scorer" in names:
+        frame = frame.droplevel("scorer", axis=1)
+    #one (frames x parts) block per coordinate, in the order of the x columns
+    x = frame.xs("x", axis=1, level="coords")
+    coords = np.empty((frame.shape[0], x.shape[1], 3))
+    for i, coord in enumerate(COORDS):
+        coords[:, :, i] = frame.xs(coord, axis=1, level="coords").reindex(columns=x.columns).to_numpy(dtype=float)
+    parts = ["_".join(str(p) for p in part) if isinstance(part, tuple) else str(part) for part in x.columns]
+    return parts, coords
+
+
+#flat column names of a pose array, e.g. Nose_x, Nose_y, Nose_likelihood for every part
+def flatColumns(parts, coords = COORDS):
+    return [part + "_" + coord for part in parts for coord in coords]
+
+
+#Returns a dataframe over a (frames x parts x n) array with (part, coord) MultiIndex columns, e.g. frame["Nose", "x"]
+#or frame.xs("likelihood", axis=1, level="coord"). The array is not copied, so it shares memory with the frame.
+def poseFrame(parts, coords, names = COORDS, index = None):
+    columns = pd.MultiIndex.from_product([parts, names], names=["part", "coord"])
+    return pd.DataFrame(coords.reshape(coords.shape[0], -1), index=index, columns=columns, copy=False)
+
+
+#sets every point whose likelihood is below threshold to nan, in place. Interpolated points keep a nan likelihood
+def applyThreshold(coords, threshold):
+    coords[~(coords[:, :, 2] >= threshold)] = np.nan
+    return coords
@@ -0,0 +1,215 @@
+import datetime
+import json
+import os
+import re
+import numpy as np
+import pandas as pd
+import Instrumentation
+
+try:
+    import pyarrow
+    import pyarrow.parquet as parquet
+except ImportError:
+    parquet = None
+
+
+#Writes the results of a session to a columnar store, so that large tables are written quickly and downstream tools can read
+#only the columns they need. Excel is only used for an optional summary (statistics, binned data and peri-event averages).
+#backend "parquet": one .parquet file per table in <outDir>/<sessionName>_results/, plus metadata.json describing every table
+#backend "hdf5": one <outDir>/<sessionName>_results.h5 store with a key per table, with table metadata stored as attributes
+#and the session metadata as json under the metadata key
+#Use as a context manager, or call close() to write the metadata and Excel summary.
+class ResultWriter:
+    def __init__(self, outDir, sessionName, backend = "parquet", excelSummary = True, metadata = None):
+        self.outDir = outDir
+        self.sessionName = sessionName
+        self.backend = backend.lower()
+        self.excelSummary = excelSummary
+        self.metadata = {"session": sessionName, "created": datetime.datetime.now().isoformat(), "tables": {}}
+        if metadata is not None:
+            self.metadata.update(metadata)
+        #sheets of the excel summary, {name: (dataframe, write index)}
+        self.summary = {}
+        self.store = None
+
+        os.makedirs(outDir, exist_ok=True)
+        if self.backend == "parquet":
+            if parquet is None:
+                raise ImportError("The parquet backend needs pyarrow. Install pyarrow or use backend='hdf5'")
+            self.path = os.path.join(outDir, sessionName + "_results")
+            os.makedirs(self.path, exist_ok=True)
+        elif self.backend == "hdf5":
+            self.path = os.path.join(outDir, sessionName + "_results.h5")
+            self.store = pd.HDFStore(self.path, mode="w")
+        else:
+            raise ValueError("Unknown result backend " + str(backend) + ". Use parquet or hdf5")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    #writes a dataframe as a table, with an optional dictionary of metadata describing it
+    #summary: if True, the table is also added to the excel summary
+    def writeFrame(self, name, frame, metadata = None, summary = False):
+        if frame is None:
+            return
+        frame = columnarFrame(frame)
+        info = {"rows": len(frame), "columns": [str(c) for c in frame.columns]}
+        if metadata is not None:
+            info["metadata"] = metadata
+        if self.backend == "parquet":
+            table = pyarrow.Table.from_pandas(frame)
+            schemaMetadata = dict(table.schema.metadata or {})
+            schemaMetadata[b"pypline"] = json.dumps(metadata or {}, default=str).encode()
+            parquet.write_table(table.replace_schema_metadata(schemaMetadata), os.path.join(self.path, name + ".parquet"))
+            info["file"] = name + ".parquet"
+        else:
+            self.store.put(name, frame, format="table")
+            self.store.get_storer(name).attrs.pypline = metadata or {}
+            info["key"] = name
+        self.metadata["tables"][name] = info
+        if summary:
+            self.summary[name] = (frame, False)
+
+    #writes an EventAlignment.AlignedTrials as a long table with one row per trial and sample, holding the trial number,
+    #event-centric time and every signal
+    def writeAligned(self, name, aligned, metadata = None):
+        numTrials, numSamples, numSignals = aligned.trials.shape
+        frame = {"trial": np.repeat(np.arange(numTrials), numSamples), "Time": np.tile(aligned.Time, numTrials)}
+        for x in range(numSignals):
+            frame[str(aligned.signals[x])] = aligned.trials[:, :, x].ravel()
+        info = {"trials": numTrials, "samples": numSamples, "signals": [str(s) for s in aligned.signals]}
+        if metadata is not None:
+            info.update(metadata)
+        self.writeFrame(name, pd.DataFrame(frame), info)
+
+    #writes a statistics dictionary: scalar values go to a single Statistics table (and the metadata),
+    #dataframe values (e.g. per-trial annotations) are written as tables of their own
+    def writeStats(self, stats, name = "Statistics"):
+        scalars = {}
+        for key, value in stats.items():
+            if isinstance(value, pd.DataFrame):
+                self.writeFrame(key, value, summary=True)
+            else:
+                scalars[key] = value
+        if len(scalars) > 0:
+            frame = pd.DataFrame({"statistic": list(scalars.keys()), "value": [toScalar(v) for v in scalars.values()]})
+            self.writeFrame(name, frame, summary=True)
+            self.metadata[name] = {k: toScalar(v) for k, v in scalars.items()}
+
+    #writes every result of a PhotometryData struct
+    @Instrumentation.stage("write", rowsIn=lambda self, data, *args, **kwargs: data.pt_cleaned)
+    def writePhotometry(self, data, prefix = ""):
+        self.metadata["photometry"] = {"type": data.type, "recorderType": data.recorderType, "cutoff": data.cutoff,
+                                       "autoFlProfile": data.autoFlProfile, "numChan": data.numChan,
+                                       "numAnimals": getattr(data, "numAnimals", 1), "events": data.id_events}
+        self.writeFrame(prefix + "raw", data.pt_raw)
+        self.writeFrame(prefix + "cleaned", data.pt_cleaned)
+        self.writeFrame(prefix + "binned", data.pt_binned, summary=True)
+        self.writeFrame(prefix + "events", data.timestamp_data)
+        self.writeFrame(prefix + "channels", getattr(data, "channelPairs", None))
+        self.writeFrame(prefix + "fit", getattr(data, "fitParams", None), summary=True)
+        for key, value in getattr(data, "pt_alignedTrials", {}).items():
+            self.writeAligned(prefix + key + "_trials", value)
+        for key, value in data.pt_alignedEvents.items():
+            self.writeFrame(prefix + key + "_aligned", value, summary=True)
+
+    #writes every result of a BehaviorData struct
+    @Instrumentation.stage("write", rowsIn=lambda self, data, *args, **kwargs: data.beh_cleaned)
+    def writeBehavior(self, data, prefix = ""):
+        self.metadata["behavior"] = {"type": data.type, "control_type": data.control_type, "threshold": data.threshold,
+                                     "videoPath": data.videoPath, "fps": toScalar(data.fps), "trueFrames": toScalar(data.trueFrames),
+                                     "events": data.id_events}
+        self.writeFrame(prefix + "raw", data.beh_data)
+        self.writeFrame(prefix + "cleaned", data.beh_cleaned)
+        self.writeFrame(prefix + "TTL", data.beh_TTL)
+        self.writeFrame(prefix + "events", data.timestamp_data)
+        for key, value in getattr(data, "beh_alignedTrials", {}).items():
+            self.writeAligned(prefix + key + "_trials", value)
+        for key, value in data.beh_alignedEvents.items():
+            self.writeFrame(prefix + key + "_aligned", value, summary=True)
+        self.writeFrame(prefix + "annotations", getattr(data, "beh_annotations", None), summary=True)
+        self.writeStats(data.beh_stats, prefix + "Statistics")
+
+    #writes the metadata and the excel summary
+    @Instrumentation.stage("write")
+    def close(self):
+        if self.store is not None:
+            self.store.put("metadata", pd.Series([json.dumps(self.metadata, default=str)]))
+            self.store.close()
+            self.store = None
+        elif self.backend == "parquet":
+            with open(os.path.join(self.path, "metadata.json"), "w") as f:
+                json.dump(self.metadata, f, indent=2, default=str)
+        if self.excelSummary and len(self.summary) > 0:
+            writeExcelSummary(os.path.join(self.outDir, self.sessionName + "_Summary.xlsx"), self.summary)
+            self.summary = {}
+
+
+#Writes {sheet name: (dataframe, write index)} to an excel file row by row with xlsxwriter's constant memory mode,
+#so that memory use does not grow with the size of the sheets. Nan values are written as empty cells.
+def writeExcelSummary(dest, sheets):
+    import xlsxwriter
+    workbook = xlsxwriter.Workbook(dest, {"constant_memory": True})
+    used = set()
+    for name, (frame, index) in sheets.items():
+        if isinstance(frame, pd.Series):
+            frame = frame.to_frame()
+        if index:
+            frame = frame.reset_index()
+        worksheet = workbook.add_worksheet(sheetName(name, used))
+        worksheet.write_row(0, 0, [str(c) for c in frame.columns])
+        for r, row in enumerate(frame.itertuples(index=False, name=None), start=1):
+            worksheet.write_row(r, 0, [toScalar(v) for v in row])
+    workbook.close()
+
+
+#returns a valid excel sheet name for name (at most 31 characters, without []:*?/ or backslashes) which is not already in used
+def sheetName(name, used):
+    name = re.sub(r"[\[\]:*?/\\]", "_", str(name))[0:31]
+    candidate = name
+    x = 1
+    while candidate.lower() in used:
+        suffix = "_" + str(x)
+        candidate = name[0:31 - len(suffix)] + suffix
+        x += 1
+    used.add(candidate.lower())
+    return candidate
+
+
+#returns frame with unique string column names and object columns converted to numbers (or strings if they are not numeric),
+#which is what columnar formats need
+def columnarFrame(frame):
+    if isinstance(frame, pd.Series):
+        frame = frame.to_frame()
+    frame = frame.copy(deep=False)
+    if not isinstance(frame.columns, pd.MultiIndex):
+        #columnar formats need unique names, repeated names get a .1, .2... suffix as with pd.read_csv
+        names = [str(c) for c in frame.columns]
+        counts = {}
+        for x, name in enumerate(names):
+            if name in counts:
+                counts[name] += 1
+                names[x] = name + "." + str(counts[name])
+            else:
+                counts[name] = 0
+        frame.columns = names
+    for x in range(frame.shape[1]):
+        if frame.iloc[:, x].dtype == object:
+            try:
+                values = pd.to_numeric(frame.iloc[:, x])
+            except (ValueError, TypeError):
+                values = frame.iloc[:, x].astype(str)
+            frame.isetitem(x, values)
+    return frame
+
+
+#converts numpy scalars and nan to plain python values
+def toScalar(value):
+    if isinstance(value, np.generic):
+        value = value.item()
+    if value is pd.NA or value is pd.NaT or (isinstance(value, float) and np.isnan(value)):
+        return None
+    return value
@@ -0,0 +1,190 @@
+import hashlib
+import json
+import os
+import pickle
+import pandas as pd
+
+try:
+    import pyarrow
+    import pyarrow.feather as feather
+except ImportError:
+    feather = None
+
+#bump whenever the on-disk layout of cached sheets changes
+CACHE_VERSION = 1
+#default location and size limit of the cache, can be overridden with environment variables
+DEFAULT_CACHE_DIR = os.environ.get("PYPLINE_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".pypline_cache"))
+DEFAULT_MAX_BYTES = int(os.environ.get("PYPLINE_CACHE_MAX_BYTES", 2 * 1024 ** 3))
+
+
+#Stores each parsed sheet of an excel workbook on first read, keyed by the hash of the workbook contents and the parameters
+#passed to the excel reader. Later reads of the same sheet load the stored copy instead of re-parsing the workbook.
+#Sheets are stored as memory-mappable feather files when pyarrow is installed and the sheet can be represented as a typed
+#column table, otherwise (or for sheets with mixed-type columns, such as DeepLabCut headers) they are pickled.
+#Once the cache grows past maxBytes, the least recently used entries are removed.
+class WorkbookCache:
+    def __init__(self, cacheDir = None, maxBytes = DEFAULT_MAX_BYTES, enabled = True):
+        self.cacheDir = cacheDir if cacheDir is not None else DEFAULT_CACHE_DIR
+        self.maxBytes = maxBytes
+        self.enabled = enabled
+        #hashes of files already read in this session, keyed by path, size and modification time
+        self._hashes = {}
+
+    #sha1 of the contents of a file, read in 1MB blocks
+    def fileHash(self, fpath):
+        stat = os.stat(fpath)
+        memoKey = (os.path.abspath(fpath), stat.st_size, stat.st_mtime_ns)
+        if memoKey not in self._hashes:
+            sha = hashlib.sha1()
+            with open(fpath, "rb") as f:
+                for block in iter(lambda: f.read(1024 * 1024), b""):
+                    sha.update(block)
+            self._hashes[memoKey] = sha.hexdigest()
+        return self._hashes[memoKey]
+
+    #name of the cache entry for a sheet, without extension. Entries for a file all share the file hash as a prefix
+    def entryName(self, fileHash, readerArgs):
+        params = json.dumps({"args": readerArgs, "version": CACHE_VERSION, "pandas": pd.__version__}, sort_keys=True, default=str)
+        return fileHash[0:20] + "_" + hashlib.sha1(params.encode()).hexdigest()[0:20]
+
+    #Given a path to an .xlsx file and a dictionary of {name: pd.read_excel keyword arguments}, returns a dictionary of
+    #{name: dataframe}. Sheets which could not be read are left out of the returned dictionary.
+    #The workbook itself is opened at most once, and only if one of the sheets is not in the cache.
+    #If refresh is True, any cached copies of this file are discarded first.
+    def readSheets(self, fpath, sheets, refresh = False):
+        if refresh:
+            self.invalidate(fpath)
+        results = {}
+        missing = dict(sheets)
+        fileHash = None
+        if self.enabled:
+            fileHash = self.fileHash(fpath)
+            for name, readerArgs in sheets.items():
+                found, frame = self._load(self.entryName(fileHash, readerArgs))
+                if found:
+                    del missing[name]
+                    if frame is not None:
+                        results[name] = frame
+
+        if len(missing) > 0:
+            with pd.ExcelFile(fpath) as workbook:
+                for name, readerArgs in missing.items():
+                    frame = None
+                    try:
+                        frame = workbook.parse(**readerArgs)
+                        results[name] = frame
+                    except Exception:
+                        pass
+                    #sheets which are not in the workbook are remembered too, so we don't reopen the workbook looking for them
+                    if self.enabled:
+                        self._store(self.entryName(fileHash, readerArgs), frame)
+            if self.enabled:
+                self.evict()
+        return results
+
+    #removes cached sheets for the given file, or the whole cache if no file is given
+    def invalidate(self, fpath = None):
+        if not os.path.isdir(self.cacheDir):
+            return
+        prefix = ""
+        if fpath is not None:
+            prefix = self.fileHash(fpath)[0:20] + "_"
+        for entry in os.listdir(self.cacheDir):
+            path = os.path.join(self.cacheDir, entry)
+            #other caches (video metadata, pipeline stages) live in subdirectories
+            if entry.startswith(prefix) and os.path.isfile(path):
+                os.remove(path)
+
+    #removes least recently used entries until the cache is smaller than maxBytes
+    def evict(self):
+        evictFiles(self.cacheDir, self.maxBytes)
+
+    #returns (found, frame), where frame is None if the sheet was previously found to be missing
+    def _load(self, entry):
+        base = os.path.join(self.cacheDir, entry)
+        found, frame = loadFrame(base)
+        if found:
+            return True, frame
+        if os.path.exists(base + ".missing"):
+            os.utime(base + ".missing")
+            return True, None
+        return False, None
+
+    def _store(self, entry, frame):
+        os.makedirs(self.cacheDir, exist_ok=True)
+        base = os.path.join(self.cacheDir, entry)
+        if frame is None:
+            open(base + ".missing", "w").close()
+            return
+        storeFrame(base, frame)
+
+
+#Stores a dataframe as base + ".feather", a memory-mappable typed column table, when pyarrow is installed and the frame can be
+#represented as one, otherwise (e.g. mixed-type columns, such as DeepLabCut headers) pickles it to base + ".pkl".
+#Returns the path written
+def storeFrame(base, frame):
+    if feather is not None:
+        try:
+            table = pyarrow.Table.from_pandas(frame)
+            feather.write_feather(table, base + ".feather.tmp")
+            os.replace(base + ".feather.tmp", base + ".feather")
+            return base + ".feather"
+        except Exception:
+            #mixed-type or unnamed columns cannot be stored as a typed table
+            if os.path.exists(base + ".feather.tmp"):
+                os.remove(base + ".feather.tmp")
+    with open(base + ".pkl.tmp", "wb") as f:
+        pickle.dump(frame, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(base + ".pkl.tmp", base + ".pkl")
+    return base + ".pkl"
+
+
+#loads a dataframe stored by storeFrame, returning (found, frame). Loaded files are touched so that eviction keeps them
+def loadFrame(base):
+    for ext in [".feather", ".pkl"]:
+        path = base + ext
+        if os.path.exists(path):
+            os.utime(path)
+            if ext == ".feather":
+                return True, feather.read_table(path, memory_map=True).to_pandas()
+            with open(path, "rb") as f:
+                return True, pickle.load(f)
+    return False, None
+
+
+#removes the least recently used (oldest modification time) files of a directory until it is smaller than maxBytes
+#readers touch the files they load, so that recently read entries are kept
+def evictFiles(cacheDir, maxBytes):
+    if not os.path.isdir(cacheDir):
+        return
+    entries = []
+    for entry in os.listdir(cacheDir):
+        path = os.path.join(cacheDir, entry)
+        if not os.path.isfile(path):
+            continue
+        stat = os.stat(path)
+        entries.append((stat.st_mtime, stat.st_size, path))
+    total = sum([e[1] for e in entries])
+    for mtime, size, path in sorted(entries):
+        if total <= maxBytes:
+            break
+        os.remove(path)
+        total -= size
+
+
+_defaultCache = None
+
+
+#shared cache used by PhotometryData and BehaviorData
+def getDefaultCache():
+    global _defaultCache
+    if _defaultCache is None:
+        _defaultCache = WorkbookCache()
+    return _defaultCache
+
+
+#reads sheets through the default cache, or straight from the workbook (still opening it only once) if useCache is False
+def readSheets(fpath, sheets, useCache = True, refresh = False):
+    if useCache:
+        return getDefaultCache().readSheets(fpath, sheets, refresh=refresh)
+    return WorkbookCache(enabled=False).readSheets(fpath, sheets)
@@ -0,0 +1,233 @@
+import collections
+import copy
+import os
+import shutil
+import sys
+import tempfile
+import weakref
+from multiprocessing import shared_memory
+import numpy as np
+import pandas as pd
+import Instrumentation
+
+#Numeric columns and arrays of a PhotometryData or BehaviorData (or a dictionary of dataframes and arrays) placed in shared
+#memory, or in memory-mapped files, so that worker processes can attach to them by name instead of receiving pickled copies.
+#
+#Ownership: the process which creates a SharedSession owns the memory. It stays available until the owner calls close() (or
+#leaves the with block), which unlinks it, and is unlinked when the owner is garbage collected or exits otherwise.
+#Workers attach with attach(handle), where handle is the small picklable SharedSession.handle. Attached data is read-only
+#and copy-on-write: a worker which modifies a dataframe (e.g. by cleaning or normalizing it) gets a private copy of the
+#modified columns, and other processes never see the change. Workers call close() on the attached session (or leave the
+#with block) when done, after which its dataframes must not be used.
+#
+#   with SharedSession.SharedSession(data) as shared:                 #data: a PhotometryData which has been read
+#       pool.map(work, [(shared.handle, channel) for channel in channels])
+#
+#   def work(args):
+#       handle, channel = args
+#       with SharedSession.attach(handle) as attached:
+#           return attached.data.pt_raw[channel].mean()
+
+#attributes of PhotometryData and BehaviorData which hold the large tables of a session
+SESSION_ATTRIBUTES = ["pt_raw", "pt_cleaned", "pt_binned", "beh_data", "beh_cleaned", "beh_pose"]
+#columns start at multiples of this many bytes within the shared block
+ALIGNMENT = 64
+
+logger = Instrumentation.getLogger("shared")
+
+#name: shared memory block name or memory-mapped file path, backend: "shm" or "mmap", size: bytes
+#tables: {attribute: table layout} of the shared dataframes and arrays, data: the session without them (pickled as is)
+SessionHandle = collections.namedtuple("SessionHandle", ["name", "backend", "size", "tables", "data"])
+
+
+#Places the numeric columns of every dataframe and every array among attributes (default: those of SESSION_ATTRIBUTES which
+#are set) of data in one block. data: a PhotometryData, BehaviorData or dictionary of dataframes and arrays
+#backend: "shm" for shared memory (in RAM, /dev/shm on linux) or "mmap" for a file in directory (default the temporary
+#directory), for sessions too large to keep twice in memory. Columns which are not numeric are pickled with the handle.
+class SharedSession:
+    def __init__(self, data, attributes = None, backend = "shm", directory = None):
+        if backend not in ["shm", "mmap"]:
+            raise ValueError("Unknown shared session backend " + str(backend) + ". Use shm or mmap")
+        values = data if isinstance(data, dict) else vars(data)
+        if attributes is None:
+            attributes = [a for a in (values if isinstance(data, dict) else SESSION_ATTRIBUTES) if isShareable(values.get(a))]
+        tables = {}
+        size = 0
+        for attribute in attributes:
+            tables[attribute], size = tableLayout(values[attribute], size)
+
+        self.backend = backend
+        self.block = None
+        self.directory = None
+        if backend == "shm":
+            self.block = shared_memory.SharedMemory(create=True, size=max(size, 1))
+            name = self.block.name
+            buffer = np.ndarray((max(size, 1),), dtype=np.uint8, buffer=self.block.buf)
+        else:
+            self.directory = tempfile.mkdtemp(prefix="pypline_shared_", dir=directory)
+            name = os.path.join(self.directory, "session.bin")
+            buffer = np.memmap(name, dtype=np.uint8, mode="w+", shape=(max(size, 1),))
+        for attribute, layout in tables.items():
+            writeTable(buffer, layout, values[attribute])
+        if backend == "mmap":
+            buffer.flush()
+        del buffer
+
+        #the session without its shared tables, which travels with the handle
+        if isinstance(data, dict):
+            shell = {k: v for k, v in data.items() if k not in tables}
+        else:
+            shell = copy.copy(data)
+            for attribute in tables:
+                setattr(shell, attribute, None)
+        self.handle = SessionHandle(name, backend, size, tables, shell)
+        #unlink when the owner is collected or exits without calling close()
+        self._finalizer = weakref.finalize(self, release, self.block, self.directory, os.getpid())
+        logger.debug("Shared %d table(s), %d bytes, as %s", len(tables), size, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    #frees the shared memory (or removes the memory-mapped file), sessions attached to it keep working until they are closed
+    def close(self):
+        self._finalizer()
+
+    @property
+    def closed(self):
+        return not self._finalizer.alive
+
+
+#frees a session's memory, only in the process which created it (forked workers inherit the owner's finalizer)
+def release(block, directory, owner):
+    if os.getpid() != owner:
+        return
+    if block is not None:
+        block.close()
+        try:
+            block.unlink()
+        except FileNotFoundError:
+            pass
+    if directory is not None:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+#A session attached to shared tables: data is a copy of the shared session (a struct or dictionary) whose tables are
+#read-only, copy-on-write views of the shared block
+class AttachedSession:
+    def __init__(self, handle):
+        self.handle = handle
+        self.block = None
+        if handle.backend == "shm":
+            #python 3.13 can attach without registering the block with the resource tracker, which would otherwise unlink
+            #it when a process which did not start from the owner exits
+            if sys.version_info >= (3, 13):
+                self.block = shared_memory.SharedMemory(name=handle.name, track=False)
+            else:
+                self.block = shared_memory.SharedMemory(name=handle.name)
+            buffer = np.ndarray((max(handle.size, 1),), dtype=np.uint8, buffer=self.block.buf)
+        else:
+            buffer = np.memmap(handle.name, dtype=np.uint8, mode="r", shape=(max(handle.size, 1),))
+        #dataframes over the block are kept here, data only holds shallow copies of them so that writes copy first
+        self.tables = {attribute: readTable(buffer, layout) for attribute, layout in handle.tables.items()}
+        del buffer
+        if isinstance(handle.data, dict):
+            self.data = dict(handle.data)
+            self.data.update({k: shallowCopy(v) for k, v in self.tables.items()})
+        else:
+            self.data = copy.copy(handle.data)
+            for attribute, table in self.tables.items():
+                setattr(self.data, attribute, shallowCopy(table))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    #releases this process' view of the block. Tables of data must not be used afterwards
+    def close(self):
+        self.tables = {}
+        self.data = None
+        if self.block is not None:
+            try:
+                self.block.close()
+            except BufferError:
+                #a table of this session is still referenced elsewhere, the view is released when it is collected
+                logger.debug("Shared block %s is still in use, leaving it open", self.handle.name)
+            self.block = None
+
+
+#attaches to a shared session by its handle, see AttachedSession
+def attach(handle):
+    return AttachedSession(handle)
+
+
+def isShareable(value):
+    return isinstance(value, pd.DataFrame) or (isinstance(value, np.ndarray) and value.dtype.kind in "biuf")
+
+
+def shallowCopy(value):
+    return value.copy(deep=False) if isinstance(value, pd.DataFrame) else value
+
+
+#Layout of a dataframe or array in the block, starting at offset. Returns (layout, offset after it).
+#Every numeric or boolean column is stored contiguously with its own dtype, other columns and the index are kept in the layout
+def tableLayout(value, offset):
+    if isinstance(value, np.ndarray):
+        if value.dtype.kind not in "biuf":
+            raise TypeError("Only numeric arrays can be shared, got dtype " + str(value.dtype))
+        offset = alignOffset(offset)
+        return {"kind": "array", "offset": offset, "shape": value.shape, "dtype": value.dtype.str}, offset + value.nbytes
+    if not isinstance(value, pd.DataFrame):
+        raise TypeError("Only dataframes and numpy arrays can be shared, got " + str(type(value)))
+    columns = []
+    others = {}
+    for x in range(value.shape[1]):
+        dtype = value.dtypes.iloc[x]
+        if isinstance(dtype, np.dtype) and dtype.kind in "biuf":
+            offset = alignOffset(offset)
+            columns.append((x, offset, dtype.str))
+            offset += value.shape[0] * dtype.itemsize
+        else:
+            others[x] = value.iloc[:, x]
+    index = None if isinstance(value.index, pd.RangeIndex) and value.index.start == 0 and value.index.step == 1 else value.index
+    return {"kind": "frame", "rows": value.shape[0], "columns": value.columns, "shared": columns, "others": others,
+            "index": index}, offset
+
+
+def alignOffset(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def writeTable(buffer, layout, value):
+    if layout["kind"] == "array":
+        view(buffer, layout["offset"], layout["dtype"], layout["shape"])[...] = value
+        return
+    for x, offset, dtype in layout["shared"]:
+        view(buffer, offset, dtype, (layout["rows"],))[:] = value.iloc[:, x].to_numpy()
+
+
+def readTable(buffer, layout):
+    if layout["kind"] == "array":
+        return readOnly(view(buffer, layout["offset"], layout["dtype"], layout["shape"]))
+    arrays = {x: readOnly(view(buffer, offset, dtype, (layout["rows"],))) for x, offset, dtype in layout["shared"]}
+    arrays.update({x: series.array for x, series in layout["others"].items()})
+    index = layout["index"] if layout["index"] is not None else pd.RangeIndex(layout["rows"])
+    #columns are built by position, so duplicated or non-string column names are kept as they are
+    frame = pd.DataFrame({x: arrays[x] for x in range(len(layout["columns"]))}, index=index, copy=False)
+    frame.columns = layout["columns"]
+    return frame
+
+
+def view(buffer, offset, dtype, shape):
+    dtype = np.dtype(dtype)
+    count = int(np.prod(shape))
+    return buffer[offset:offset + count * dtype.itemsize].view(dtype).reshape(shape)
+
+
+def readOnly(array):
+    array.flags.writeable = False
+    return array
@@ -0,0 +1,144 @@
+import warnings
+import numpy as np
+
+try:
+    import scipy.signal as scipySignal
+except ImportError:
+    scipySignal = None
+
+#Smoothing, filtering and decimation shared by the photometry and behavior pipelines.
+#Every function works along the first axis (samples) of a (samples) or (samples x channels) array, on every channel at once,
+#and treats nan as missing data rather than letting it spread to its neighbours.
+
+
+#NaN-aware centered moving average: the mean of the non-nan samples within window samples around every sample (from
+#window // 2 samples before to window - window // 2 - 1 samples after), computed from running sums in O(n) for any window.
+#minCount: fewest non-nan samples a window needs, otherwise the result is nan
+#partial: average windows which run past the start or end of the data over the samples they have, instead of returning nan
+def movingAverage(values, window, minCount = 1, partial = False):
+    values = np.asarray(values, dtype=float)
+    if window < 1:
+        raise ValueError("Moving average window must be at least 1 sample, got " + str(window))
+    n = values.shape[0]
+    finite = ~np.isnan(values)
+    #running sums of values relative to their mean, which keeps the sums small and accurate for long recordings
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        offset = np.nan_to_num(np.nanmean(values, axis=0)) if n > 0 else 0
+    sums = np.zeros((n + 1,) + values.shape[1:])
+    np.cumsum(np.where(finite, values - offset, 0), axis=0, out=sums[1:])
+    counts = np.zeros((n + 1,) + values.shape[1:], dtype=np.int64)
+    np.cumsum(finite, axis=0, out=counts[1:])
+
+    start = np.arange(n) - window // 2
+    stop = start + window
+    low = np.clip(start, 0, n)
+    high = np.clip(stop, 0, n)
+    count = counts[high] - counts[low]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        out = (sums[high] - sums[low]) / count + offset
+    out[count < max(minCount, 1)] = np.nan
+    if not partial:
+        out[(start < 0) | (stop > n)] = np.nan
+    return out
+
+
+#Linearly interpolates runs of at most maxGap nan samples, for every channel at once.
+#Gaps at the start or end of a channel are left as nan, unless extend is True, in which case they take the nearest value.
+#Gaps longer than maxGap are always left as nan.
+def interpolateGaps(values, maxGap, extend = False):
+    values = np.asarray(values, dtype=float)
+    shape = values.shape
+    n = shape[0]
+    if n < 1 or (maxGap < 1 and not extend):
+        return values.copy()
+    #one contiguous row per channel, accumulating along rows is much faster than along columns
+    channels = values.reshape(n, -1).T.copy()
+    valid = ~np.isnan(channels)
+    samples = np.arange(n, dtype=np.int32)
+    #last valid sample at or before, and first valid sample at or after every sample
+    previous = np.maximum.accumulate(np.where(valid, samples, -1), axis=1)
+    following = np.minimum.accumulate(np.where(valid, samples, n)[:, ::-1], axis=1)[:, ::-1]
+    inside = (previous >= 0) & (following < n)
+    fill = ~valid & inside & (following - previous - 1 <= maxGap)
+    c, r = np.nonzero(fill)
+    p, f = previous[c, r], following[c, r]
+    channels[c, r] = channels[c, p] + (r - p) / (f - p) * (channels[c, f] - channels[c, p])
+    if extend:
+        c, r = np.nonzero(~valid & (previous < 0) & (following < n))
+        channels[c, r] = channels[c, following[c, r]]
+        c, r = np.nonzero(~valid & (previous >= 0) & (following >= n))
+        channels[c, r] = channels[c, previous[c, r]]
+    return channels.T.reshape(shape)
+
+
+#Zero-phase Butterworth filter (applied forwards and backwards, so peaks are not shifted in time).
+#cutoff: cutoff frequency in Hz, or [low, high] for "bandpass"/"bandstop", rate: samples per second
+#kind: "lowpass", "highpass", "bandpass" or "bandstop"
+#segments: optional id of the segment of every sample (e.g. the recording windows of pulsed photometry), each run of equal
+#ids is filtered on its own so the filter does not bridge the gaps between them
+#Missing samples are interpolated for filtering and are nan again in the result.
+def butterworth(values, cutoff, rate, kind = "lowpass", order = 4, segments = None):
+    if scipySignal is None:
+        raise ImportError("Butterworth filters need scipy. Install scipy to filter signals")
+    values = np.asarray(values, dtype=float)
+    if np.any(np.asarray(cutoff, dtype=float) >= rate / 2):
+        raise ValueError("Cutoff " + str(cutoff) + " Hz must be below the Nyquist frequency (" + str(rate / 2) + " Hz)")
+    sos = scipySignal.butter(order, cutoff, btype=kind, fs=rate, output="sos")
+    if segments is None:
+        return zeroPhase(sos, values)
+    segments = np.asarray(segments)
+    bounds = np.concatenate([[0], np.flatnonzero(segments[1:] != segments[:-1]) + 1, [len(segments)]])
+    out = np.empty(values.shape)
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        out[start:end] = zeroPhase(sos, values[start:end])
+    return out
+
+
+#zero-phase low-pass (lowpass given), high-pass (highpass given) or band-pass (both given) filter, see butterworth
+#returns a copy of values if neither is given
+def bandFilter(values, rate, lowpass = None, highpass = None, order = 4, segments = None):
+    if lowpass is not None and highpass is not None:
+        return butterworth(values, [highpass, lowpass], rate, "bandpass", order, segments)
+    if lowpass is not None:
+        return butterworth(values, lowpass, rate, "lowpass", order, segments)
+    if highpass is not None:
+        return butterworth(values, highpass, rate, "highpass", order, segments)
+    return np.array(values, dtype=float)
+
+
+#applies second-order sections forwards and backwards along the first axis, filling missing samples first
+def zeroPhase(sos, values):
+    missing = np.isnan(values)
+    if values.shape[0] < 2 or missing.all():
+        return values.copy()
+    filled = interpolateGaps(values, values.shape[0], extend=True) if missing.any() else values
+    #channels without any data stay nan
+    filled = np.where(np.isnan(filled), 0, filled)
+    #short segments cannot be padded by the default length (3 times the number of filter coefficients)
+    padlen = min(3 * (2 * len(sos) + 1), values.shape[0] - 1)
+    out = scipySignal.sosfiltfilt(sos, filled, axis=0, padlen=padlen)
+    out[missing] = np.nan
+    return out
+
+
+#Anti-aliased decimation: low-pass filters below the Nyquist frequency of targetRate, then keeps every factor-th sample
+#(factor = rate / targetRate rounded to an integer). Returns (decimated values, factor).
+def decimate(values, rate, targetRate, order = 8, segments = None):
+    factor = int(round(rate / targetRate))
+    values = np.asarray(values, dtype=float)
+    if factor <= 1:
+        return values.copy(), 1
+    filtered = butterworth(values, 0.8 * (rate / factor) / 2, rate, "lowpass", order, segments)
+    return filtered[::factor], factor
+
+
+#samples per second of a recording from the median interval between sample times, ignoring the gaps between segments
+def sampleRate(time, segments = None):
+    step = np.diff(np.asarray(time, dtype=float))
+    if segments is not None:
+        step = step[np.asarray(segments)[1:] == np.asarray(segments)[:-1]]
+    step = step[step > 0]
+    if len(step) < 1:
+        raise ValueError("Cannot determine the sample rate of fewer than two distinct sample times")
+    return 1 / np.median(step)
@@ -0,0 +1,49 @@
+import numpy as np
+import Instrumentation
+import SignalProcessing
+
+logger = Instrumentation.getLogger("velocity")
+
+
+#Given an array of coordinates shaped (frames x parts x 2), or (frames x 2) for a single part, returns the frame-to-frame
+#euclidian displacement of every part and the total locomotion of every part.
+#Displacements greater than or equal to threshold are treated as putative outliers and set to nan, and are not counted
+#towards total locomotion. The first frame has no previous frame, so its velocity is always 0.
+#If movingAverage is True, velocity is smoothed with a 10 sample moving average which skips nan frames.
+def calcVelocity(coords, threshold = 100, movingAverage = False):
+    coords = np.asarray(coords, dtype=float)
+    singlePart = coords.ndim == 2
+    if singlePart:
+        coords = coords[:, np.newaxis, :]
+    if coords.ndim != 3 or coords.shape[2] < 2:
+        raise ValueError("Expected coordinates shaped (frames x parts x 2), got " + str(coords.shape))
+
+    vel = np.zeros(coords.shape[0:2])
+    if coords.shape[0] > 1:
+        step = np.diff(coords[:, :, 0:2], axis=0)
+        dist = np.hypot(step[:, :, 0], step[:, :, 1])
+        #nan displacements compare as False, so they stay nan without being counted as outliers
+        dist[dist >= threshold] = np.nan
+        vel[1:] = dist
+
+    locomotion = np.nansum(vel, axis=0)
+
+    if movingAverage == True:
+        vel = smoothVelocity(vel)
+
+    if singlePart:
+        return vel[:, 0], float(locomotion[0])
+    return vel, locomotion
+
+
+#Moving average (10 samples by default) along the frame axis of a (frames x parts) array, skipping nan frames.
+#First window/2 and last window/2 - 1 samples cannot be calculated, so they are padded with 0 so that dimensions fit with existing data
+#This differs from the per-frame calcVel loop it replaced in two ways: the loop padded window/2 samples at the end, returning
+#one sample more than it was given, and its np.convolve made every window containing a nan frame (a dropped label or an
+#outlier) nan, where the mean of the window's other frames is returned here. Windows without nan frames are unchanged.
+def smoothVelocity(vel, window = 10):
+    out = SignalProcessing.movingAverage(vel, window)
+    n = out.shape[0]
+    out[0:min(window // 2, n)] = 0
+    out[max(n - (window - window // 2 - 1), 0):n] = 0
+    return out
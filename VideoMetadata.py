@@ -0,0 +1,249 @@
+import collections
+import concurrent.futures
+import hashlib
+import json
+import os
+import shutil
+import struct
+import subprocess
+import numpy as np
+import Instrumentation
+import SessionCache
+
+#Frame count, frame rate, duration and per-frame timestamps of behavioral videos, read from the container's headers and
+#index without decoding any frame:
+#   .avi files: the RIFF headers and idx1 index are parsed directly (one entry per frame, so dropped frames are counted)
+#   other containers: ffprobe's packet list, if ffprobe is installed
+#   otherwise: cv2's CAP_PROP_FRAME_COUNT and CAP_PROP_FPS, with timestamps assumed evenly spaced
+#Results are stored in a sidecar <video>.pypline.json next to the video (or in the session cache directory if the video's
+#directory is read-only), keyed by the size and modification time of the video, so each video is only probed once.
+#
+#   info = VideoMetadata.probeVideo("session1.avi")
+#   info.frames, info.fps, info.duration, info.timestamps
+
+#bump whenever the contents of sidecar files change
+METADATA_VERSION = 1
+SIDECAR_SUFFIX = ".pypline.json"
+
+logger = Instrumentation.getLogger("video")
+
+#path: video file, frames: number of frames, fps: frames per second, duration: seconds,
+#timestamps: presentation time of every frame in seconds (from the start of the video), source: "avi", "ffprobe" or "cv2"
+VideoInfo = collections.namedtuple("VideoInfo", ["path", "frames", "fps", "duration", "timestamps", "source"])
+
+
+#Returns the VideoInfo of a video, from its sidecar if the video has not changed since it was probed.
+#useCache: read and write sidecars, refresh: probe the video again even if a sidecar exists
+@Instrumentation.stage("probe")
+def probeVideo(fpath, useCache = True, refresh = False):
+    if not os.path.exists(fpath):
+        raise FileNotFoundError("Video file not found: " + str(fpath))
+    stat = os.stat(fpath)
+    key = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "version": METADATA_VERSION}
+    if useCache and not refresh:
+        info = loadSidecar(fpath, key)
+        if info is not None:
+            return info
+
+    info = None
+    if os.path.splitext(fpath)[1].lower() == ".avi":
+        try:
+            info = probeAVI(fpath)
+        except (ValueError, struct.error) as e:
+            logger.debug("Could not read the AVI index of %s (%s)", fpath, e)
+    if info is None and shutil.which("ffprobe") is not None:
+        try:
+            info = probeFFprobe(fpath)
+        except (ValueError, subprocess.SubprocessError, OSError) as e:
+            logger.debug("ffprobe failed on %s (%s)", fpath, e)
+    if info is None:
+        info = probeCV2(fpath)
+
+    if useCache:
+        storeSidecar(fpath, key, info)
+    return info
+
+
+#Probes many videos in parallel, returning {path: VideoInfo}. Videos which cannot be probed are logged and left out.
+#Probing waits on file reads and subprocesses rather than the CPU, so threads are used.
+def probeVideos(paths, workers = 8, useCache = True, refresh = False):
+    results = {}
+    paths = list(dict.fromkeys(p for p in paths if p is not None))
+    if len(paths) < 1:
+        return results
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(min(workers, len(paths)), 1)) as pool:
+        futures = {pool.submit(probeVideo, p, useCache, refresh): p for p in paths}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                results[futures[future]] = future.result()
+            except Exception as e:
+                logger.warning("Warning: could not read video metadata of %s (%s)", futures[future], e)
+    return results
+
+
+#Reads the frame rate from the video stream header and counts the video frames in the idx1 index of an .avi file.
+#OpenDML (>1GB) files index frames per RIFF segment, for those the total frame count of the dmlh header is used instead.
+#AVI frames are evenly spaced, a frame which was dropped while recording is stored as an empty chunk and still counted.
+def probeAVI(fpath):
+    streams = []
+    totalFrames = None
+    odmlFrames = None
+    indexFrames = None
+    segments = 0
+    with open(fpath, "rb") as f:
+        fileSize = os.fstat(f.fileno()).st_size
+        position = 0
+        while position + 12 <= fileSize:
+            f.seek(position)
+            riff, size, form = struct.unpack("<4sI4s", f.read(12))
+            if riff != b"RIFF" or form not in [b"AVI ", b"AVIX"]:
+                if segments == 0:
+                    raise ValueError("not an AVI file")
+                break
+            segments += 1
+            end = min(position + 8 + size, fileSize)
+            for fourcc, start, length in riffChunks(f, position + 12, end):
+                if fourcc == b"avih":
+                    f.seek(start)
+                    totalFrames = struct.unpack("<16xI", f.read(20))[0]
+                elif fourcc == b"strh":
+                    f.seek(start)
+                    fccType, scale, rate, streamLength = struct.unpack("<4s16xII4xI", f.read(36))
+                    streams.append({"type": fccType, "scale": scale, "rate": rate, "length": streamLength})
+                elif fourcc == b"dmlh":
+                    f.seek(start)
+                    odmlFrames = struct.unpack("<I", f.read(4))[0]
+                elif fourcc == b"idx1" and segments == 1:
+                    indexFrames = np.frombuffer(readChunk(f, start, length - length % 16),
+                                                dtype=[("ckid", "S4"), ("flags", "<u4"), ("offset", "<u4"), ("size", "<u4")])
+            position = position + 8 + size + size % 2
+
+    videos = [x for x, s in enumerate(streams) if s["type"] == b"vids"]
+    if len(videos) < 1:
+        raise ValueError("no video stream")
+    stream = videos[0]
+    scale, rate = streams[stream]["scale"], streams[stream]["rate"]
+    if scale == 0 or rate == 0:
+        raise ValueError("video stream has no frame rate")
+    fps = rate / scale
+
+    frames = None
+    if indexFrames is not None and segments == 1:
+        #chunk ids are the stream number followed by dc (compressed) or db (uncompressed) for video frames
+        ids = [("%02d" % stream + suffix).encode() for suffix in ["dc", "db"]]
+        frames = int(np.isin(indexFrames["ckid"], ids).sum())
+    if frames is None or frames == 0:
+        frames = odmlFrames or streams[stream]["length"] or totalFrames
+    if not frames:
+        raise ValueError("no frame count in headers")
+    return VideoInfo(fpath, int(frames), fps, frames / fps, np.arange(frames) / fps, "avi")
+
+
+#yields (fourcc, data offset, data length) of every chunk between start and end, descending into LIST chunks except movi
+#(which holds the frames themselves)
+def riffChunks(f, start, end):
+    position = start
+    while position + 8 <= end:
+        f.seek(position)
+        fourcc, size = struct.unpack("<4sI", f.read(8))
+        if fourcc == b"LIST":
+            listType = f.read(4)
+            if listType != b"movi":
+                yield from riffChunks(f, position + 12, min(position + 8 + size, end))
+        else:
+            yield fourcc, position + 8, size
+        position = position + 8 + size + size % 2
+
+
+def readChunk(f, start, length):
+    f.seek(start)
+    return f.read(length)
+
+
+#Lists the packets of the first video stream with ffprobe, which reads the container without decoding frames.
+#Timestamps are the presentation times of the packets, so variable frame rate videos get their true frame times.
+def probeFFprobe(fpath):
+    command = ["ffprobe", "-v", "error", "-select_streams", "v:0", "-show_entries",
+               "stream=avg_frame_rate,r_frame_rate:packet=pts_time", "-of", "json", fpath]
+    output = json.loads(subprocess.run(command, capture_output=True, check=True, timeout=600).stdout)
+    streams = output.get("streams", [])
+    if len(streams) < 1:
+        raise ValueError("no video stream")
+    times = np.array([float(p["pts_time"]) for p in output.get("packets", []) if p.get("pts_time") not in [None, "N/A"]])
+    if len(times) < 1:
+        raise ValueError("no packets")
+    #packets are stored in decoding order, which differs from presentation order for videos with B-frames
+    times = np.sort(times)
+    times = times - times[0]
+    fps = frameRate(streams[0].get("avg_frame_rate")) or frameRate(streams[0].get("r_frame_rate"))
+    if not fps:
+        fps = (len(times) - 1) / times[-1] if times[-1] > 0 else 0
+    duration = times[-1] + 1 / fps if fps else times[-1]
+    return VideoInfo(fpath, len(times), fps, duration, times, "ffprobe")
+
+
+#parses ffprobe's "num/den" frame rates, returning None for 0/0
+def frameRate(text):
+    if text is None:
+        return None
+    num, den = (text.split("/") + ["1"])[0:2]
+    return float(num) / float(den) if float(den) != 0 and float(num) != 0 else None
+
+
+#Frame count and frame rate reported by OpenCV. The count comes from the container headers and may be approximate
+#for some codecs, timestamps are assumed evenly spaced.
+def probeCV2(fpath):
+    import cv2
+    video = cv2.VideoCapture(fpath)
+    try:
+        if not video.isOpened():
+            raise ValueError("OpenCV could not open " + str(fpath))
+        frames = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
+        fps = video.get(cv2.CAP_PROP_FPS)
+    finally:
+        video.release()
+    if not fps:
+        raise ValueError("OpenCV could not read the frame rate of " + str(fpath))
+    return VideoInfo(fpath, frames, fps, frames / fps, np.arange(frames) / fps, "cv2")
+
+
+#candidate paths of the sidecar of a video: next to it, then in the session cache directory
+def sidecarPaths(fpath):
+    name = hashlib.sha1(os.path.abspath(fpath).encode()).hexdigest()[0:20] + "_" + os.path.basename(fpath) + SIDECAR_SUFFIX
+    return [fpath + SIDECAR_SUFFIX, os.path.join(SessionCache.DEFAULT_CACHE_DIR, "video", name)]
+
+
+#returns the VideoInfo stored in a sidecar of the video matching key, or None
+def loadSidecar(fpath, key):
+    for path in sidecarPaths(fpath):
+        try:
+            with open(path) as f:
+                stored = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if stored.get("key") != key:
+            continue
+        frames, fps = stored["frames"], stored["fps"]
+        #evenly spaced timestamps are not stored
+        timestamps = np.asarray(stored["timestamps"], dtype=float) if stored.get("timestamps") is not None else np.arange(frames) / fps
+        return VideoInfo(fpath, frames, fps, stored["duration"], timestamps, stored["source"])
+    return None
+
+
+#writes the sidecar of a video, in the first location which is writable
+def storeSidecar(fpath, key, info):
+    timestamps = None
+    if len(info.timestamps) > 0 and not np.allclose(info.timestamps, np.arange(info.frames) / info.fps, rtol=0, atol=1e-6):
+        timestamps = [float(t) for t in info.timestamps]
+    stored = {"key": key, "frames": int(info.frames), "fps": float(info.fps), "duration": float(info.duration),
+              "source": info.source, "timestamps": timestamps}
+    for path in sidecarPaths(fpath):
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            with open(path + ".tmp", "w") as f:
+                json.dump(stored, f)
+            os.replace(path + ".tmp", path)
+            return path
+        except OSError:
+            continue
+    return None
@@ -0,0 +1,238 @@
+#Benchmark of every stage of the photometry and behavior pipelines on synthetic recordings (see generators.py).
+#Each stage is timed (best of --repeats runs) and its peak memory measured with tracemalloc (in a separate run, since
+#tracing slows allocations down) across increasing recording sizes. The scaling exponent of every stage (slope of
+#log time against log size) is printed, which should be close to 1 for stages that scale linearly.
+#Results can be saved with --out and compared against a previous run with --baseline, which fails (exit code 1) if a
+#stage became slower than the baseline by more than --tolerance.
+#
+#usage:
+#   python benchmarks/bench_pipeline.py --sizes 100000 200000 400000 --out bench.csv
+#   python benchmarks/bench_pipeline.py --baseline bench.csv
+#   python benchmarks/bench_pipeline.py --pipeline behavior --behavior deeplabcut --control brainmata --workbooks
+#   python benchmarks/bench_pipeline.py --pipeline behavior --files --dlc-format h5 --sizes 250000 500000 1000000
+import argparse
+import contextlib
+import io
+import math
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import BehaviorStruct
+import Instrumentation
+import PhotometryStruct
+import generators
+
+#stage timings shorter than this are too noisy to compare against a baseline
+MIN_SECONDS = 0.005
+#default part aligned to events for each behavioral data type
+ALIGN_PARTS = {"deeplabcut": "Tongue_x_bool", "ezt_freezing": "Freezing", "ezt_location": "Distance_px"}
+
+
+#Returns the stages of a photometry session of size samples as a list of (name, function), run in order on a new struct.
+#If workbookDir is given the recording is written to a workbook there first, and reading it is the first stage.
+def photometryStages(size, args, workbookDir = None):
+    events = {k: v for k, v in generators.MEDPC_EVENTS.items() if k not in ["id_recordingStart", "id_recordingStop"]}
+    type = "continuous" if args.continuous else "pulsed"
+    data = PhotometryStruct.PhotometryData(type=type, id_eventsDict=events, useCache=False)
+    stages = []
+    if workbookDir is not None:
+        fpath = os.path.join(workbookDir, "photometry_" + str(size) + ".xlsx")
+        if not os.path.exists(fpath):
+            generators.photometryWorkbook(fpath, size, args.recorder, pulsed=not args.continuous)
+        stages.append(("readData", lambda: data.readData(fpath)))
+    else:
+        if args.recorder == "doric":
+            rate = 1000.0
+            data.pt_raw = generators.doricFrame(size, rate, pulsed=not args.continuous)
+        else:
+            rate = 100.0
+            data.pt_raw = generators.rwdFrame(size, rate=rate, pulsed=not args.continuous)
+        data.timestamp_data = generators.medpcEvents(generators.duration(size, rate, not args.continuous) + 10)
+    stages.append(("clean", data.clean))
+    stages.append(("normalize", lambda: data.normalize(method=args.norm_method)))
+    if not args.continuous:
+        stages.append(("binData", data.binData))
+    stages.append(("alignEvents", data.alignEvents))
+    return stages
+
+
+#Returns the stages of a behavior session of size frames, see photometryStages
+def behaviorStages(size, args, workbookDir = None):
+    fps = 30.0
+    events = {"id_trialStart": 71, "id_cueAversive": 34} if args.control == "medpc" else generators.BRAINMATA_EVENTS
+    data = BehaviorStruct.BehaviorData(type=args.behavior, id_eventsDict=events, useCache=False)
+    stages = []
+
+    #the video is only used for its frame rate and number of frames
+    def setVideo():
+        data.videoPath = "synthetic.avi"
+        data.fps = fps
+        data.trueFrames = size
+
+    if workbookDir is not None and args.files:
+        name = args.behavior + "_" + args.control + "_" + args.dlc_format + "_" + str(size)
+        paths = {"behavior": os.path.join(workbookDir, name + (".h5" if args.behavior == "deeplabcut" and args.dlc_format == "h5" else ".csv")),
+                 "events": os.path.join(workbookDir, name + "_events.csv"), "ttl": os.path.join(workbookDir, name + "_ttl.csv")}
+        if not all(os.path.exists(p) for p in paths.values()):
+            paths = generators.behaviorFiles(workbookDir, name, size, args.behavior, args.control, fps, dlcFormat=args.dlc_format)
+        stages.append(("readFiles", lambda: (data.readFiles(paths["behavior"], paths["events"], paths["ttl"]), setVideo())))
+    elif workbookDir is not None:
+        fpath = os.path.join(workbookDir, args.behavior + "_" + args.control + "_" + str(size) + ".xlsx")
+        if not os.path.exists(fpath):
+            generators.behaviorWorkbook(fpath, size, args.behavior, args.control, fps)
+        stages.append(("readData", lambda: (data.readData(fpath), setVideo())))
+    else:
+        if args.behavior == "deeplabcut":
+            data.beh_data = generators.dlcFrame(size)
+        elif args.behavior == "ezt_freezing":
+            data.beh_data = generators.ezTrackFreezing(size, fps)
+        else:
+            data.beh_data = generators.ezTrackLocation(size, fps)
+        data.timestamp_data = generators.medpcEvents(size / fps)
+        data.beh_TTL = generators.behaviorTTL(generators.trialTimes(size / fps, rng=np.random.default_rng(0)))
+        data.determineControlType()
+        setVideo()
+
+    stages.append(("clean", data.clean))
+    part = ALIGN_PARTS[args.behavior]
+    if args.behavior == "deeplabcut":
+        stages.append(("calcVel", lambda: data.calcVel(data.beh_cleaned[["Nose_x", "Nose_y"]])))
+        stages.append(("booleanEvent", lambda: data.booleanEvent(part="Tongue_x")))
+    stages.append(("alignEvents", lambda: data.alignEvents(part=part, baseline=5, outcome=10)))
+    windows = [([0, 3], True, "trialStart", part + "_predictive"), ([3, 5], True, "trialStart", part + "_outcome")]
+    stages.append(("annotatePerievent", lambda: data.annotatePerievent(windows)))
+    return stages
+
+
+#builds the stages of a session, discarding the output of the pipeline
+def buildStages(pipeline, size, args, workbookDir):
+    makeStages = photometryStages if pipeline == "photometry" else behaviorStages
+    with contextlib.redirect_stdout(io.StringIO()):
+        return makeStages(size, args, workbookDir)
+
+
+#runs every stage, returning {stage: seconds}. Output of the pipeline is discarded
+def timeStages(stages):
+    seconds = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        for name, function in stages:
+            start = time.perf_counter()
+            function()
+            seconds[name] = time.perf_counter() - start
+    return seconds
+
+
+#runs every stage with tracemalloc, returning {stage: peak memory allocated during the stage in bytes}
+def memoryStages(stages):
+    peaks = {}
+    tracemalloc.start()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            for name, function in stages:
+                tracemalloc.reset_peak()
+                before = tracemalloc.get_traced_memory()[0]
+                function()
+                peaks[name] = tracemalloc.get_traced_memory()[1] - before
+    finally:
+        tracemalloc.stop()
+    return peaks
+
+
+#benchmarks one pipeline across sizes, returning a dataframe with one row per size and stage
+def runPipeline(pipeline, args, workbookDir = None):
+    rows = []
+    for size in args.sizes:
+        best = {}
+        for x in range(args.repeats):
+            for name, seconds in timeStages(buildStages(pipeline, size, args, workbookDir)).items():
+                best[name] = min(best.get(name, math.inf), seconds)
+        peaks = memoryStages(buildStages(pipeline, size, args, workbookDir))
+        for name, seconds in best.items():
+            rows.append({"pipeline": pipeline, "size": size, "stage": name, "seconds": seconds,
+                         "us_per_row": seconds / size * 1e6, "peak_mb": peaks[name] / 2 ** 20})
+            print("%-11s %10d %-26s %10.4f %12.3f %10.1f" % (pipeline, size, name, seconds, seconds / size * 1e6, peaks[name] / 2 ** 20))
+    return pd.DataFrame(rows)
+
+
+#slope of log(seconds) against log(size) of every stage, ~1 for linear scaling and ~2 for quadratic scaling
+def scalingExponents(results):
+    rows = []
+    for (pipeline, stage), group in results.groupby(["pipeline", "stage"], sort=False):
+        exponent = np.nan
+        if group["size"].nunique() > 1:
+            exponent = np.polyfit(np.log(group["size"]), np.log(group["seconds"].clip(lower=1e-9)), 1)[0]
+        rows.append({"pipeline": pipeline, "stage": stage, "exponent": exponent})
+    return pd.DataFrame(rows)
+
+
+#rows of results which are slower than the same pipeline, size and stage of baseline by more than tolerance
+def findRegressions(results, baseline, tolerance):
+    merged = results.merge(baseline, on=["pipeline", "size", "stage"], suffixes=("", "_baseline"))
+    slower = (merged["seconds"] > merged["seconds_baseline"] * (1 + tolerance)) & (merged["seconds"] > MIN_SECONDS)
+    return merged[slower]
+
+
+def parseArgs(argv = None):
+    parser = argparse.ArgumentParser(description="Time and measure the peak memory of every pipeline stage across recording sizes.")
+    parser.add_argument("--pipeline", nargs="+", choices=["photometry", "behavior"], default=["photometry", "behavior"])
+    parser.add_argument("--sizes", nargs="+", type=int, default=[50000, 100000, 200000, 400000],
+                        help="number of samples (photometry) or frames (behavior) of each recording")
+    parser.add_argument("--recorder", choices=["doric", "rwd"], default="doric", help="photometry layout (default doric)")
+    parser.add_argument("--continuous", action="store_true", help="continuous instead of pulsed photometry recordings")
+    parser.add_argument("--norm-method", choices=["endpoints", "ols", "irls", "sliding"], default="endpoints")
+    parser.add_argument("--behavior", choices=list(ALIGN_PARTS.keys()), default="deeplabcut", help="behavior layout (default deeplabcut)")
+    parser.add_argument("--control", choices=["medpc", "brainmata"], default="medpc", help="event layout of behavior sessions (default medpc)")
+    parser.add_argument("--workbooks", action="store_true", help="write every recording to a workbook and include readData in the stages")
+    parser.add_argument("--files", action="store_true",
+                        help="write every behavior recording to DeepLabCut/ezTrack and event .csv files and include readFiles in the stages")
+    parser.add_argument("--dlc-format", choices=["csv", "h5"], default="csv", help="format of the DeepLabCut files written with --files (default csv)")
+    parser.add_argument("--workbook-dir", help="directory for the workbooks and files, which are reused between runs (default a temporary directory)")
+    parser.add_argument("--repeats", type=int, default=3, help="number of timed runs of every size, the fastest is kept (default 3)")
+    parser.add_argument("--out", help="save the results to this .csv file")
+    parser.add_argument("--baseline", help=".csv file of a previous run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown compared to the baseline (default 0.25)")
+    args = parser.parse_args(argv)
+    if args.control == "brainmata" and not (args.workbooks or args.files):
+        parser.error("--control brainmata is only read from workbooks or files, pass --workbooks or --files")
+    return args
+
+
+def main(argv = None):
+    args = parseArgs(argv)
+    #only warnings of the pipeline, its progress messages would drown the results
+    Instrumentation.configureLogging("WARNING")
+    print("%-11s %10s %-26s %10s %12s %10s" % ("pipeline", "size", "stage", "seconds", "us per row", "peak MB"))
+    with tempfile.TemporaryDirectory() as tmp:
+        workbookDir = None
+        if args.workbooks or args.files:
+            workbookDir = args.workbook_dir or tmp
+            os.makedirs(workbookDir, exist_ok=True)
+        results = pd.concat([runPipeline(pipeline, args, workbookDir) for pipeline in args.pipeline], ignore_index=True)
+
+    print("\nScaling exponents (1 = linear):")
+    for row in scalingExponents(results).itertuples():
+        print("%-11s %-26s %6.2f%s" % (row.pipeline, row.stage, row.exponent, "  <- superlinear" if row.exponent > 1.2 else ""))
+    if args.out is not None:
+        results.to_csv(args.out, index=False)
+        print("Results written to", args.out)
+
+    if args.baseline is not None:
+        regressions = findRegressions(results, pd.read_csv(args.baseline), args.tolerance)
+        if len(regressions) > 0:
+            print("\nRegressions against", args.baseline + ":")
+            for row in regressions.itertuples():
+                print("%-11s %10d %-26s %10.4f s (baseline %.4f s)" % (row.pipeline, row.size, row.stage, row.seconds, row.seconds_baseline))
+            return 1
+        print("\nNo stage is more than %d%% slower than %s" % (args.tolerance * 100, args.baseline))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
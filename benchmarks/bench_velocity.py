@@ -0,0 +1,77 @@
+#Benchmark for VelocityEngine.calcVelocity
+#Checks that the vectorized engine reproduces the original per-frame BehaviorData.calcVel loop, then times the engine
+#across increasing numbers of frames to show that run time grows linearly with the length of the recording.
+#usage: python benchmarks/bench_velocity.py [numParts]
+import math
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import VelocityEngine
+
+
+#original per-frame implementation of BehaviorData.calcVel, kept here as a reference for the engine's output
+def legacyCalcVel(coords, threshold = 100):
+    vel = np.array([])
+    vel = np.append(vel, 0)
+    locomotion = float(0)
+    for x in range(1, int(coords.shape[0])):
+        dist = math.dist((coords[x-1, 0], coords[x-1, 1]), (coords[x, 0], coords[x, 1]))
+        if dist >= threshold:
+            vel = np.append(vel, np.nan)
+        else:
+            if math.isnan(dist) is False:
+                locomotion = locomotion + dist
+            vel = np.append(vel, dist)
+    return vel, locomotion
+
+
+#random walk of every part with ~5% of frames dropped below the likelihood threshold and occasional tracking jumps
+def makeCoords(numFrames, numParts, seed = 0):
+    rng = np.random.default_rng(seed)
+    coords = np.cumsum(rng.normal(0, 3, size=(numFrames, numParts, 2)), axis=0) + 300
+    coords[rng.random((numFrames, numParts)) < 0.05] = np.nan
+    jumps = rng.random((numFrames, numParts)) < 0.001
+    coords[jumps] += 500
+    return coords
+
+
+def checkEquivalence(numFrames = 5000, numParts = 3):
+    coords = makeCoords(numFrames, numParts)
+    vel, total = VelocityEngine.calcVelocity(coords)
+    for x in range(numParts):
+        refVel, refTotal = legacyCalcVel(coords[:, x, :])
+        np.testing.assert_allclose(vel[:, x], refVel, rtol=1e-12, equal_nan=True)
+        np.testing.assert_allclose(total[x], refTotal, rtol=1e-9)
+    print("Engine output matches per-frame reference for", numParts, "parts x", numFrames, "frames")
+
+
+def timeEngine(numFrames, numParts, repeats = 3):
+    coords = makeCoords(numFrames, numParts)
+    best = math.inf
+    for x in range(repeats):
+        start = time.perf_counter()
+        VelocityEngine.calcVelocity(coords)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(numParts = 12):
+    checkEquivalence()
+    #time the reference loop on a small input for comparison
+    coords = makeCoords(5000, 1)
+    start = time.perf_counter()
+    legacyCalcVel(coords[:, 0, :])
+    legacy = (time.perf_counter() - start) * numParts
+    print("Per-frame reference: %.3f s for 5000 frames x %d parts" % (legacy, numParts))
+
+    print("%10s %10s %12s %14s" % ("frames", "parts", "seconds", "us per frame"))
+    for numFrames in [10000, 100000, 1000000]:
+        seconds = timeEngine(numFrames, numParts)
+        print("%10d %10d %12.4f %14.4f" % (numFrames, numParts, seconds, seconds / numFrames * 1e6))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 12)
@@ -0,0 +1,250 @@
+#Synthetic recordings in every layout the pipeline reads, for benchmarks and for trying out changes without real data.
+#Every generator takes a size (samples or frames) and a seed, and returns dataframes laid out exactly as the corresponding
+#sheet is read by PhotometryData.readData / BehaviorData.readData. The workbook functions write complete .xlsx files.
+#
+#usage: python benchmarks/generators.py <output directory> [size]
+#   writes a pulsed Doric, a continuous RWD, a DeepLabCut/Med-Pc, a DeepLabCut/BrainMata and both ezTrack workbooks
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+#Med-Pc ids of the events written by medpcEvents, matching the event dictionaries of main.py
+MEDPC_EVENTS = {"id_sessionStart": 1, "id_sessionEnd": 2, "id_recordingStart": 5, "id_recordingStop": 6,
+                "id_trialStart": 71, "id_cueAversive": 34}
+#BrainMata event columns, as renamed by BehaviorData.readData
+BRAINMATA_EVENTS = {"id_trialStart": "TONE_timestamp", "id_cueReward": "Reward Cue_timestamp", "id_cueNeutral": "Neutral Cue_timestamp"}
+
+
+#Sample times of a recording of numSamples samples at rate Hz. Pulsed recordings are only sampled while the laser is on,
+#for onTime seconds every period seconds, so the time jumps between recording windows.
+def sampleTimes(numSamples, rate = 1000.0, pulsed = True, period = 10.0, onTime = 1.0):
+    if not pulsed:
+        return np.arange(numSamples) / rate
+    perWindow = int(onTime * rate)
+    sample = np.arange(numSamples)
+    return (sample // perWindow) * period + (sample % perWindow) / rate
+
+
+#isosbestic and signal traces of one fiber: exponential bleaching, noise and transients in the signal channel after every event
+def fiberTraces(time, eventTimes, rng, scale = 1.0):
+    bleach = np.exp(-time / max(time[-1] * 2, 1))
+    isosbestic = scale * (0.8 * bleach + 0.2) + rng.normal(0, 0.005 * scale, len(time))
+    signal = 1.3 * isosbestic + 0.1 * scale + rng.normal(0, 0.005 * scale, len(time))
+    #a transient of 2 seconds after every event
+    start = np.searchsorted(time, eventTimes)
+    end = np.searchsorted(time, np.asarray(eventTimes) + 2)
+    for s, e in zip(start, end):
+        signal[s:e] += 0.05 * scale * np.exp(-(time[s:e] - time[s]))
+    return isosbestic, signal
+
+
+#laser ramp at the edges of every recording window: the first sample is below the cutoff and the second one is dim
+def laserRamp(time, gap = 1.0):
+    starts = np.concatenate([[0], np.flatnonzero(np.diff(time) > gap) + 1])
+    ramp = np.ones(len(time))
+    ramp[starts] = 0.001
+    ramp[np.minimum(starts + 1, len(time) - 1)] = 0.5
+    return ramp
+
+
+#Trial start times of a session of the given duration, one trial every interval seconds after a 30 second habituation
+def trialTimes(duration, interval = 30.0, rng = None):
+    times = np.arange(30.0, duration - 20, interval)
+    if rng is not None:
+        times = times + rng.uniform(0, 5, len(times))
+    return times
+
+
+#Doric export of a single fiber (first sheet of a photometry workbook, read with header=1)
+#columns: Time(s), AIn-1 - Dem (AOut-1) (405 nm), AIn-1 - Dem (AOut-2) (465 nm), DI/O-3 (recording window TTL), DI/O-4
+def doricFrame(numSamples, rate = 1000.0, pulsed = True, seed = 0):
+    rng = np.random.default_rng(seed)
+    time = sampleTimes(numSamples, rate, pulsed)
+    isosbestic, signal = fiberTraces(time, trialTimes(time[-1], rng=rng), rng)
+    ramp = laserRamp(time) if pulsed else 1
+    return pd.DataFrame({"Time(s)": time, "AIn-1 - Dem (AOut-1)": isosbestic * ramp, "AIn-1 - Dem (AOut-2)": signal * ramp,
+                         "DI/O-3": np.ones(numSamples), "DI/O-4": np.zeros(numSamples)})
+
+
+#RWD export of numFibers fibers (first sheet of a photometry workbook, read with header=1)
+#columns: Timestamp, CH1-410, CH1-470, CH2-410, CH2-470...
+def rwdFrame(numSamples, numFibers = 2, rate = 100.0, pulsed = False, seed = 0):
+    rng = np.random.default_rng(seed)
+    time = sampleTimes(numSamples, rate, pulsed)
+    ramp = laserRamp(time) if pulsed else 1
+    events = trialTimes(time[-1], rng=rng)
+    frame = {"Timestamp": time}
+    for x in range(1, numFibers + 1):
+        isosbestic, signal = fiberTraces(time, events, rng, scale=1 + 0.2 * x)
+        frame["CH" + str(x) + "-410"] = isosbestic * ramp
+        frame["CH" + str(x) + "-470"] = signal * ramp
+    return pd.DataFrame(frame)
+
+
+#Med-Pc events (Events sheet): Index, ID and secs of every event, with session start/end, recording window start/stop
+#(every period seconds) and trial start/aversive cue events. duration is the length of the session in seconds
+def medpcEvents(duration, period = 10.0, onTime = 1.0, seed = 0):
+    rng = np.random.default_rng(seed)
+    trials = trialTimes(duration, rng=rng)
+    windows = np.arange(0, duration, period)
+    events = [(MEDPC_EVENTS["id_sessionStart"], 0.5 * period), (MEDPC_EVENTS["id_sessionEnd"], duration - 0.5 * period)]
+    events += [(MEDPC_EVENTS["id_recordingStart"], t) for t in windows]
+    events += [(MEDPC_EVENTS["id_recordingStop"], t + onTime) for t in windows]
+    events += [(MEDPC_EVENTS["id_trialStart"], t) for t in trials]
+    events += [(MEDPC_EVENTS["id_cueAversive"], t + 10) for t in trials]
+    events = sorted(events, key=lambda e: e[1])
+    return pd.DataFrame({"Index": np.arange(len(events)), "ID": [e[0] for e in events], "secs": [e[1] for e in events]})
+
+
+#BrainMata events (Events sheet): one column per event type starting with SOLENOID_WATER, a "timestamp" row under the
+#header, then the times of every event of that type
+def brainmataEvents(duration, seed = 0):
+    rng = np.random.default_rng(seed)
+    trials = trialTimes(duration, rng=rng)
+    reward = rng.random(len(trials)) < 0.5
+    columns = {"SOLENOID_WATER": trials[reward] + 3, "TONE": trials, "Reward Cue": trials[reward], "Neutral Cue": trials[~reward]}
+    length = max([len(v) for v in columns.values()])
+    frame = {}
+    for key, value in columns.items():
+        frame[key] = ["timestamp"] + list(value) + [np.nan] * (length - len(value))
+    return pd.DataFrame(frame)
+
+
+#camera TTL pulses (Behavior-TTL sheet, read with index_col=0): onset and offset of a pulse at every trial start,
+#on the camera clock, which lags the control software by lag seconds and drifts by drift parts per million
+def behaviorTTL(trialStarts, lag = 0.2, drift = 50, seed = 0):
+    rng = np.random.default_rng(seed)
+    onsets = np.asarray(trialStarts, dtype=float) * (1 + drift * 1e-6) + lag + rng.normal(0, 0.01, len(trialStarts))
+    return pd.DataFrame({"Onset": onsets, "Offset": onsets + 1})
+
+
+#DeepLabCut output as written by DeepLabCut to .h5/.csv: (scorer, bodyparts, coords) MultiIndex columns holding x, y and
+#likelihood of every part, indexed by frame number. Parts follow a random walk, with ~5% of frames labeled below the
+#likelihood threshold and occasional tracking jumps.
+def dlcOutput(numFrames, parts = ("Nose", "Back1", "Tail", "Tongue"), seed = 0):
+    rng = np.random.default_rng(seed)
+    coords = np.cumsum(rng.normal(0, 2, size=(numFrames, len(parts), 2)), axis=0) + 300
+    coords[rng.random((numFrames, len(parts))) < 0.001] += 400
+    likelihood = np.where(rng.random((numFrames, len(parts))) < 0.05, rng.uniform(0, 0.5, (numFrames, len(parts))),
+                          rng.uniform(0.9, 1, (numFrames, len(parts))))
+    values = np.concatenate([coords, likelihood[:, :, np.newaxis]], axis=2).reshape(numFrames, -1)
+    columns = pd.MultiIndex.from_product([["DLC_resnet50_syntheticShuffle1_100000"], list(parts), ["x", "y", "likelihood"]],
+                                         names=["scorer", "bodyparts", "coords"])
+    return pd.DataFrame(values, columns=columns)
+
+
+#DeepLabCut export (first sheet of a behavior workbook, read with header=0): a scorer header, bodyparts and coords rows,
+#then the frame number and x, y, likelihood of every part for every frame, see dlcOutput
+def dlcFrame(numFrames, parts = ("Nose", "Back1", "Tail", "Tongue"), seed = 0):
+    output = dlcOutput(numFrames, parts, seed)
+    header = [["bodyparts"] + list(output.columns.get_level_values("bodyparts")), ["coords"] + list(output.columns.get_level_values("coords"))]
+    body = pd.DataFrame(output.to_numpy())
+    body.insert(0, "frame", np.arange(numFrames))
+    rows = pd.concat([pd.DataFrame(header), pd.DataFrame(body.to_numpy(dtype=object))], ignore_index=True)
+    rows.columns = ["scorer"] + list(output.columns.get_level_values("scorer"))
+    return rows
+
+
+#ezTrack FreezeAnalysis export (first sheet, read with header=0): settings columns, then Frame, Motion and Freezing (0 or 100)
+def ezTrackFreezing(numFrames, fps = 30.0, seed = 0):
+    rng = np.random.default_rng(seed)
+    motion = rng.gamma(2, 200, numFrames)
+    #freezing bouts of a few seconds
+    freezing = (np.convolve(rng.random(numFrames) < 0.002, np.ones(int(fps * 3)), mode="same") > 0) * 100
+    motion[freezing > 0] = rng.uniform(0, 20, int((freezing > 0).sum()))
+    return pd.DataFrame({"File": "synthetic.avi", "FPS": fps, "MotionCutoff": 10.0, "FreezeThresh": 180, "MinFreezeDuration": 15,
+                         "Frame": np.arange(numFrames), "Motion": motion, "Freezing": freezing})
+
+
+#ezTrack LocationTracking export (first sheet, read with header=0): settings columns, then Frame, X, Y and Distance_px
+def ezTrackLocation(numFrames, fps = 30.0, seed = 0):
+    rng = np.random.default_rng(seed)
+    xy = np.clip(np.cumsum(rng.normal(0, 2, (numFrames, 2)), axis=0) + 200, 0, 400)
+    distance = np.concatenate([[0], np.sqrt((np.diff(xy, axis=0) ** 2).sum(axis=1))])
+    return pd.DataFrame({"File": "synthetic.avi", "FPS": fps, "Location_Thresh": 99.5, "Use_Window": True, "Window_Weight": 0.9,
+                         "Window_Size": 100, "Start_Frame": 0, "Frame": np.arange(numFrames), "X": xy[:, 0], "Y": xy[:, 1],
+                         "Distance_px": distance})
+
+
+#duration in seconds of a recording generated with the given number of samples (see sampleTimes)
+def duration(numSamples, rate = 1000.0, pulsed = True, period = 10.0, onTime = 1.0):
+    return sampleTimes(numSamples, rate, pulsed, period, onTime)[-1] if numSamples > 0 else 0.0
+
+
+#writes a photometry workbook: recording on the first sheet (under one line of metadata) and Med-Pc events
+#recorder: "doric" or "rwd"
+def photometryWorkbook(fpath, numSamples, recorder = "doric", pulsed = True, seed = 0):
+    if recorder == "doric":
+        rate = 1000.0
+        data = doricFrame(numSamples, rate, pulsed, seed)
+    else:
+        rate = 100.0
+        data = rwdFrame(numSamples, rate=rate, pulsed=pulsed, seed=seed)
+    events = medpcEvents(duration(numSamples, rate, pulsed) + 10, seed=seed)
+    with pd.ExcelWriter(fpath, engine="xlsxwriter") as writer:
+        pd.DataFrame([["Synthetic " + recorder + " recording"]]).to_excel(writer, sheet_name="Photometry", index=False, header=False)
+        data.to_excel(writer, sheet_name="Photometry", index=False, startrow=1)
+        events.to_excel(writer, sheet_name="Events", index=False)
+    return fpath
+
+
+#returns (behavioral data, events, camera TTLs) of a behavior session, see behaviorWorkbook
+#dlcLayout: "sheet" for DeepLabCut data as pasted into a workbook, "output" for DeepLabCut's own MultiIndex layout
+def behaviorTables(numFrames, behavior = "deeplabcut", control = "medpc", fps = 30.0, seed = 0, dlcLayout = "sheet"):
+    if behavior == "deeplabcut":
+        data = dlcFrame(numFrames, seed=seed) if dlcLayout == "sheet" else dlcOutput(numFrames, seed=seed)
+    elif behavior == "ezt_freezing":
+        data = ezTrackFreezing(numFrames, fps, seed)
+    else:
+        data = ezTrackLocation(numFrames, fps, seed)
+    length = numFrames / fps
+    rng = np.random.default_rng(seed)
+    trials = trialTimes(length, rng=rng)
+    events = medpcEvents(length, seed=seed) if control == "medpc" else brainmataEvents(length, seed)
+    if control == "brainmata":
+        trials = events["TONE"].iloc[1:].dropna().to_numpy(dtype=float)
+    return data, events, behaviorTTL(trials, seed=seed)
+
+
+#writes a behavior workbook: behavioral data on the first sheet, events and camera TTLs
+#behavior: "deeplabcut", "ezt_freezing" or "ezt_location", control: "medpc" or "brainmata"
+def behaviorWorkbook(fpath, numFrames, behavior = "deeplabcut", control = "medpc", fps = 30.0, seed = 0):
+    data, events, ttl = behaviorTables(numFrames, behavior, control, fps, seed)
+    with pd.ExcelWriter(fpath, engine="xlsxwriter") as writer:
+        data.to_excel(writer, sheet_name="Behavior", index=False)
+        events.to_excel(writer, sheet_name="Events", index=False)
+        ttl.to_excel(writer, sheet_name="Behavior-TTL")
+    return fpath
+
+
+#Writes a behavior session as the files of the tracking and control software, for BehaviorData.readFiles:
+#<name>.csv or <name>.h5 (DeepLabCut, dlcFormat) or <name>.csv (ezTrack), <name>_events.csv and <name>_ttl.csv.
+#returns {"behavior": path, "events": path, "ttl": path}
+def behaviorFiles(outDir, name, numFrames, behavior = "deeplabcut", control = "medpc", fps = 30.0, seed = 0, dlcFormat = "csv"):
+    data, events, ttl = behaviorTables(numFrames, behavior, control, fps, seed, dlcLayout="output")
+    paths = {"behavior": os.path.join(outDir, name + ".csv"), "events": os.path.join(outDir, name + "_events.csv"),
+             "ttl": os.path.join(outDir, name + "_ttl.csv")}
+    if behavior == "deeplabcut" and dlcFormat == "h5":
+        paths["behavior"] = os.path.join(outDir, name + ".h5")
+        data.to_hdf(paths["behavior"], key="df_with_missing", format="table", mode="w")
+    else:
+        data.to_csv(paths["behavior"], index=behavior == "deeplabcut")
+    events.to_csv(paths["events"], index=False)
+    ttl.to_csv(paths["ttl"])
+    return paths
+
+
+def main(outDir, size = 100000):
+    os.makedirs(outDir, exist_ok=True)
+    print(photometryWorkbook(os.path.join(outDir, "doric_pulsed.xlsx"), size, "doric", pulsed=True))
+    print(photometryWorkbook(os.path.join(outDir, "rwd_continuous.xlsx"), size, "rwd", pulsed=False))
+    frames = max(size // 10, 1000)
+    print(behaviorWorkbook(os.path.join(outDir, "dlc_medpc.xlsx"), frames, "deeplabcut", "medpc"))
+    print(behaviorWorkbook(os.path.join(outDir, "dlc_brainmata.xlsx"), frames, "deeplabcut", "brainmata"))
+    print(behaviorWorkbook(os.path.join(outDir, "ezt_freezing.xlsx"), frames, "ezt_freezing", "medpc"))
+    print(behaviorWorkbook(os.path.join(outDir, "ezt_location.xlsx"), frames, "ezt_location", "medpc"))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 100000)
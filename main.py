@@ -1,10 +1,11 @@
 import os
-import tkinter
-from tkinter import filedialog
 import matplotlib.pyplot as plt
 import pandas as pd
 import BehaviorStruct
-import PhotometryStruct
+import Instrumentation
+import Plotting
+import PipelineDAG
+import ResultWriter
 
 #dictionary of events in Med-Pc timestamp data
 events = {}
@@ -14,9 +15,20 @@ pulsed_events = {"id_recordingStart": 5, "id_recordingStop": 6}
 openField_events = {"id_sessionStart": 1, "id_sessionEnd": 2}
 fearConditioning_events = {"id_trialStart": 71, "id_cueAversive": 34}
 pavlov_events = {}
+#licking windows scored on pavlovian BrainMata sessions: (window in seconds, whether licking is correct, event, label)
+LICK_WINDOWS = [([0, 3], True, "cueReward", "Tongue_predictive"),
+                ([3, 10], True, "cueReward", "Tongue_outcome"),
+                ([3, 10], False, "cueNeutral", "Tongue_outcome"),
+                ([0, 3], False, "cueNeutral", "Tongue_predictive")]
+#format of the result store ("parquet" or "hdf5"), and whether an excel summary is written next to it
+resultBackend = "parquet"
+excelSummary = True
 
 
 def main(events= events):
+    #tkinter is only needed for the interactive file dialogs, so headless runs (see BatchRunner.py) can import this module without it
+    import tkinter
+    from tkinter import filedialog
     root = tkinter.Tk()
     root.withdraw()
     print("\n== Fiber Photometry Analysis ==")
@@ -106,7 +118,9 @@ def main(events= events):
         else:
             print("Incorrect input")
 
-
+    #time every stage of the analysis, the report is saved next to the data file
+    report = Instrumentation.RunReport(os.path.splitext(os.path.basename(fpath))[0], metadata={"type": type, "paradigm": paradigm, "behavior": behavior})
+    report.start()
 
     ##########################################################
     #### BRAINMATA BEHAVIORAL ANALYSIS  WITHOUT MINISCOPE ####
@@ -122,50 +136,26 @@ def main(events= events):
                                            filetypes=[("Video File", "*.avi")])
 
         print("Analyzing Brainmata recording against Deeplabcut behavior...")
-        beh_struct = BehaviorStruct.BehaviorData(type= behavior, id_eventsDict= events, videoPath= vpath)
-        beh_struct.readData(fpath)
-        beh_struct.clean()
-        beh_struct.booleanEvent(part="Tongue_x")
-        beh_struct.alignEvents(part="Tongue_x_bool", baseline=5, outcome=10)
-        beh_struct.annotatePerieventBehavior(window = [0, 3], isCorrect = True, eventName = "cueReward", part = "Tongue_predictive")
-        beh_struct.annotatePerieventBehavior(window=[3, 10], isCorrect=True, eventName="cueReward", part="Tongue_outcome")
-        beh_struct.annotatePerieventBehavior(window = [3, 10], isCorrect = False, eventName = "cueNeutral", part = "Tongue_outcome")
-        beh_struct.annotatePerieventBehavior(window=[0, 3], isCorrect=False, eventName="cueNeutral", part="Tongue_predictive")
+        #stage outputs are cached in memory (see PipelineDAG), so re-running with other windows does not re-read or re-clean the session
+        pipeline = PipelineDAG.behaviorPipeline(fpath, videoPath=vpath, type=behavior, events=events, cache=PipelineDAG.getDefaultCache(useDisk=False))
+        pipeline.set("boolean", parts=["Tongue_x"])
+        pipeline.set("align", part="Tongue_x_bool", baseline=5, outcome=10)
+        pipeline.set("annotate", specs=LICK_WINDOWS)
+        beh_struct = pipeline.run("annotate")
 
         name = fpath.split("/")
         saveDir = ""
         saveDir = "/".join(name[0:len(name) - 1])
 
         for key, value in beh_struct.beh_alignedEvents.items():
-            plot = beh_struct.beh_alignedEvents[key].plot(x="Time", y="Average", kind="line", figsize=(10, 5))
-            plot.set_title(key)
-            figPath = saveDir + "/" + key + "_DLC.png"
-            plt.savefig(figPath)
+            Plotting.eventsFigure({key: value}, dest=saveDir + "/" + key + "_DLC.png")
 
         plt.show()
 
-        # save data
-        print("Saving processed and aligned data in .xlsx format...")
-        # save all behavior data
-        dest = saveDir + "/" + "Behavior_All.xlsx"
-        writer = pd.ExcelWriter(dest, engine="xlsxwriter")
-        beh_struct.beh_data.to_excel(writer, sheet_name="Behavior_Data_Raw", index=True)
-        beh_struct.beh_cleaned.to_excel(writer, sheet_name="Behavior_Data_Processed", index=True)
-        beh_struct.beh_TTL.to_excel(writer, sheet_name="Behavior_TTl", index=False)
-
-        #process statistics dictionary
-        #separate out dataframes to be saved as separate excel tabs
-        stats = {}
-        for key, value in beh_struct.beh_stats.items():
-            if isinstance(value, pd.DataFrame):
-                value.to_excel(writer, sheet_name= key[0:31], index= False)
-            else:
-                stats.update({key: value})
-
-        stats = pd.Series(stats, name="statistics")
-        stats.to_excel(writer, sheet_name="Statistics", index=True)
-
-        writer.close()
+        # save all behavior data, statistics and per-trial annotations
+        print("Saving processed and aligned data...")
+        with ResultWriter.ResultWriter(saveDir, "Behavior_All", backend=resultBackend, excelSummary=excelSummary) as results:
+            results.writeBehavior(beh_struct)
         print("Finished")
 
 
@@ -173,12 +163,9 @@ def main(events= events):
     #### PULSED RECORDING PROCESSING ####
     #####################################
     if type == "pulsed":
-        channel1 = PhotometryStruct.PhotometryData(type= type, id_eventsDict= events)
-        channel1.readData(fpath)
-        channel1.clean()
-        #normalize and bin data
-        channel1.normalize()
-        channel1.binData()
+        #read, clean, normalize and bin data, reusing the outputs of stages whose parameters have not changed since the last run
+        pipeline = PipelineDAG.photometryPipeline(fpath, type=type, events=events, cache=PipelineDAG.getDefaultCache(useDisk=False))
+        channel1 = pipeline.run("bin")
 
 
     ##################################
@@ -204,36 +191,15 @@ def main(events= events):
 
         #plot results
         print("Plotting total locomotion...")
-        plot = channel1.beh_cleaned.plot(x="Time", y="Back1_Vel", kind="line", figsize=(10,5))
-        plot.set_title("Back1")
-        plt.savefig(saveDir + "/" + "Back1_DLC.png")
-        plt.savefig(saveDir + "/" + "Back1_DLC.png")
+        Plotting.traceFigure(channel1.beh_cleaned, "Back1_Vel", dest=saveDir + "/" + "Back1_DLC.png", title="Back1")
         print("Plotting aligned events...")
         for key, value in channel1.beh_alignedEvents.items():
-            plot = channel1.beh_alignedEvents[key].plot(x="Time", y="Average", kind="line", figsize=(10, 5))
-            plot.set_title(key)
-            figPath = saveDir + "/" + key + "_DLC.png"
-            plt.savefig(figPath)
-
-        #save data
-        print("Saving processed and aligned data in .xlsx format...")
-        stats = pd.Series(channel1.beh_stats, name="Statistics")
-        #save all DLC data
-        dest = saveDir + "/" + "DLC_All.xlsx"
-        writer = pd.ExcelWriter(dest, engine="xlsxwriter")
-        stats.to_excel(writer, sheet_name="Statistics", index=True)
-        channel1.beh_data.to_excel(writer, sheet_name="DLC_Data", index=True)
-        channel1.beh_cleaned.to_excel(writer, sheet_name="DLC_Cleaned", index=True)
-        channel1.beh_TTL.to_excel(writer, sheet_name="DLC-TTL", index=False)
-        writer.close()
-
-        #save aligned events as a separate spreadsheet
-        dest = saveDir + "/" + "DLC_Aligned.xlsx"
-        writer = pd.ExcelWriter(dest, engine= 'xlsxwriter')
-        for key, value in channel1.dlc_alignedEvents.items():
-            sheetName = key + "_velocity"
-            value.to_excel(writer, sheet_name= sheetName, index= True)
-        writer.close()
+            Plotting.eventsFigure({key: value}, dest=saveDir + "/" + key + "_DLC.png")
+
+        #save all DLC data and aligned events
+        print("Saving processed and aligned data...")
+        with ResultWriter.ResultWriter(saveDir, "DLC_All", backend=resultBackend, excelSummary=excelSummary) as results:
+            results.writeBehavior(channel1)
 
         #show plots
         plt.show()
@@ -276,32 +242,12 @@ def main(events= events):
 
         #plot trials
         print("Plotting aligned events...")
-        x = 1
-        numPlots = len(channel1.beh_alignedEvents)
-        for key, value in channel1.beh_alignedEvents.items():
-            event = channel1.beh_alignedEvents[key]
-            plt.subplot(numPlots, 1, x)
-            plt.plot(event["Time"], event["Average"])
-            #plt.fill_between(event["Time"], event["Average"] - event["SD"], event["Average"] + event["SD"], alpha=0.2)
-            title = pTitle + ": " + key
-            plt.title(title)
-            plt.xlabel("Time(s)")
-            plt.ylabel(pylab)
-            plt.grid()
-            x += 1
-
-        # save and show plots
-        plt.tight_layout(pad=0.4)
         figPath = saveDir + "/" + "_" + pTitle + ".png"
-        plt.savefig(figPath)
+        Plotting.eventsFigure(channel1.beh_alignedEvents, dest=figPath, title=pTitle, ylabel=pylab)
 
-        #save aligned events as a separate spreadsheet
-        dest = saveDir + "/" + pTitle + "_Aligned.xlsx"
-        writer = pd.ExcelWriter(dest, engine= 'xlsxwriter')
-        for key, value in channel1.beh_alignedEvents.items():
-            sheetName = key + "_" + pTitle
-            value.to_excel(writer, sheet_name= sheetName, index= True)
-        writer.close()
+        #save data and aligned events
+        with ResultWriter.ResultWriter(saveDir, pTitle, backend=resultBackend, excelSummary=excelSummary) as results:
+            results.writeBehavior(channel1)
 
         plt.show()
 
@@ -311,42 +257,36 @@ def main(events= events):
     #############################################
     if type != "behavior-only" and type != "eztrack":
         #plot results
-        fig, axes = plt.subplots(2,2)
-        channel1.pt_cleaned.plot(ax= axes[0,0], x="Time", y=["_465", "_405"], kind="line", figsize=(10, 5))
-        axes[0,0].set_title("Raw Data")
-        axes[0,0].set_ylabel("Current")
-        channel1.pt_cleaned.plot(ax = axes[0,1], x="Time", y=["norm"], kind="line", figsize=(10, 5))
-        axes[0,1].set_title("Normalized")
-        axes[0,1].set_ylabel("f/f")
-        if type == "pulsed":
-            channel1.pt_cleaned.plot(ax = axes[1,0], x="Time", y=["norm"], kind="line", figsize=(10, 5))
-            axes[1,0].set_title("Binned and Normalized")
-            axes[1,0].set_ylabel("f/f")
-        fig.tight_layout()
+        #every isosbestic/signal channel pair of every animal is drawn on the same axes
+        #traces are decimated to the width of the figure, so long recordings draw quickly
+        pairs = channel1.channelPairs
 
         #get name of original xlsx file for plot names
         name = fpath.split("/")
         name = name[len(name) - 1].split(".")
         name = name[0]
         figName = name + "_Signal.png"
-        excelName = name + "_Processed.xlsx"
         #save plots and data
-        plt.savefig(figName)
-        writer = pd.ExcelWriter(excelName, engine="xlsxwriter")
-        channel1.pt_cleaned.to_excel(writer, sheet_name="Data", index=False)
-        if type == "pulsed":
-            channel1.pt_cleaned.to_excel(writer, sheet_name="Binned Data", index=False)
-        if channel1.mpc_data is not None:
-            channel1.mpc_data.to_excel(writer, sheet_name="Med-Pc", index=False)
-        writer.close()
-
-        #scatter plot of 465 vs 405 data
-        channel1.pt_raw.plot(x="_405", y="_465", c="Time", kind="scatter", colormap="viridis")
-        #save graph
+        Plotting.photometryFigure(channel1.pt_cleaned, pairs, binned=channel1.pt_binned, dest=figName)
+        with ResultWriter.ResultWriter(os.getcwd(), name, backend=resultBackend, excelSummary=excelSummary) as results:
+            results.writePhotometry(channel1)
+            #save each animal of multi-animal recordings separately
+            if channel1.numAnimals > 1:
+                binned = channel1.splitByAnimal(binned=True) if channel1.pt_binned is not None else {}
+                for animal, data in channel1.splitByAnimal().items():
+                    results.writeFrame(str(animal) + "_cleaned", data)
+                    results.writeFrame(str(animal) + "_binned", binned.get(animal), summary=True)
+
+        #scatter plot of 465 vs 405 data (first channel pair)
         figName = name + "_Scatter.png"
-        plt.savefig(figName)
+        Plotting.scatterFigure(channel1.pt_cleaned, pairs.isosbestic.iloc[0], pairs.signal.iloc[0], dest=figName)
 
         #display graphs
         plt.show()
 
-main()
\ No newline at end of file
+    report.stop()
+    report.log()
+    report.write(os.path.join(os.path.dirname(fpath), report.session + "_report.json"))
+
+if __name__ == "__main__":
+    main()
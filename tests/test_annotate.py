@@ -0,0 +1,114 @@
+import numpy as np
+import pandas as pd
+import pytest
+import BehaviorStruct
+import EventAlignment
+from benchmarks import generators
+
+EVENTS = {"id_trialStart": 71, "id_cueAversive": 34}
+WINDOWS = [[0, 3], [3, 10], [-2, 0.5], [1.25, 1.25], [8, 20]]
+
+
+#the per-window annotatePerieventBehavior which annotatePerievent replaced: counts the samples at or above 1 of every trial
+#column of the aligned event data from the sample closest to tmin up to (not including) the sample closest to tmax
+def legacyAnnotate(eventData, window, isCorrect):
+    wMin = eventData['Time'].sub(window[0]).abs().idxmin()
+    wMax = eventData['Time'].sub(window[1]).abs().idxmin()
+    counts = []
+    annotations = []
+    for x in range(eventData.shape[1] - 3):
+        trial = eventData.iloc[wMin:wMax][x]
+        count = trial[trial >= 1].shape[0]
+        counts.append(count)
+        annotations.append("Correct" if (count > 0) == isCorrect else "Incorrect")
+    numCorrect = annotations.count("Correct")
+    return counts, annotations, numCorrect / len(counts)
+
+
+#generated DeepLabCut session with a boolean column of every part, with the video's frame count and fps set instead of read
+@pytest.fixture(scope="module")
+def session(tmp_path_factory):
+    paths = generators.behaviorFiles(str(tmp_path_factory.mktemp("annotate")), "session", 9000)
+    data = BehaviorStruct.BehaviorData(id_eventsDict=dict(EVENTS))
+    data.readFiles(paths["behavior"], paths["events"], paths["ttl"])
+    data.videoPath = "session.avi"
+    data.fps = 30.0
+    data.trueFrames = 9000
+    data.clean()
+    for part in ["Tongue_x", "Nose_x"]:
+        data.booleanEvent(part)
+    return data
+
+
+@pytest.mark.parametrize("part", ["Tongue_x_bool", "Nose_x_bool"])
+def test_annotate_perievent_matches_per_window_loop(session, part):
+    session.beh_annotations = None
+    session.alignEvents(part=part, baseline=5, outcome=15)
+    specs = [(window, isCorrect, eventName, part) for window in WINDOWS for isCorrect in [True, False] for eventName in ["trialStart", "cueAversive"]]
+    table = session.annotatePerievent(specs)
+    assert len(table) == sum(session.beh_alignedTrials[spec[2]].trials.shape[0] for spec in specs)
+    for window, isCorrect, eventName, _ in specs:
+        counts, annotations, fraction = legacyAnnotate(session.beh_alignedEvents[eventName], window, isCorrect)
+        assert len(counts) > 1
+        label = part + "_" + eventName
+        rows = table[(table["event"] == eventName) & (table["window_start"] == window[0]) & (table["window_end"] == window[1])
+                     & (table["isCorrect"] == isCorrect)]
+        np.testing.assert_array_equal(rows["count"].to_numpy(), counts)
+        np.testing.assert_array_equal(rows["annotation"].to_numpy(), annotations)
+        #the beh_stats entries are those of the last spec of every label, as the per-window loop overwrote them too
+        if (window, isCorrect) == (WINDOWS[-1], False):
+            np.testing.assert_array_equal(session.beh_stats[label + "_annotations"]["num_" + label].to_numpy(), counts)
+            assert session.beh_stats[label + "_correct"] == fraction
+
+
+#aligned trials of two events and two parts with sparse responses, so that windows have trials with and without them
+def test_annotate_perievent_sparse_responses_match_per_window_loop():
+    rng = np.random.default_rng(1)
+    time = np.arange(300) / 20 - 5
+    data = BehaviorStruct.BehaviorData()
+    for eventName, numTrials in [("trialStart", 15), ("cueAversive", 8)]:
+        for part in ["Tongue_x_bool", "Nose_x_bool"]:
+            trials = (rng.random((numTrials, len(time), 1)) < 0.02).astype(float)
+            trials[rng.random(trials.shape) < 0.1] = np.nan
+            aligned = EventAlignment.AlignedTrials(time, trials, [part])
+            data.beh_alignedTrials[eventName] = aligned
+            data.beh_alignedEvents[eventName] = EventAlignment.trialsFrame(aligned)
+            eventSpecs = [(window, isCorrect, eventName, part) for window in WINDOWS for isCorrect in [True, False]]
+            table = data.annotatePerievent(eventSpecs)
+            for window, isCorrect, _, _ in eventSpecs:
+                counts, annotations, fraction = legacyAnnotate(data.beh_alignedEvents[eventName], window, isCorrect)
+                rows = table[(table["window_start"] == window[0]) & (table["window_end"] == window[1]) & (table["isCorrect"] == isCorrect)]
+                np.testing.assert_array_equal(rows["count"].to_numpy(), counts)
+                np.testing.assert_array_equal(rows["annotation"].to_numpy(), annotations)
+    assert set(data.beh_annotations["annotation"]) == {"Correct", "Incorrect"}
+    assert (data.beh_annotations["count"] == 0).any() and (data.beh_annotations["count"] > 0).any()
+    #parts x windows x isCorrect rows for every trial
+    assert len(data.beh_annotations) == 2 * len(WINDOWS) * 2 * (15 + 8)
+
+
+def test_annotate_perievent_behavior_is_one_spec(session):
+    session.alignEvents(part="Tongue_x_bool", baseline=5, outcome=15)
+    table = session.annotatePerieventBehavior([0, 3], True, "trialStart", "Tongue_x_bool")
+    counts, annotations, fraction = legacyAnnotate(session.beh_alignedEvents["trialStart"], [0, 3], True)
+    np.testing.assert_array_equal(table["count"].to_numpy(), counts)
+    assert session.beh_stats["Tongue_x_bool_trialStart_correct"] == fraction
+
+
+#latencies are the seconds from the window's first sample to its first sample at or above threshold
+def test_score_windows_latencies_match_per_window_search():
+    rng = np.random.default_rng(0)
+    time = np.arange(200) / 10 - 5
+    trials = (rng.random((12, 200)) < 0.05).astype(float)
+    trials[3] = np.nan
+    trials[4, 100:150] = np.nan
+    counts, latencies = EventAlignment.scoreWindows(time, trials, WINDOWS)
+    for x, window in enumerate(WINDOWS):
+        start = EventAlignment.nearestIndex(time, window[0])
+        stop = max(EventAlignment.nearestIndex(time, window[1]), start)
+        for y in range(trials.shape[0]):
+            hits = np.flatnonzero(trials[y, start:stop] >= 1)
+            assert counts[y, x] == len(hits)
+            if len(hits) > 0:
+                assert latencies[y, x] == pytest.approx(time[start + hits[0]] - time[start])
+            else:
+                assert np.isnan(latencies[y, x])
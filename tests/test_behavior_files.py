@@ -0,0 +1,41 @@
+import numpy as np
+import BehaviorStruct
+from benchmarks import generators
+
+
+def readFiles(paths, withEvents = True):
+    data = BehaviorStruct.BehaviorData()
+    if withEvents:
+        data.readFiles(paths["behavior"], paths["events"], paths["ttl"])
+    else:
+        data.readFiles(paths["behavior"])
+    return data
+
+
+#cleaning needs the video's frame count and fps, which are set here instead of reading a video
+def cleanWithoutVideo(data):
+    data.videoPath = "session.avi"
+    data.fps = 30.0
+    data.trueFrames = len(data.beh_data)
+    data.clean()
+    return data
+
+
+def test_read_files_without_events(tmp_path):
+    paths = generators.behaviorFiles(str(tmp_path), "session", 600)
+    data = readFiles(paths, withEvents=False)
+    assert data.timestamp_data is None and data.beh_TTL is None
+    assert data.control_type is None and data.timestamp_index is None
+    assert data.bodyParts == ["Nose", "Back1", "Tail", "Tongue"]
+    assert data.beh_data.shape == (600, 12)
+    cleanWithoutVideo(data)
+    np.testing.assert_allclose(data.beh_cleaned["Time"].to_numpy(), np.arange(600) / 30.0)
+
+
+def test_read_files_with_events(tmp_path):
+    paths = generators.behaviorFiles(str(tmp_path), "session", 600)
+    data = readFiles(paths)
+    assert data.control_type == "medpc"
+    assert data.timestamp_index is not None
+    cleanWithoutVideo(data)
+    assert list(data.beh_TTL.columns) == ["onset", "offset"]
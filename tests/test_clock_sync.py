@@ -0,0 +1,82 @@
+import numpy as np
+import pandas as pd
+import BehaviorStruct
+import ClockSync
+
+TRIAL_START = 71
+
+
+def test_match_events_nearest_onset_in_event_order():
+    matches, report = ClockSync.matchEvents([30.0, np.nan, 10.0, 50.0], [10.2, 30.3, 50.1, 70.0])
+    np.testing.assert_array_equal(matches["event"].to_numpy(), [0, 1, 2, 3])
+    np.testing.assert_array_equal(matches["ttl"].to_numpy(), [1, np.nan, 0, 2])
+    np.testing.assert_allclose(matches["offset"].to_numpy(), [0.3, np.nan, 0.2, 0.1])
+    assert report["Events"] == 4 and report["Matched"] == 3 and report["Unmatched"] == 1
+    assert report["Duplicate_Matches"] == 0
+
+
+def test_match_events_max_gap():
+    matches, report = ClockSync.matchEvents([10.0, 30.0], [10.2, 30.05], maxGap=0.1)
+    np.testing.assert_array_equal(matches["ttl"].to_numpy(), [np.nan, 1])
+    assert report["Matched"] == 1 and report["Unmatched"] == 1
+    assert np.isnan(report["Drift_PPM"])
+
+
+def test_match_events_duplicate_onset():
+    matches, report = ClockSync.matchEvents([10.0, 10.3, 30.0], [10.2, 30.2])
+    np.testing.assert_array_equal(matches["ttl"].to_numpy(), [0, 0, 1])
+    assert report["Duplicate_Matches"] == 2
+
+
+def test_match_events_drift():
+    events = np.arange(1, 20) * 100.0
+    onsets = events * (1 + 50e-6) + 0.2
+    _, report = ClockSync.matchEvents(events, onsets)
+    np.testing.assert_allclose(report["Drift_PPM"], 50, rtol=1e-6)
+    np.testing.assert_allclose(report["Drift_Intercept"], 0.2, atol=1e-9)
+    assert report["Max_Residual"] < 1e-9
+
+
+#the per-event loop alignEvents replaced: every trial start sets the offset of its closest camera TTL, so when several
+#trial starts share a TTL the last one wins
+def legacyOffsets(ttl, trialStarts):
+    offsets = pd.Series(np.nan, index=ttl.index)
+    for t in trialStarts:
+        closest = ttl["onset"].sub(t).abs().idxmin()
+        offsets[closest] = ttl.at[closest, "onset"] - t
+    return offsets
+
+
+#behavioral session at 10 frames per second whose velocity is the frame time, with camera TTLs indexed from 1 as in the
+#Behavior-TTL sheet. Trial starts at 10 and 10.3 s share the TTL at 10.2 s, and the TTL at 70.2 s matches no trial start
+def behaviorSession(trialStarts = (10.0, 10.3, 30.0, 50.0)):
+    events = pd.DataFrame({"Index": np.arange(len(trialStarts)), "ID": TRIAL_START, "secs": list(trialStarts)})
+    data = BehaviorStruct.BehaviorData(id_eventsDict={"id_trialStart": TRIAL_START}, mpcDF=events)
+    data.formatEvents()
+    data.fps = 10.0
+    time = np.arange(1000) / 10
+    data.beh_cleaned = pd.DataFrame({"Back1_Vel": time, "Time": time})
+    data.beh_TTL = pd.DataFrame({"onset": [10.2, 30.2, 50.2, 70.2], "offset": [11.2, 31.2, 51.2, 71.2]}, index=[1, 2, 3, 4])
+    return data
+
+
+def test_align_events_duplicate_ttl_matches_per_event_loop():
+    data = behaviorSession()
+    expected = legacyOffsets(data.beh_TTL, [10.0, 10.3, 30.0, 50.0])
+    data.alignEvents("Back1_Vel", baseline=1, outcome=1)
+    np.testing.assert_allclose(data.beh_TTL["offset_MPC"].to_numpy(), [-0.1, 0.2, 0.2, np.nan])
+    np.testing.assert_allclose(data.beh_TTL["offset_MPC"].to_numpy(), expected.to_numpy())
+    assert data.beh_stats["Sync_Duplicate_Matches"] == 2 and data.beh_stats["Sync_Matched"] == 4
+    #as in the loop, trials are centered on onset + offset of their closest TTL, so both trial starts sharing a TTL use the
+    #offset of the last one
+    trials = data.beh_alignedTrials["trialStart"].trials[:, :, 0]
+    np.testing.assert_allclose(trials[0], trials[1])
+    np.testing.assert_allclose(trials[0], np.arange(91, 111) / 10)
+    np.testing.assert_allclose(trials[2], np.arange(294, 314) / 10)
+
+
+def test_align_events_unmatched_trial_start():
+    data = behaviorSession((10.0, 30.0, 50.0))
+    data.alignEvents("Back1_Vel", baseline=1, outcome=1, maxGap=0.1)
+    assert np.isnan(data.beh_TTL["offset_MPC"]).all()
+    assert data.beh_stats["Sync_Unmatched"] == 3
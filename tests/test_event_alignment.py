@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+import EventAlignment
+
+#10 samples per second from 0 to 9.9 s, with no samples from 6.1 to 6.9 s. The signal is the sample time
+TIME = np.delete(np.arange(100) / 10, np.arange(61, 70))
+
+
+def test_nearest_index_ties_and_edges():
+    time = np.array([0.0, 1.0, 2.0, 4.0])
+    idx = EventAlignment.nearestIndex(time, [-5, 0.4, 0.5, 0.6, 3.0, 3.1, 9])
+    np.testing.assert_array_equal(idx, [0, 0, 0, 1, 2, 3, 3])
+
+
+def test_align_trials_inside_recording():
+    aligned = EventAlignment.alignTrials(TIME, TIME, [3.0], baseline=1, outcome=1, rate=10)
+    np.testing.assert_allclose(aligned.Time, np.arange(20) / 10 - 1)
+    assert aligned.trials.shape == (1, 20, 1)
+    np.testing.assert_allclose(aligned.trials[0, :, 0], np.arange(20, 40) / 10)
+
+
+#a sample half a sample interval from a point of the time axis is used, ties going to the earlier sample
+def test_align_trials_half_sample_tolerance():
+    aligned = EventAlignment.alignTrials(TIME, TIME, [3.05], baseline=1, outcome=1, rate=10)
+    np.testing.assert_allclose(aligned.trials[0, :, 0], np.arange(20, 40) / 10)
+    #at the edges of the gap, points half a sample from the last sample before it and the first sample after it are used
+    aligned = EventAlignment.alignTrials(TIME, TIME, [6.05], baseline=0, outcome=1, rate=10)
+    expected = np.full(10, np.nan)
+    expected[[0, 9]] = [6.0, 7.0]
+    np.testing.assert_allclose(aligned.trials[0, :, 0], expected)
+    #points just over half a sample from any sample are nan, unless the tolerance is widened
+    aligned = EventAlignment.alignTrials(TIME, TIME, [6.052], baseline=0, outcome=1, rate=10)
+    expected[0] = np.nan
+    np.testing.assert_allclose(aligned.trials[0, :, 0], expected)
+    aligned = EventAlignment.alignTrials(TIME, TIME, [6.052], baseline=0, outcome=1, rate=10, tolerance=0.06)
+    expected[0] = 6.0
+    np.testing.assert_allclose(aligned.trials[0, :, 0], expected)
+
+
+def test_align_trials_nan_pads_gaps_and_recording_edges():
+    aligned = EventAlignment.alignTrials(TIME, TIME, [0.3, 6.5, 9.5], baseline=1, outcome=1, rate=10)
+    trials = aligned.trials[:, :, 0]
+    #the first 7 points of the first trial are before the recording
+    assert np.isnan(trials[0, 0:7]).all()
+    np.testing.assert_allclose(trials[0, 7:], np.arange(0, 13) / 10)
+    #the gap from 6.1 to 6.9 s is nan, not filled with the samples at its edges
+    expected = np.arange(55, 75) / 10
+    expected[(expected > 6.05) & (expected < 6.95)] = np.nan
+    np.testing.assert_allclose(trials[1], expected)
+    #the last 5 points of the last trial are after the recording
+    np.testing.assert_allclose(trials[2, 0:15], np.arange(85, 100) / 10)
+    assert np.isnan(trials[2, 15:]).all()
+
+
+def test_align_trials_several_signals_and_empty_inputs():
+    signals = pd.DataFrame({"a": TIME, "b": -TIME})
+    aligned = EventAlignment.alignTrials(TIME, signals, [2.0, 4.0], baseline=0.5, outcome=0.5)
+    assert aligned.signals == ["a", "b"]
+    np.testing.assert_allclose(aligned.trials[:, :, 1], -aligned.trials[:, :, 0])
+    np.testing.assert_allclose(aligned.trials[1, :, 0], np.arange(35, 45) / 10)
+    empty = EventAlignment.alignTrials(TIME, signals, [], baseline=0.5, outcome=0.5, rate=10)
+    assert empty.trials.shape == (0, 10, 2)
@@ -0,0 +1,104 @@
+import numpy as np
+import pandas as pd
+import pytest
+import BehaviorStruct
+import EventIndex
+import PhotometryStruct
+from benchmarks import generators
+
+TRIAL_START = 71
+
+
+#Med-Pc events with unsorted times, repeated times and missing times
+def medpcFrame(numEvents = 500, seed = 0):
+    rng = np.random.default_rng(seed)
+    secs = np.round(rng.random(numEvents) * 100, 1)
+    secs[rng.random(numEvents) < 0.05] = np.nan
+    return pd.DataFrame({"Index": np.arange(numEvents), "ID": rng.choice([1, 2, 34, TRIAL_START], numEvents), "secs": secs})
+
+
+def test_get_matches_boolean_filter():
+    frame = medpcFrame()
+    index = EventIndex.fromMedPC(frame)
+    for key in [1, 2, 34, TRIAL_START, 99]:
+        expected = frame[frame.ID == key].secs.dropna().to_numpy()
+        np.testing.assert_array_equal(index.get(key), np.sort(expected))
+        assert index.count(key) == len(expected)
+    assert 99 not in index and len(index.get(99)) == 0
+
+
+#between includes both bounds, as the boolean filter (secs >= t0) & (secs <= t1) did
+@pytest.mark.parametrize("t0, t1", [(10.0, 20.0), (10.05, 19.95), (-5, 200), (50.0, 50.0), (20.0, 10.0), (np.nan, 20.0)])
+def test_between_matches_boolean_filter(t0, t1):
+    frame = medpcFrame()
+    index = EventIndex.fromMedPC(frame)
+    for key in [1, 2, 34, TRIAL_START]:
+        expected = frame[(frame.ID == key) & (frame.secs >= t0) & (frame.secs <= t1)].secs.to_numpy()
+        np.testing.assert_array_equal(index.between(key, t0, t1), np.sort(expected))
+
+
+def test_between_includes_repeated_bound_times():
+    index = EventIndex.EventIndex([TRIAL_START] * 5, [1.0, 2.0, 2.0, 3.0, 3.0])
+    np.testing.assert_array_equal(index.between(TRIAL_START, 2.0, 3.0), [2.0, 2.0, 3.0, 3.0])
+
+
+def photometrySession(frame):
+    data = PhotometryStruct.PhotometryData()
+    data.timestamp_data = frame
+    data.eventIndex()
+    return data
+
+
+def trialStarts(frame):
+    return np.sort(frame[frame.ID == TRIAL_START].secs.dropna().to_numpy())
+
+
+def test_get_mpc_times_after_in_place_change():
+    frame = medpcFrame()
+    data = photometrySession(frame)
+    index = data.timestamp_index
+    row = int(np.flatnonzero((frame.ID == TRIAL_START).to_numpy())[3])
+    frame.loc[row, "secs"] = 1234.5
+    np.testing.assert_array_equal(data.getMPCTimes(TRIAL_START), trialStarts(frame))
+    assert data.getMPCTimes(TRIAL_START)[-1] == 1234.5 and data.timestamp_index is not index
+    #a changed event ID moves its time to the other event
+    frame.iloc[row, frame.columns.get_loc("ID")] = 34
+    assert 1234.5 not in data.getMPCTimes(TRIAL_START) and 1234.5 in data.getMPCTimes(34)
+
+
+def test_get_mpc_times_after_assigned_column_and_appended_rows():
+    frame = medpcFrame()
+    data = photometrySession(frame)
+    frame["secs"] = frame["secs"] + 1
+    np.testing.assert_array_equal(data.getMPCTimes(TRIAL_START), trialStarts(frame))
+    data.timestamp_data = pd.concat([frame, pd.DataFrame({"Index": [500], "ID": [TRIAL_START], "secs": [500.0]})], ignore_index=True)
+    assert data.getMPCTimes(TRIAL_START)[-1] == 500.0
+
+
+def test_unchanged_table_keeps_index():
+    data = photometrySession(medpcFrame())
+    index = data.timestamp_index
+    data.getMPCTimes(TRIAL_START)
+    data.timestamp_data.loc[0, "Index"] = -1
+    data.getMPCTimes(TRIAL_START)
+    assert data.timestamp_index is index
+
+
+#tables of more than FULL_ROWS rows are only compared on sampled rows, which is enough for changes to the sampled rows
+def test_large_table_change_on_sampled_row():
+    frame = medpcFrame(EventIndex.FULL_ROWS + 1)
+    data = photometrySession(frame)
+    frame.loc[0, ["ID", "secs"]] = [TRIAL_START, -1.0]
+    assert data.getMPCTimes(TRIAL_START)[0] == -1.0
+
+
+def test_get_event_times_after_in_place_change():
+    data = BehaviorStruct.BehaviorData(mpcDF=generators.brainmataEvents(600))
+    data.formatEvents()
+    assert data.control_type == "brainmata"
+    index = data.timestamp_index
+    data.timestamp_data.loc[3, "TONE_timestamp"] = -3.0
+    np.testing.assert_array_equal(data.getEventTimes("TONE_timestamp"), np.sort(data.timestamp_data["TONE_timestamp"].dropna().to_numpy()))
+    assert data.getEventTimes("TONE_timestamp")[0] == -3.0 and data.timestamp_index is not index
+    with pytest.raises(KeyError):
+        data.getEventTimes("TONE")
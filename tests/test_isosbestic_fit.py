@@ -0,0 +1,28 @@
+import numpy as np
+import IsosbesticFit
+
+
+def test_irls_perfectly_linear_pair():
+    X = np.linspace(1, 2, 200)
+    slope, intercept = IsosbesticFit.fitIRLS(X, 3 * X + 0.5)
+    np.testing.assert_allclose(slope, [3])
+    np.testing.assert_allclose(intercept, [0.5])
+
+
+def test_irls_linear_pair_with_outlier():
+    X = np.linspace(1, 2, 200)
+    Y = 3 * X + 0.5
+    Y[50] += 10
+    slope, intercept = IsosbesticFit.fitIRLS(X, Y)
+    np.testing.assert_allclose(slope, [3])
+    np.testing.assert_allclose(intercept, [0.5])
+
+
+def test_irls_degenerate_column_does_not_affect_others():
+    rng = np.random.default_rng(0)
+    X = np.column_stack([np.linspace(1, 2, 500), rng.normal(1, 0.1, 500)])
+    Y = np.column_stack([2 * X[:, 0] + 1, 1.5 * X[:, 1] + 0.2 + rng.normal(0, 0.01, 500)])
+    slope, intercept = IsosbesticFit.fitIRLS(X, Y)
+    assert np.all(np.isfinite(slope)) and np.all(np.isfinite(intercept))
+    np.testing.assert_allclose(slope[0], 2)
+    np.testing.assert_allclose(slope[1], 1.5, atol=0.05)
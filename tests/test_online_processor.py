@@ -0,0 +1,128 @@
+import logging
+import threading
+import warnings
+import numpy as np
+import pandas as pd
+import pytest
+import IsosbesticFit
+import OnlineProcessor
+import PhotometryStruct
+from benchmarks import generators
+
+TRIAL_START = 71
+
+
+def test_welford_matches_nanmean_and_nanstd():
+    rng = np.random.default_rng(0)
+    trials = rng.normal(size=(30, 50, 3))
+    trials[rng.random(trials.shape) < 0.2] = np.nan
+    #a point with data in one trial only, and one with no data at all
+    trials[1:, 0, 0] = np.nan
+    trials[:, 1, 0] = np.nan
+    accumulator = OnlineProcessor.Welford(trials.shape[1:])
+    for trial in trials:
+        accumulator.update(trial)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        mean = np.nanmean(trials, axis=0)
+        sd = np.nanstd(trials, axis=0, ddof=1)
+    np.testing.assert_allclose(accumulator.average(), mean, rtol=1e-12)
+    np.testing.assert_allclose(accumulator.sd(), sd, rtol=1e-10)
+    np.testing.assert_array_equal(accumulator.count, (~np.isnan(trials)).sum(axis=0))
+    assert accumulator.updates == 30
+    assert np.isnan(accumulator.sd()[0, 0]) and np.isnan(accumulator.average()[1, 0])
+
+
+#batches of every size, including single samples and a batch where one pair has no valid sample
+@pytest.mark.parametrize("cuts", [[], [1, 2, 3], [500, 501], list(range(0, 4000, 7)), [100, 1000, 1010, 3999]])
+def test_running_fit_matches_ols(cuts):
+    rng = np.random.default_rng(1)
+    X = rng.normal(2, 0.3, size=(4000, 3)) + np.array([0, 100, -5])
+    Y = np.array([1.5, -0.5, 3]) * X + np.array([0.2, 40, 1]) + rng.normal(0, 0.1, size=X.shape)
+    X[rng.random(X.shape) < 0.05] = np.nan
+    Y[rng.random(Y.shape) < 0.05] = np.nan
+    X[0:600, 2] = np.nan
+    fit = OnlineProcessor.RunningFit(3)
+    for batchX, batchY in zip(np.split(X, cuts), np.split(Y, cuts)):
+        fit.update(batchX, batchY)
+    slope, intercept = fit.params()
+    expectedSlope, expectedIntercept = IsosbesticFit.fitOLS(X, Y)
+    np.testing.assert_allclose(slope, expectedSlope, rtol=1e-9)
+    np.testing.assert_allclose(intercept, expectedIntercept, rtol=1e-9)
+
+
+def test_running_fit_without_enough_samples():
+    fit = OnlineProcessor.RunningFit(2)
+    assert np.isnan(fit.params()[0]).all()
+    fit.update([[1.0, np.nan]], [[2.0, 1.0]])
+    fit.update([[1.0, np.nan]], [[3.0, 1.0]])
+    #two samples of the same isosbestic value, and no valid sample
+    assert np.isnan(fit.params()[0]).all()
+
+
+#replays a recording into .csv files at 100 times real time while watch's TailSource processes them as they are written.
+#maxEventDelay covers events read up to a few polls after the samples around them on a slow machine
+def replayAndWatch(tmp_path, samples, events, type, baseline = 5, outcome = 5):
+    samplesPath, eventsPath = str(tmp_path / "live.csv"), str(tmp_path / "live_events.csv")
+    sink = OnlineProcessor.FileSink(samplesPath, eventsPath)
+    replay = threading.Thread(target=OnlineProcessor.replay, args=(samples, sink, events), kwargs={"speed": 100, "batchSeconds": 1})
+    processor = OnlineProcessor.OnlineProcessor(type=type, events={"id_trialStart": TRIAL_START}, baseline=baseline, outcome=outcome,
+                                                maxEventDelay=30)
+    source = OnlineProcessor.TailSource(samplesPath, eventsPath)
+    replay.start()
+    try:
+        averages = processor.run(source, idleTimeout=1, logInterval=None, pollTimeout=0.05)
+    finally:
+        replay.join()
+    return processor, averages
+
+
+def test_replay_and_watch_continuous(tmp_path):
+    samples = generators.rwdFrame(30000)
+    events = generators.medpcEvents(samples["Timestamp"].iloc[-1])
+    processor, averages = replayAndWatch(tmp_path, samples, events, "continuous")
+    numTrials = int((events["ID"] == TRIAL_START).sum())
+    assert processor.samplesIn == len(samples) and len(processor.pending) == 0
+    assert processor.accumulators["trialStart"].updates == numTrials
+    #the running fit over the whole recording is the batch fit of every sample
+    pairs = processor.data.channelPairs
+    renamed = processor.data.renameColumns(samples)
+    expectedSlope, expectedIntercept = IsosbesticFit.fitOLS(renamed[list(pairs.isosbestic)].to_numpy(), renamed[list(pairs.signal)].to_numpy())
+    slope, intercept = processor.fit.params()
+    np.testing.assert_allclose(slope, expectedSlope, rtol=1e-9)
+    np.testing.assert_allclose(intercept, expectedIntercept, rtol=1e-9)
+    average = averages["trialStart"]
+    np.testing.assert_allclose(average["Time"].to_numpy(), np.arange(1000) / 100 - 5, atol=1e-9)
+    assert average["Trials"].max() == numTrials
+    assert np.isfinite(average["Average"]).all() and (average["Average"] > 0).all()
+
+
+def test_replay_and_watch_pulsed(tmp_path):
+    samples = generators.doricFrame(20000)
+    events = generators.medpcEvents(samples["Time(s)"].iloc[-1])
+    #pulsed recordings are averaged per 10 s recording window, so trials span several windows
+    processor, averages = replayAndWatch(tmp_path, samples, events, "pulsed", baseline=30, outcome=30)
+    #without session bounds the windows and the samples kept in them are those of a batch clean
+    batch = PhotometryStruct.PhotometryData(type="pulsed")
+    batch.pt_raw = samples
+    batch.clean()
+    assert processor.windows == batch.pt_cleaned["Window"].max() + 1
+    expectedSlope, expectedIntercept = IsosbesticFit.fitOLS(batch.pt_cleaned[["_405"]].to_numpy(), batch.pt_cleaned[["_465"]].to_numpy())
+    slope, intercept = processor.fit.params()
+    np.testing.assert_allclose(slope, expectedSlope, rtol=1e-9)
+    np.testing.assert_allclose(intercept, expectedIntercept, rtol=1e-9)
+    assert processor.accumulators["trialStart"].updates == int((events["ID"] == TRIAL_START).sum())
+    average = averages["trialStart"]
+    assert len(average) == 6 and average["Trials"].min() > 0
+    assert np.isfinite(average["Average"]).all()
+
+
+def test_finish_drops_trials_without_samples(caplog):
+    processor = OnlineProcessor.OnlineProcessor(events={"id_trialStart": TRIAL_START})
+    processor.addSamples(generators.doricFrame(1, pulsed=False))
+    processor.addEvents(pd.DataFrame({"ID": [TRIAL_START, TRIAL_START], "secs": [1.0, 2.0]}))
+    assert len(processor.pending) == 2
+    with caplog.at_level(logging.WARNING, logger="pypline.online"):
+        averages = processor.finish()
+    assert len(processor.pending) == 0 and averages == {}
+    assert "2 trial(s) were not averaged" in caplog.text
@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+import pytest
+import PhotometryStruct
+from benchmarks import generators
+
+
+def cleanedData(frame, type):
+    data = PhotometryStruct.PhotometryData(type=type, id_eventsDict={"id_sessionStart": 1, "id_sessionEnd": 2, "id_trialStart": 71})
+    data.pt_raw = frame
+    data.timestamp_data = generators.medpcEvents(frame.iloc[-1, 0])
+    data.clean()
+    return data
+
+
+@pytest.mark.parametrize("type, frame", [("pulsed", generators.doricFrame(20000)),
+                                         ("continuous", generators.doricFrame(20000, pulsed=False)),
+                                         ("continuous", generators.rwdFrame(20000))])
+def test_clean_leaves_raw_data_unchanged(type, frame):
+    original = frame.copy(deep=True)
+    data = cleanedData(frame, type)
+    data.filterSignals(lowpass=5)
+    data.normalize(method="ols")
+    data.binData(binSize=None if type == "pulsed" else 1)
+    pd.testing.assert_frame_equal(data.pt_raw, original)
+
+
+def test_cleaned_data_does_not_share_writes_with_raw_data():
+    data = cleanedData(generators.doricFrame(20000, pulsed=False), "continuous")
+    value = data.pt_raw.iloc[0, 1]
+    data.pt_cleaned.iloc[0, 1] = 0
+    assert data.pt_raw.iloc[0, 1] == value
+
+
+def test_locked_frame_cannot_be_written():
+    frame = PhotometryStruct.lockFrame(pd.DataFrame({"Time(s)": np.arange(5.0), "AIn-1 - Dem (AOut-1)": np.ones(5)}))
+    with pytest.raises(ValueError):
+        frame.iloc[0, 1] = 0
+    assert frame.iloc[0, 1] == 1
@@ -0,0 +1,94 @@
+import numpy as np
+import pandas as pd
+import PhotometryStruct
+
+#hand-built pulsed recording: a window which started before the recording (3 samples), a full window of 8 samples whose last
+#sample has the laser off, a single-sample window and a window of 6 samples which ends with the recording
+TIMES = np.concatenate([[0.000, 0.001, 0.002], 10 + np.arange(8) / 1000, [20.0], 30 + np.arange(6) / 1000])
+WINDOWS = np.array([0, 0, 0] + [1] * 8 + [2] + [3] * 6)
+
+
+def pulsedFrame():
+    signal = 100 * TIMES
+    signal[10] = 0
+    return pd.DataFrame({"Time(s)": TIMES, "AIn-1 - Dem (AOut-1)": np.ones(len(TIMES)), "AIn-1 - Dem (AOut-2)": signal,
+                         "DI/O-3": np.ones(len(TIMES)), "DI/O-4": np.zeros(len(TIMES))})
+
+
+def test_segment_windows_ids_and_trim():
+    windowId, keep = PhotometryStruct.segmentWindows(TIMES, gap=1, trim=2)
+    np.testing.assert_array_equal(windowId, WINDOWS)
+    #first and last 2 samples of every window are dropped, so windows of up to 4 samples are dropped entirely
+    np.testing.assert_array_equal(np.flatnonzero(keep), [5, 6, 7, 8, 14, 15])
+
+
+def test_segment_windows_single_sample_window():
+    windowId, keep = PhotometryStruct.segmentWindows(TIMES, gap=1, trim=0)
+    np.testing.assert_array_equal(windowId, WINDOWS)
+    assert keep.all()
+    _, keep = PhotometryStruct.segmentWindows(TIMES, gap=1, trim=1)
+    assert not keep[11]
+    np.testing.assert_array_equal(np.flatnonzero(keep), [1, 4, 5, 6, 7, 8, 9, 13, 14, 15, 16])
+
+
+def test_segment_windows_without_jumps():
+    windowId, keep = PhotometryStruct.segmentWindows(np.arange(5) / 1000)
+    np.testing.assert_array_equal(windowId, np.zeros(5))
+    np.testing.assert_array_equal(keep, [False, False, True, False, False])
+
+
+def test_clean_keeps_trimmed_samples_of_full_windows():
+    data = PhotometryStruct.PhotometryData(type="pulsed")
+    data.pt_raw = pulsedFrame()
+    data.clean()
+    #the first window started before the recording and the single-sample window is trimmed away. The laser-off sample is
+    #removed before trimming, so the second window is trimmed as 7 samples
+    np.testing.assert_allclose(data.pt_cleaned["Time"].to_numpy(), [10.002, 10.003, 10.004, 30.002, 30.003])
+    np.testing.assert_array_equal(data.pt_cleaned["Window"].to_numpy(), [0, 0, 0, 2, 2])
+    np.testing.assert_array_equal(data.pt_cleaned["StartIdx"].to_numpy(), [True, False, False, True, False])
+
+
+def test_bin_data_of_cleaned_windows():
+    data = PhotometryStruct.PhotometryData(type="pulsed")
+    data.pt_raw = pulsedFrame()
+    data.clean()
+    data.binData()
+    binned = data.pt_binned
+    np.testing.assert_array_equal(binned["Window"].to_numpy(), [0, 2])
+    np.testing.assert_array_equal(binned["Samples"].to_numpy(), [3, 2])
+    np.testing.assert_allclose(binned["Time"].to_numpy(), [10.003, 30.0025])
+    np.testing.assert_allclose(binned["StartTime"].to_numpy(), [10.002, 30.002])
+    np.testing.assert_allclose(binned["EndTime"].to_numpy(), [10.004, 30.003])
+    np.testing.assert_allclose(binned["_465"].to_numpy(), [1000.3, 3000.25])
+    np.testing.assert_allclose(binned["_465_median"].to_numpy(), [1000.3, 3000.25])
+    np.testing.assert_allclose(binned["_465_SD"].to_numpy(), [0.1, np.sqrt(0.005)])
+    np.testing.assert_allclose(binned["_405"].to_numpy(), [1, 1])
+
+
+def test_bin_windows_single_sample_and_nan():
+    signals = pd.DataFrame({"a": [1.0, 2.0, np.nan, 5.0, 7.0, 9.0], "b": [np.nan, np.nan, np.nan, 1.0, 2.0, 4.0]})
+    binned = PhotometryStruct.binWindows(np.arange(6.0), np.array([0, 0, 0, 1, 2, 2]), signals)
+    np.testing.assert_array_equal(binned["Window"].to_numpy(), [0, 1, 2])
+    np.testing.assert_array_equal(binned["Samples"].to_numpy(), [3, 1, 2])
+    np.testing.assert_allclose(binned["Time"].to_numpy(), [1, 3, 4.5])
+    np.testing.assert_allclose(binned["a"].to_numpy(), [1.5, 5, 8])
+    np.testing.assert_allclose(binned["a_median"].to_numpy(), [1.5, 5, 8])
+    np.testing.assert_allclose(binned["a_SD"].to_numpy(), [np.sqrt(0.5), np.nan, np.sqrt(2)])
+    np.testing.assert_allclose(binned["b"].to_numpy(), [np.nan, 1, 3])
+    np.testing.assert_allclose(binned["b_SD"].to_numpy(), [np.nan, np.nan, np.sqrt(2)])
+
+
+#means, medians and SDs of every window match a pandas groupby over the same windows, as the per-window means did
+def test_bin_windows_matches_groupby():
+    rng = np.random.default_rng(0)
+    windowId = np.repeat(np.arange(20), rng.integers(1, 30, 20))
+    signals = pd.DataFrame(rng.normal(size=(len(windowId), 3)), columns=["_405", "_465", "norm"])
+    signals.iloc[rng.random(len(windowId)) < 0.1, 1] = np.nan
+    time = np.arange(len(windowId)) / 100
+    binned = PhotometryStruct.binWindows(time, windowId, signals)
+    groups = signals.groupby(windowId)
+    np.testing.assert_allclose(binned["Time"].to_numpy(), pd.Series(time).groupby(windowId).mean().to_numpy())
+    for col in signals.columns:
+        np.testing.assert_allclose(binned[col].to_numpy(), groups[col].mean().to_numpy())
+        np.testing.assert_allclose(binned[col + "_median"].to_numpy(), groups[col].median().to_numpy())
+        np.testing.assert_allclose(binned[col + "_SD"].to_numpy(), groups[col].std(ddof=1).to_numpy())
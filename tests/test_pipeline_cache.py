@@ -0,0 +1,85 @@
+import os
+import subprocess
+import sys
+import numpy as np
+import pandas as pd
+import PipelineDAG
+from benchmarks import generators
+
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+#runs the behavior pipeline of the files given on the command line against a stage cache directory and pickles the
+#aligned output and how every stage was obtained. The video is not read, its frame count and fps are set from the data
+RUN_PIPELINE = """
+import pickle, sys
+sys.path[:0] = [sys.argv[1]]
+import BehaviorStruct, PipelineDAG
+def readVideo(self, refreshCache = False):
+    self.fps = 30.0
+    self.trueFrames = len(self.beh_data)
+BehaviorStruct.BehaviorData.readVideo = readVideo
+behaviorPath, eventsPath, ttlPath, videoPath, cacheDir, outPath = sys.argv[2:8]
+cache = PipelineDAG.StageCache(cacheDir=cacheDir)
+pipeline = PipelineDAG.behaviorPipeline(behaviorPath=behaviorPath, eventsPath=eventsPath, ttlPath=ttlPath, videoPath=videoPath,
+                                        events={"id_trialStart": 71}, cache=cache)
+pipeline.set("boolean", parts=["Tongue_x"])
+pipeline.set("align", part="Back1_Vel")
+data = pipeline.run()
+with open(outPath, "wb") as f:
+    pickle.dump({"lastRun": pipeline.lastRun, "beh_TTL": data.beh_TTL, "beh_cleaned": data.beh_cleaned,
+                 "aligned": data.beh_alignedEvents}, f)
+"""
+
+
+def runPipeline(paths, cacheDir, outPath):
+    subprocess.run([sys.executable, "-c", RUN_PIPELINE, REPOSITORY, paths["behavior"], paths["events"], paths["ttl"],
+                    paths["video"], cacheDir, outPath], check=True)
+    return pd.read_pickle(outPath)
+
+
+def test_behavior_pipeline_reloads_from_disk_in_a_new_process(tmp_path):
+    paths = generators.behaviorFiles(str(tmp_path), "session", 3000)
+    paths["video"] = str(tmp_path / "session.avi")
+    open(paths["video"], "wb").close()
+    cacheDir = str(tmp_path / "stages")
+    cold = runPipeline(paths, cacheDir, str(tmp_path / "cold.pkl"))
+    warm = runPipeline(paths, cacheDir, str(tmp_path / "warm.pkl"))
+    assert set(cold["lastRun"].values()) == {"run"}
+    assert warm["lastRun"] == {"read": "run", "clean": "disk", "boolean": "disk", "align": "disk", "annotate": "disk"}
+    pd.testing.assert_frame_equal(warm["beh_TTL"], cold["beh_TTL"])
+    pd.testing.assert_frame_equal(warm["beh_cleaned"], cold["beh_cleaned"])
+    assert list(warm["aligned"]) == list(cold["aligned"])
+    for name in cold["aligned"]:
+        pd.testing.assert_frame_equal(warm["aligned"][name], cold["aligned"][name])
+
+
+#stages run again on top of stages loaded from disk, e.g. after their own entries were evicted
+def test_every_behavior_stage_reloads_from_disk(tmp_path):
+    paths = generators.behaviorFiles(str(tmp_path), "session", 3000)
+    paths["video"] = str(tmp_path / "session.avi")
+    open(paths["video"], "wb").close()
+    cacheDir = str(tmp_path / "stages")
+    cold = runPipeline(paths, cacheDir, str(tmp_path / "cold.pkl"))
+    #drop the entries of the last two stages, so the clean and boolean stages are loaded from disk and the rest run again
+    for entry in os.listdir(cacheDir):
+        if entry.startswith("align_") or entry.startswith("annotate_"):
+            os.remove(os.path.join(cacheDir, entry))
+    warm = runPipeline(paths, cacheDir, str(tmp_path / "warm.pkl"))
+    assert warm["lastRun"] == {"read": "run", "clean": "disk", "boolean": "disk", "align": "run", "annotate": "run"}
+    pd.testing.assert_frame_equal(warm["beh_TTL"], cold["beh_TTL"])
+    for name in cold["aligned"]:
+        pd.testing.assert_frame_equal(warm["aligned"][name], cold["aligned"][name])
+
+
+def test_changed_tables_include_renamed_columns():
+    base = PipelineDAG.snapshot(type("Data", (), {})())
+    base.table = pd.DataFrame({"a": np.arange(3.0), "b": np.arange(3.0)})
+    base.array = np.arange(3.0)
+    value = PipelineDAG.snapshot(base)
+    assert PipelineDAG.changedTables(value, base) == []
+    value.table.columns = ["onset", "offset"]
+    assert PipelineDAG.changedTables(value, base) == ["table"]
+    value = PipelineDAG.snapshot(base)
+    value.table.iloc[1, 0] = np.nan
+    value.array = value.array + 1
+    assert PipelineDAG.changedTables(value, base) == ["table", "array"]
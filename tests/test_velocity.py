@@ -0,0 +1,100 @@
+import math
+import numpy as np
+import pandas as pd
+import BehaviorStruct
+import VelocityEngine
+from benchmarks import generators
+
+
+#the per-frame BehaviorData.calcVel loop which VelocityEngine replaced, as it was written
+def legacyCalcVel(df, movingAverage = False, threshold = 100):
+    vel = np.array([])
+    vel = np.append(vel, 0)
+    locomotion = float(0)
+    for x in range(1, int(df.shape[0])):
+        dist = math.dist((df.iloc[x-1, 0], df.iloc[x-1, 1]), (df.iloc[x, 0], df.iloc[x, 1]))
+        if dist >= threshold:
+            vel = np.append(vel, np.nan)
+        else:
+            if np.isnan(dist) is False or math.isnan(dist) is False:
+                locomotion = locomotion + dist
+            vel = np.append(vel, dist)
+    if movingAverage == True:
+        test = np.convolve(vel, np.ones(10), 'valid') / 10
+        test = np.concatenate([[0, 0, 0, 0, 0], test, [0, 0, 0, 0, 0]])
+        return test, locomotion
+    return vel, locomotion
+
+
+#DeepLabCut session read from generated files and cleaned, with the video's frame count and fps set instead of read
+def cleanedSession(tmp_path, numFrames = 400):
+    paths = generators.behaviorFiles(str(tmp_path), "session", numFrames)
+    data = BehaviorStruct.BehaviorData()
+    data.readFiles(paths["behavior"], paths["events"], paths["ttl"])
+    data.videoPath = "session.avi"
+    data.fps = 30.0
+    data.trueFrames = numFrames
+    data.clean()
+    return data
+
+
+#random walk, with dropped frames (nan) and tracking jumps past the threshold unless clean is True
+def walk(numFrames = 300, seed = 0, clean = False):
+    rng = np.random.default_rng(seed)
+    coords = np.cumsum(rng.normal(0, 3, size=(numFrames, 2)), axis=0) + 300
+    if not clean:
+        coords[[40, 41, 150]] += 500
+        coords[rng.random(numFrames) < 0.05] = np.nan
+    return pd.DataFrame(coords, columns=["x", "y"])
+
+
+def test_clean_velocity_matches_per_frame_loop(tmp_path):
+    data = cleanedSession(tmp_path)
+    pose = data.pose()
+    assert np.isnan(data.beh_pose[:, :, 0]).any()
+    for part in data.bodyParts:
+        vel, locomotion = legacyCalcVel(pose[part][["x", "y"]])
+        np.testing.assert_allclose(data.beh_cleaned[part + "_Vel"].to_numpy(), vel, rtol=1e-12, equal_nan=True)
+        np.testing.assert_allclose(data.beh_stats[part + "_Total_Locomotion"], locomotion, rtol=1e-12)
+
+
+def test_calc_vel_matches_per_frame_loop():
+    df = walk()
+    vel, locomotion = BehaviorStruct.BehaviorData().calcVel(df)
+    refVel, refLocomotion = legacyCalcVel(df)
+    np.testing.assert_allclose(vel, refVel, rtol=1e-12, equal_nan=True)
+    np.testing.assert_allclose(locomotion, refLocomotion, rtol=1e-12)
+    assert np.isnan(vel[[41, 151]]).all()
+
+
+#without nan frames the moving average is the old one, with one sample less of padding at the end
+def test_moving_average_without_nan_matches_per_frame_loop():
+    df = walk(clean=True)
+    vel, locomotion = BehaviorStruct.BehaviorData().calcVel(df, movingAverage=True)
+    refVel, refLocomotion = legacyCalcVel(df, movingAverage=True)
+    assert len(refVel) == len(vel) + 1
+    np.testing.assert_allclose(vel, refVel[:-1], rtol=1e-9, atol=1e-12)
+    np.testing.assert_allclose(locomotion, refLocomotion, rtol=1e-12)
+
+
+#with nan frames, windows the old moving average left as nan are averaged over their non-nan frames
+def test_moving_average_skips_nan_frames():
+    df = walk()
+    vel, _ = BehaviorStruct.BehaviorData().calcVel(df, movingAverage=True)
+    refVel, _ = legacyCalcVel(df, movingAverage=True)
+    raw, _ = legacyCalcVel(df)
+    refVel = refVel[:-1]
+    finite = ~np.isnan(refVel)
+    assert (~finite).sum() > 10
+    np.testing.assert_allclose(vel[finite], refVel[finite], rtol=1e-9, atol=1e-12)
+    for x in np.flatnonzero(~finite):
+        np.testing.assert_allclose(vel[x], np.nanmean(raw[x - 5:x + 5]), rtol=1e-9)
+
+
+def test_engine_processes_parts_like_single_parts():
+    coords = np.stack([walk(seed=x).to_numpy() for x in range(3)], axis=1)
+    vel, locomotion = VelocityEngine.calcVelocity(coords, movingAverage=True)
+    for x in range(3):
+        partVel, partLocomotion = VelocityEngine.calcVelocity(coords[:, x, :], movingAverage=True)
+        np.testing.assert_allclose(vel[:, x], partVel, equal_nan=True)
+        np.testing.assert_allclose(locomotion[x], partLocomotion, rtol=1e-12)